@@ -1,4 +1,8 @@
 from .app import OptimalLoc
+from .batch import Scenario, run_scenarios
 from .bash_command import visualize
+from .distances import DistanceMatrix
+from .store import DistanceStore
+from .streaming import HexagonCounter
 
 __version__ = "0.1.7"
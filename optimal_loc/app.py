@@ -1,70 +1,273 @@
-from numpy import array, meshgrid, nan, percentile
-from pandas import DataFrame, pivot_table
+from time import perf_counter
+
+from numpy import (
+    add, arange, argmin, array, asarray, bincount, errstate, flatnonzero, inf, isfinite, ix_, maximum, select, unique,
+    where, zeros
+)
+from pandas import DataFrame, Index, concat
 from pymongo.mongo_client import MongoClient
-from h3 import geo_to_h3, h3_to_geo, edge_length
-import pickle
-from pulp import LpProblem, LpMinimize, LpVariable, lpSum, PULP_CBC_CMD
-from folium import plugins, Map, CircleMarker, Marker, Icon
+from pulp import LpElement
+from folium import plugins, Map
+from h3 import h3_get_resolution
 
 
 from optimal_loc.app_constants import (
-    HEX_LAT, FROMHEX, TOHEX, HEX_LOCATION, SUPPLY_HEXAGON_ID, TOTAL_EVENT, HEX_ID, HEX_LON, HEXAGON_ID, LATITUDE,
-    LONGITUDE, FROMHEX_LAT, FROMHEX_LON, HEXAGON, FILENAME, DISTANCE, SUPPLY_DATA_COLUMN, OPTIMAL_DATA_COLUMN, INDEX
+    HEX_LAT, SUPPLY_HEXAGON_ID, TOTAL_EVENT, HEX_LON, HEXAGON_ID, SUPPLY_DATA_COLUMN, OPTIMAL_DATA_COLUMN,
+    NUMBER_OF_LOC, OBJECTIVE, LOWER_BOUND, GAP, SECONDS, SERVED_EVENTS, MEAN_DISTANCE, MAX_DISTANCE, CHANGE, OPENED,
+    CLOSED, KEPT, COVERED, COVERED_EVENTS
+)
+from optimal_loc.indexing import (
+    AUTO_MAX_HEXAGONS, DEFAULT_CHUNK_SIZE, auto_resolution_counts, cells_to_strings, count_events,
+    event_frequency_table, frequency_table, geo_to_cells, select_auto_resolution, strings_to_cells
+)
+from optimal_loc.coverage import (
+    MAX_COVERAGE, SET_COVER, CoverageModel, radius_coverage_pairs, ring_coverage_pairs, solve_coverage
+)
+from optimal_loc.decomposition import (
+    DEFAULT_MAX_PARTITION_SIZE, nearest_site_assignment, partition_labels, solve_partitions
 )
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.heuristics import PMedianSolution
+from optimal_loc.hierarchy import (
+    N_CANDIDATES, N_HEXAGONS, N_VARIABLES, RESOLUTION, STATUS, candidate_positions, expand_sites, level_tables
+)
+from optimal_loc.maps import DEFAULT_MAX_CELLS, coarsen_hexagons, frequency_colours, hexagon_layer, map_center
+from optimal_loc.mongo import DEFAULT_BATCH_SIZE, read_distance_frame
+from optimal_loc.optimization import (
+    PMedianModel, candidate_pairs, check_candidate_pairs, solve_model, sweep_p_median
+)
+from optimal_loc.profiling import (
+    DISTANCE_MATRIX, EXTRACTION, INDEXING, MODEL_BUILDING, PIVOTING, SOLVING, RunProfile
+)
+from optimal_loc.results import RESULTS_DIR, ResultStore
+from optimal_loc.store import DistanceStore, missing_blocks
+from optimal_loc.streaming import HexagonCounter, chunk_coordinates
 
+HEX_SIZE_RESOLUTIONS = {'medium': 8, 'big': 5, 'small': 10}
 
-def set_resolution(raw_data: DataFrame, hex_size: str):
-    if hex_size == 'medium':
-        resolution = 8
-    elif hex_size == 'big':
-        resolution = 5
-    elif hex_size == 'small':
-        resolution = 10
-    else:
-        resolution_set = 0
-        resolution = 15
-        while resolution_set == 0:
-            if raw_data.apply(lambda x: geo_to_h3(x[LATITUDE], x[LONGITUDE], resolution), 1).nunique() < 150:
-                resolution_set = 1
-            else:
-                resolution = resolution - 1
+
+def set_resolution(raw_data: DataFrame, hex_size: str, max_hexagons: int = AUTO_MAX_HEXAGONS, **kwargs):
+    """
+    Returns the H3 resolution for the given hexagon size.
+
+    With hex_size='auto' (or anything other than small, medium and big) the points are indexed once at
+    resolution 15 and rolled up to parent cells until fewer than `max_hexagons` hexagons remain.
+    H3 parents do not tile their children exactly, so the rolled up counts are only used to pick the resolution.
+    Keyword arguments go to `optimal_loc.indexing.geo_to_cells`.
+    """
+    if hex_size in HEX_SIZE_RESOLUTIONS:
+        return HEX_SIZE_RESOLUTIONS[hex_size]
+    resolution, _, _ = auto_resolution_counts(raw_data, max_hexagons, **kwargs)
     return resolution
 
 
+def _pulp_assignment(pulp_solution, hexagon_ids):
+    # The "X_<supply>_<demand>" names are split where both sides are known (PuLP-sanitised) ids, so ids containing
+    # "_" are recovered too, and the variable order of the problem does not matter.
+    sanitised = {str(hexagon_id).translate(LpElement.trans): position
+                 for position, hexagon_id in enumerate(hexagon_ids)}
+    variables = [v for v in pulp_solution.variables() if v.name.startswith("X_")]
+    values = array([v.varValue or 0.0 for v in variables])
+    supply_positions = []
+    demand_positions = []
+    for variable in (variables[i] for i in flatnonzero(values > 0.5)):
+        pair = variable.name[2:]
+        for split in (i for i, character in enumerate(pair) if character == "_"):
+            if pair[:split] in sanitised and pair[split + 1:] in sanitised:
+                supply_positions.append(sanitised[pair[:split]])
+                demand_positions.append(sanitised[pair[split + 1:]])
+                break
+    return asarray(supply_positions, dtype=int), asarray(demand_positions, dtype=int)
+
+
+def solution_tables(pulp_solution, frequency_data: DataFrame, distances=None, candidates=None):
+    """
+    Builds the "optimal_data" and "supply_data" tables of a solution, see 'OptimalLoc.prepare_data_tables'.
+
+    Parameters:
+        pulp_solution: A PMedianSolution, or a solved PuLP problem with "X_<supply>_<demand>" variables.
+        frequency_data (DataFrame): The hexagons the solution positions refer to.
+        distances (ndarray): Optional (supply, demand) distance matrix in the order of frequency_data, or the
+            distance of every demand hexagon to its site, for the "mean_distance" and "max_distance" statistics.
+        candidates (ndarray): Positions in frequency_data of the supply rows of a PMedianSolution, when the model
+            only had some hexagons as candidate supplies. The rows of `distances` are these candidates then.
+
+    Returns:
+        tuple: (optimal_data, supply_data)
+
+    Note:
+        Every table is built from the (supply position, demand position) arrays of the assignment with array
+        indexing, and the per site statistics with one bincount each. "served_events" is the number of events of
+        the demand hexagons a site serves, "mean_distance" their event weighted mean distance to the site and
+        "max_distance" the distance to its furthest demand hexagon.
+    """
+    hexagon_ids = frequency_data[HEXAGON_ID].to_numpy()
+    if isinstance(pulp_solution, PMedianSolution):
+        supply_rows = asarray(pulp_solution.assignment)
+        demand_positions = arange(len(hexagon_ids))
+    else:
+        supply_rows, demand_positions = _pulp_assignment(pulp_solution, hexagon_ids)
+    supply_positions = supply_rows if candidates is None else asarray(candidates)[supply_rows]
+
+    optimal_data = DataFrame({SUPPLY_HEXAGON_ID: hexagon_ids[supply_positions],
+                              HEXAGON_ID: hexagon_ids[demand_positions],
+                              HEX_LAT: frequency_data[HEX_LAT].to_numpy()[demand_positions],
+                              HEX_LON: frequency_data[HEX_LON].to_numpy()[demand_positions]})
+
+    sites = flatnonzero(bincount(supply_positions, minlength=len(hexagon_ids)))
+    supply_data = frequency_data.iloc[sites].reset_index(drop=True).rename(columns={HEXAGON_ID: SUPPLY_HEXAGON_ID})
+
+    events = frequency_data[TOTAL_EVENT].to_numpy()
+    served_events = bincount(supply_positions, events[demand_positions], minlength=len(hexagon_ids))[sites]
+    supply_data[SERVED_EVENTS] = served_events.astype(events.dtype)
+    if distances is not None:
+        distances = asarray(distances)
+        if distances.ndim == 1:
+            pair_distances = distances[demand_positions]
+        else:
+            pair_distances = distances[supply_rows, demand_positions]
+        weighted = bincount(supply_positions, events[demand_positions] * pair_distances, minlength=len(hexagon_ids))
+        furthest = zeros(len(hexagon_ids))
+        maximum.at(furthest, supply_positions, pair_distances)
+        with errstate(invalid="ignore", divide="ignore"):
+            supply_data[MEAN_DISTANCE] = weighted[sites] / served_events
+        supply_data[MAX_DISTANCE] = furthest[sites]
+
+    return optimal_data, supply_data
+
+
 class OptimalLoc:
-    def __init__(self):
+    def __init__(self, n_workers: int = None, chunk_size: int = DEFAULT_CHUNK_SIZE, executor: str = "thread",
+                 profile_callback=None, distance_store: DistanceStore = None, results_dir: str = RESULTS_DIR):
+        """
+        Parameters:
+            n_workers (int): Number of workers used to index the events into hexagons. Default is None (no pool).
+            chunk_size (int): Number of events indexed per worker task. Default is 1,000,000.
+            executor (str): "thread" or "process" pool for the indexing. Default is "thread".
+            profile_callback (callable): Optional hook called as callback(phase, seconds, profile) after every phase
+                of a run, e.g. to send the timings to a monitoring system. The timings are in the 'profile' attribute.
+            distance_store (DistanceStore): Optional persistent distances, keyed by (resolution, fromhex, tohex).
+                'create_hexagon_distance_data' takes the stored distances from it and 'save_distances' writes to it.
+            results_dir (str): Every 'calculate_optimal_locations' run is saved to its own directory in here, see
+                'optimal_loc.results.ResultStore'. Default is "optimal_loc_results".
+        """
+        self.n_workers = n_workers
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.profile_callback = profile_callback
+        self.profile = RunProfile(profile_callback)
+        self.distance_store = distance_store
+        self.results = ResultStore(results_dir)
+        self.run_id = None
         self.supply_data = None
         self.optimal_data = None
-        self.hex_distance_data = None
+        self.distance_matrix = None
         self.event_frequency_data = None
         self.resolution = None
+        self.objective = None
+        self.lower_bound = None
+
+    @property
+    def hex_distance_data(self) -> DataFrame:
+        """
+        The long-form distance data, one row per pair of hexagons, read-only.
+
+        It is a new frame built with 'distance_matrix.to_frame()' on every access, so edits to it, e.g.
+        `object.hex_distance_data.loc[...] = x`, are not seen by the object. The optimisation always uses
+        'distance_matrix'. To use edited distances, read the edited frame with 'read_distances', which converts it
+        to the matrix once.
+
+        Raises:
+            AttributeError: When it is assigned.
+        """
+        if self.distance_matrix is None:
+            return None
+        return self.distance_matrix.to_frame()
+
+    @hex_distance_data.setter
+    def hex_distance_data(self, distance_data: DataFrame):
+        raise AttributeError("hex_distance_data is read-only, please read the distances with "
+                             "read_distances(read_from_dataframe=True, distance_dataframe=...).")
 
-    def plot_frequency_hexagons(self):
-        plot_data = self.event_frequency_data.copy()
-        perc_90 = percentile(plot_data["total_event"], 90)
-        perc_75 = percentile(plot_data["total_event"], 75)
-        plot_data["colors"] = plot_data["total_event"].apply(lambda x: "red" if x > perc_90 else (
-            "green" if x > perc_75 else "blue"), 1)
-        WHS_COORD = [plot_data['hex_lat'].median(), plot_data['hex_lon'].median()]
-        map_nyc = Map(location=WHS_COORD, zoom_start=10, width=740, height=500)
-
-        for j, i in plot_data.iterrows():
-            CircleMarker((i["hex_lat"], i["hex_lon"]),
-                         radius=5, color=i["colors"],
-                         popup={"Total Event": i["total_event"]}
-                         ).add_to(map_nyc)
+    def _get_distance_matrix(self, distance_data=None) -> DistanceMatrix:
+        if distance_data is None:
+            distance_data = self.distance_matrix
+        if distance_data is None or isinstance(distance_data, DistanceMatrix):
+            return distance_data
+        return DistanceMatrix.from_frame(distance_data)
+
+    def _distance_block(self, from_data: DataFrame, to_data: DataFrame = None, distance_method="haversine"):
+        # The distances from the hexagons of from_data to those of to_data (or to themselves). With a distance store,
+        # the stored pairs are used and the distance_method only computes the others.
+        if self.distance_store is None:
+            return DistanceMatrix.from_frequency_data(from_data, self.resolution, distance_method, to_data)
+        matrix = DistanceMatrix.from_frequency_data(from_data, self.resolution, None, to_data)
+        found = self.distance_store.fill(matrix, self.resolution)
+        print(f"{found.sum()} of {found.size} hexagon pairs were read from the distance store.")
+        # The within-hexagon distances and the "haversine" / "h3" distances of the pairs missing from the store are
+        # estimates, which 'save_distances' skips. The distances of a provider, and NaN pairs filled in later, are
+        # saved.
+        matrix.estimated = zeros(found.shape, dtype=bool)
+        diagonal = matrix.same_hexagon_pairs()
+        matrix.estimated[diagonal] = ~found[diagonal]
+        # The distance of a hexagon to itself is always known, from the store or the within-hexagon distance.
+        known = found.copy()
+        known[diagonal] = True
+        if distance_method is not None and not known.all():
+            # Only the blocks of missing pairs (new x all, old x new) are computed, e.g. requested from a routing
+            # engine, so a few new hexagons do not ask for the whole matrix again.
+            to_data = from_data if to_data is None else to_data
+            for rows, columns in missing_blocks(found, known):
+                missing = DistanceMatrix.from_frequency_data(from_data.iloc[rows], self.resolution, distance_method,
+                                                             to_data.iloc[columns])
+                block = ix_(rows, columns)
+                matrix.values[block] = where(known[block], matrix.values[block], missing.values)
+                if not hasattr(distance_method, "distances"):
+                    matrix.estimated[block] |= ~known[block]
+                    continue
+                # The provider distances are cached as they arrive, so the next run does not request them again.
+                missing.estimated = known[block]
+                self.distance_store.put(missing, self.resolution, write_back=False)
+        return matrix
+
+    def _indexing_options(self) -> dict:
+        return {"chunk_size": self.chunk_size, "n_workers": self.n_workers, "executor": self.executor}
+
+    def plot_frequency_hexagons(self, mode: str = "polygons", max_cells: int = DEFAULT_MAX_CELLS):
+        """
+        Plots the event frequency of the hexagons on a folium map.
 
+        Parameters:
+            mode (str): "polygons" (one GeoJSON layer of the hexagons), "points" (one clustered layer of their
+                centroids) or "markers" (one marker per hexagon). Default is "polygons".
+            max_cells (int): Above this number of hexagons they are aggregated into their H3 parents, until at
+                most `max_cells` cells remain. Default is 5,000.
+
+        Returns:
+            Map: The hexagons coloured red above the 90th percentile of the events, green above the 75th and
+                blue otherwise.
+
+        Note:
+            The map is static HTML and its initial view shows all the hexagons, so the coarsening keeps its size,
+            and the time the browser needs to load it, bounded however many hexagons there are.
+        """
+        plot_data, _ = coarsen_hexagons(self.event_frequency_data, max_cells, weight=TOTAL_EVENT)
+        map_nyc = Map(location=map_center(self.event_frequency_data), zoom_start=10, width=740, height=500)
+        hexagon_layer(plot_data, frequency_colours(plot_data[TOTAL_EVENT]), mode,
+                      tooltip_columns=[TOTAL_EVENT]).add_to(map_nyc)
         plugins.Fullscreen(position='topleft').add_to(map_nyc)
 
         return map_nyc
 
-    def event_frequency(self, raw_input_data: DataFrame, hex_size: str = 'auto', resolution: int = None) -> None:
+    def event_frequency(self, raw_input_data: DataFrame, hex_size: str = 'auto', resolution: int = None,
+                        max_hexagons: int = AUTO_MAX_HEXAGONS) -> None:
         """
         Calculate the frequency of events in each hexagonal region.
 
         Parameters:
         raw_data (DataFrame): pandas DataFrame containing event data, with columns "latitude" and "longitude".
         hex_size (string): You can specify hexagon sizes by small, medium or big, otherwise it will be assigned as auto
+        max_hexagons (int): In auto mode, the finest resolution with fewer hexagons than this is used. Default is 150.
 
         Returns:
         None
@@ -76,7 +279,8 @@ class OptimalLoc:
         the hexagonal region IDs, total event counts, and corresponding latitude and longitude coordinates.
 
         Note:
-        This function assumes that the 'geo_to_h3' and 'h3_to_geo' functions from the H3 library are available.
+        The coordinates are indexed in bulk as NumPy arrays, in chunks of `chunk_size` points which are spread over
+        `n_workers` workers when the object was created with a pool. Centroids are computed once per unique hexagon.
 
         Example:
         raw_event_data = pd.DataFrame({'latitude': [42.123, 42.456, 42.789], 'longitude': [-71.123, -71.456, -71.789]})
@@ -85,44 +289,98 @@ class OptimalLoc:
         event_freq_data = object_name.event_frequency_data
         print(event_freq_data)
         """
-        raw_data = raw_input_data.copy()
-        if resolution:
-            self.resolution = resolution
-        else:
-            self.resolution = set_resolution(raw_data, hex_size)
-
-        raw_data[HEX_ID] = raw_data.apply(lambda x: geo_to_h3(x[LATITUDE], x[LONGITUDE], self.resolution), 1)
+        self.profile = RunProfile(self.profile_callback)
+        with self.profile.phase(INDEXING):
+            if resolution:
+                self.resolution = resolution
+            else:
+                self.resolution = set_resolution(raw_input_data, hex_size, max_hexagons, **self._indexing_options())
 
-        raw_data = raw_data[HEX_ID].value_counts().reset_index().rename(columns={INDEX: HEXAGON_ID,
-                                                                                 HEX_ID: TOTAL_EVENT})
-        raw_data[HEX_LOCATION] = raw_data.apply(lambda x: h3_to_geo(h=x[HEXAGON_ID]), 1)
-        raw_data[HEX_LAT] = raw_data.apply(lambda x: x[HEX_LOCATION][0], 1)
-        raw_data[HEX_LON] = raw_data.apply(lambda x: x[HEX_LOCATION][1], 1)
-        raw_data = raw_data.drop(columns=HEX_LOCATION)
+            raw_data = event_frequency_table(raw_input_data, self.resolution, **self._indexing_options())
 
         self.event_frequency_data = raw_data
 
-    def create_hexagon_distance_data(self, raw_data: DataFrame, hex_size: str = 'auto', resolution: int = None) -> None:
+    def stream_event_frequency(self, chunks, hex_size: str = 'medium', resolution: int = None,
+                               counter: HexagonCounter = None) -> HexagonCounter:
+        """
+        Calculate the frequency of events in each hexagonal region from an iterable of event chunks.
+
+        Parameters:
+        chunks (iterable): Chunks of events, e.g. pd.read_csv(..., chunksize=n), ParquetFile.iter_batches() or a
+            generator of DataFrames, (n, 2) latitude/longitude arrays or (latitudes, longitudes) tuples.
+        hex_size (string): small, medium or big. Auto is not available since the chunks are only read once.
+        resolution (int): H3 resolution to use instead of hex_size.
+        counter (HexagonCounter): Partial counts to continue from, e.g. the merged counters of other workers.
+
+        Returns:
+        HexagonCounter: The counts, which can be merged with the counts of other files or workers.
+
+        Description:
+        Each chunk is folded into per hexagon counts and dropped, so the memory use depends on the number of
+        hexagons and not on the number of events. The 'event_frequency_data' and 'resolution' attributes are
+        updated like in 'event_frequency'.
+
+        Example:
+        object_name = OptimalLoc()
+        object_name.stream_event_frequency(pd.read_csv('events.csv', chunksize=1_000_000), 'medium')
+        object_name.create_hexagon_distance_data()
+        """
+        if counter is None:
+            if not resolution:
+                if hex_size not in HEX_SIZE_RESOLUTIONS:
+                    raise ValueError("Streaming needs a fixed hex_size (small, medium or big) or a resolution.")
+                resolution = HEX_SIZE_RESOLUTIONS[hex_size]
+            counter = HexagonCounter(resolution, **self._indexing_options())
+        elif resolution and resolution != counter.resolution:
+            raise ValueError(f"The counter was built at resolution {counter.resolution}, not {resolution}.")
+
+        self.profile = RunProfile(self.profile_callback)
+        with self.profile.phase(INDEXING):
+            self.set_event_counts(counter.consume(chunks))
+        return counter
+
+    def set_event_counts(self, counter: HexagonCounter) -> None:
+        """
+        Sets 'event_frequency_data' and 'resolution' from a (merged) HexagonCounter.
+
+        Example:
+        counter = HexagonCounter(8).consume(chunks_of_file_1).merge(HexagonCounter(8).consume(chunks_of_file_2))
+        object_name = OptimalLoc()
+        object_name.set_event_counts(counter)
+        """
+        self.resolution = counter.resolution
+        self.event_frequency_data = counter.to_frame()
+
+    def create_hexagon_distance_data(self, raw_data: DataFrame = None, hex_size: str = 'auto', resolution: int = None,
+                                     max_hexagons: int = AUTO_MAX_HEXAGONS, distance_method="haversine") -> None:
         """
         Create a DataFrame containing the distances between pairs of hexagonal regions.
 
         Parameters:
         raw_data (DataFrame): pandas DataFrame containing event data, with columns "latitude" and "longitude".
+            If None, the existing 'event_frequency_data' is used, e.g. after 'stream_event_frequency'.
         hex_size (string): You can specify hexagon sizes by small, medium or big, otherwise it will be assigned as auto
+        max_hexagons (int): In auto mode, the finest resolution with fewer hexagons than this is used. Default is 150.
+        distance_method (string or DistanceProvider): "haversine" fills every pair with the great-circle distance in
+            metres, "h3" with the distance along the H3 grid, None leaves the pairs NaN so you can fill in the real
+            distances. A provider from 'optimal_loc.providers', e.g. OSRMTableProvider for road distances from a
+            routing engine, is called for the distances. Default is "haversine".
 
         Returns:
-        DataFrame: A pandas DataFrame containing columns "fromhex", "tohex", "fromhex_lat", "fromhex_lon", "tohex_lat", "tohex_lon", and "distance".
+        None
 
         Description:
-        This function creates a DataFrame that represents the distances between pairs of hexagonal regions.
-        It first calculates the event frequency using the 'event_frequency' function and then generates a meshgrid of hexagon IDs.
-        The resulting DataFrame includes columns that represent the source hexagon, target hexagon, and their corresponding latitude and longitude coordinates.
-        The distance between each pair of hexagons is not calculated in this function.
+        This function creates a DistanceMatrix (a float32 matrix plus the hexagon index) over the hexagons of
+        'event_frequency_data' and stores it in the 'distance_matrix' attribute.
+        The long-form DataFrame with columns "fromhex", "tohex", "fromhex_lat", "fromhex_lon", "tohex_lat", "tohex_lon"
+        and "distance" is only built when 'hex_distance_data' is read.
 
         Note:
-        This function assumes that the 'event_frequency' function has been executed to generate the 'event_frequency_data' attribute.
-        The meshgrid and array functions are imported from numpy.
-        You can calculate yourself the real distances after this function completed.
+        The distance within a hexagon (the diagonal) is the average distance between two points of the hexagon.
+        You can calculate yourself the real distances after this function completed and read them with 'read_distances'.
+        With a 'distance_store', every pair found in it (its local cache first, then its MongoDB collection) gets the
+        stored distance, and only the other pairs get the distance_method ones. The distances of a provider are
+        added to the local cache of the store right away, 'save_distances' writes them back to MongoDB.
 
         Example:
         raw_event_data = pd.DataFrame({'latitude': [42.123, 42.456, 42.789], 'longitude': [-71.123, -71.456, -71.789]})
@@ -130,38 +388,25 @@ class OptimalLoc:
         object.create_hexagon_distance_data(raw_event_data)
         hex_distance_data = object.hex_distance_data
         """
-        self.event_frequency(raw_data, hex_size, resolution)
-        event_data = self.event_frequency_data.copy()
-
-        hexagon_ids = event_data[[HEXAGON_ID, HEX_LAT, HEX_LON]].rename(columns={HEXAGON_ID: HEXAGON})
-        out_list = array(meshgrid(hexagon_ids.hexagon, hexagon_ids.hexagon)).T.reshape(-1, 2)
+        if raw_data is not None:
+            self.event_frequency(raw_data, hex_size, resolution, max_hexagons)
+        elif self.event_frequency_data is None:
+            raise ValueError("Please give raw_data or run event_frequency / stream_event_frequency first.")
+        event_data = self.event_frequency_data
 
-        hex_distance_data = DataFrame(data=out_list, columns=[FROMHEX, TOHEX])
-
-        hex_distance_data = hex_distance_data.merge(
-            hexagon_ids[[HEXAGON, HEX_LAT, HEX_LON]].rename(
-                columns={HEX_LON: FROMHEX_LON, HEX_LAT: FROMHEX_LAT}),
-            left_on=FROMHEX,
-            right_on=HEXAGON,
-            how="left").drop(columns=[HEXAGON])
-
-        hex_distance_data = hex_distance_data.merge(
-            hexagon_ids[[HEXAGON, HEX_LAT, HEX_LON]],
-            left_on=TOHEX,
-            right_on=HEXAGON,
-            how="left").drop(columns=[HEXAGON]).rename(columns={HEX_LON: "tohex_lon", HEX_LAT: 'tohex_lat'})
-
-        # Average distance between two random points within a circle according to its diameter = (2 * radius) / 3
-        eq_hex_distance = int((edge_length(self.resolution, "m") * 2) / 3)
-        hex_distance_data[DISTANCE] = hex_distance_data.apply(lambda x: eq_hex_distance if x[FROMHEX] == x[TOHEX] else nan, 1)
-
-        self.hex_distance_data = hex_distance_data
+        with self.profile.phase(DISTANCE_MATRIX):
+            self.distance_matrix = self._distance_block(event_data, None, distance_method)
 
         print("Distance data for each hexagons was created. You can read it by object_name.hex_distance_data")
 
     def read_distances_from_mongodb(self, mongo_client: MongoClient,
                                     mongo_database_name: str,
-                                    mongo_collection_name: str):
+                                    mongo_collection_name: str,
+                                    filter_hexagons: bool = False,
+                                    query: dict = None,
+                                    batch_size: int = DEFAULT_BATCH_SIZE,
+                                    read_workers: int = None,
+                                    partition_field: str = "_id"):
         """
         Reads distance data from a MongoDB collection and stores it in a DataFrame.
 
@@ -169,9 +414,19 @@ class OptimalLoc:
             mongo_client (MongoClient): The MongoDB client object used to connect to the MongoDB server.
             mongo_database_name (str): The name of the MongoDB database containing the distance data.
             mongo_collection_name (str): The name of the MongoDB collection containing the distance data.
+            filter_hexagons (bool): Only read the pairs between the hexagons of 'event_frequency_data'. The filter
+                runs in MongoDB, so the other pairs are not transferred. Default is False.
+            query (dict): Additional MongoDB filter of the distance documents. Default is None.
+            batch_size (int): Cursor batch size, also the number of documents converted to arrays at once.
+                Default is 50,000.
+            read_workers (int): Number of parallel cursors, each reading one range of `partition_field`.
+                Default is None (a single cursor).
+            partition_field (str): Indexed field the parallel reads are split on. Default is "_id".
 
         Raises:
             ConnectionError: If there is an error connecting to the MongoDB server.
+            ValueError: If filter_hexagons is True before the event frequencies were calculated, or the documents
+                miss a required field.
 
         Returns:
             None
@@ -179,6 +434,10 @@ class OptimalLoc:
         Note:
             This function assumes that the MongoDB client has already been properly configured
             and connected to the server.
+            Only the "fromhex", "tohex" and "distance" fields are projected and required, "_id" and any other
+            field stay in MongoDB. The hexagon coordinates are the H3 centroids. The documents are streamed batch by
+            batch into categorical hexagon columns and float arrays, so the whole collection is never held as Python
+            dictionaries.
 
         Example:
             mongo_client = MongoClient('mongodb://localhost:27017')
@@ -194,22 +453,59 @@ class OptimalLoc:
             print(e)
             raise ConnectionError()
 
+        hexagons = None
+        if filter_hexagons:
+            if self.event_frequency_data is None:
+                raise ValueError("Please run event_frequency before reading the distances with filter_hexagons.")
+            hexagons = self.event_frequency_data[HEXAGON_ID].tolist()
+
         db = mongo_client[mongo_database_name]
         col = db[mongo_collection_name]
-        distance_data = DataFrame(list(col.find()))
-        # TODO: Write a exception for the column names
+        with self.profile.phase(DISTANCE_MATRIX):
+            distance_data = read_distance_frame(col, hexagons, query, batch_size=batch_size, n_workers=read_workers,
+                                                partition_field=partition_field)
+
+        self.distance_matrix = DistanceMatrix.from_frame(distance_data)
+
+    def save_distances(self, write_back: bool = True) -> int:
+        """
+        Saves the current distances to the 'distance_store', e.g. after filling in the real distances.
+
+        Only real distances are saved: the pairs read from the store or computed by a distance provider, the pairs
+        left NaN and filled in since, and the distances read with 'read_distances'. The "haversine" or "h3"
+        distances which 'create_hexagon_distance_data' filled in for the pairs missing from the store, and the
+        distance of a hexagon to itself, are estimates and not saved.
 
-        self.hex_distance_data = distance_data
+        Parameters:
+            write_back (bool): Also upsert them to the MongoDB collection of the store. Default is True.
+
+        Returns:
+            int: The number of hexagon pairs saved.
+
+        Raises:
+            ValueError: If the object has no distance store, resolution or distances.
+
+        Example:
+            object = OptimalLoc(distance_store=DistanceStore("distances.sqlite", collection))
+            object.event_frequency(raw_data)
+            object.read_distances(read_from_dataframe=True, distance_dataframe=real_distances)
+            object.save_distances()
+        """
+        distance_matrix = self._get_distance_matrix()
+        if self.distance_store is None or self.resolution is None or distance_matrix is None:
+            raise ValueError("Please create the object with a distance_store and create or read the distances first.")
+        return self.distance_store.put(distance_matrix, self.resolution, write_back)
 
     def read_distances(self, read_from_dataframe: bool = False,
                        read_from_mongo: bool = False,
                        distance_dataframe: DataFrame = DataFrame(),
                        mongo_client: MongoClient = None,
                        mongo_database_name: str = None,
-                       mongo_collection_name: str = None):
+                       mongo_collection_name: str = None,
+                       **mongo_options):
 
         """
-        Reads distance data from a specified source and stores it in the `hex_distance_data` attribute.
+        Reads distance data from a specified source and stores it in the `distance_matrix` attribute.
 
         Parameters:
             read_from_dataframe (bool): Flag indicating whether to read distance data from a DataFrame. Default is False.
@@ -218,6 +514,8 @@ class OptimalLoc:
             mongo_client (MongoClient): The MongoDB client object used to connect to the MongoDB server. Default is None.
             mongo_database_name (str): The name of the MongoDB database containing the distance data. Default is None.
             mongo_collection_name (str): The name of the MongoDB collection containing the distance data. Default is None.
+            **mongo_options: filter_hexagons, query, batch_size, read_workers and partition_field of
+                'read_distances_from_mongodb'.
 
         Raises:
             ValueError: If both `read_from_dataframe` and `read_from_mongo` are True or if none of them are True.
@@ -263,7 +561,7 @@ class OptimalLoc:
                 'fromhex', 'tohex', 'fromhex_lat', 'fromhex_lon', 'tohex_lat', 'tohex_lon', 'distance'
                 """)
 
-            self.hex_distance_data = distance_dataframe
+            self.distance_matrix = DistanceMatrix.from_frame(distance_dataframe)
             print("Successfully read the distance data")
 
         elif read_from_mongo:
@@ -271,7 +569,8 @@ class OptimalLoc:
                 self.read_distances_from_mongodb(
                     mongo_client=mongo_client,
                     mongo_database_name=mongo_database_name,
-                    mongo_collection_name=mongo_collection_name)
+                    mongo_collection_name=mongo_collection_name,
+                    **mongo_options)
                 print("Successfully read the distance data")
 
             else:
@@ -285,18 +584,22 @@ class OptimalLoc:
             # do something with c
             pass
 
-    def prepare_data_tables(self, pulp_solution, frequency_data: DataFrame):
+    def prepare_data_tables(self, pulp_solution, frequency_data: DataFrame, distances=None):
         """
         Prepares data tables for analysis based on the solution obtained from a Pulp optimization model and frequency data.
 
         Parameters:
-            pulp_solution: The solution obtained from a Pulp optimization model.
+            pulp_solution: The solution obtained from a Pulp optimization model, or the PMedianSolution of the
+                heuristic solver, whose positions refer to the rows of frequency_data.
             frequency_data (DataFrame): A pandas DataFrame containing frequency data.
+            distances (ndarray): Optional (supply, demand) distances in the order of frequency_data.
 
         Returns:
             dict: A dictionary containing the analysis results with the following keys:
                 - "optimal_data": DataFrame containing the optimal assignment of supply and hexagon IDs.
-                - "supply_data": DataFrame containing the supply data for the assigned hexagons.
+                - "supply_data": DataFrame containing the supply data for the assigned hexagons, with the
+                  "served_events" of every site and, given the distances, its event weighted "mean_distance" and
+                  its "max_distance" to a served hexagon.
 
         Note:
             This function assumes that the solution provided is compatible with the frequency data.
@@ -304,25 +607,8 @@ class OptimalLoc:
         """
         analysis_result = {}
 
-        wh_loc = []
-        hex_loc = []
-        assign = []
-        for v in pulp_solution.variables()[len(frequency_data):]:
-            wh_loc.append(v.name.split("_")[1])
-            hex_loc.append(v.name.split("_")[2])
-            assign.append(v.varValue)
-        df = DataFrame({SUPPLY_HEXAGON_ID: wh_loc, HEXAGON_ID: hex_loc, "assign": assign})
-        optimal_data = df[df["assign"] != 0].reset_index(drop=True)
-
-        optimal_data = optimal_data.merge(
-            frequency_data[[HEXAGON_ID, HEX_LAT, HEX_LON]],
-            on=HEXAGON_ID,
-            how="left").drop(columns=["assign"])
-
-        supply_data = frequency_data[frequency_data[HEXAGON_ID].isin(
-            list(optimal_data[SUPPLY_HEXAGON_ID].unique()))].reset_index(drop=True).rename(
-            columns={HEXAGON_ID: SUPPLY_HEXAGON_ID})
-        
+        optimal_data, supply_data = solution_tables(pulp_solution, frequency_data, distances)
+
         self.optimal_data = optimal_data
         self.supply_data = supply_data
         
@@ -331,91 +617,612 @@ class OptimalLoc:
 
         return analysis_result
 
+    def _build_model(self, number_of_loc: int, distance_data=None, frequency_data: DataFrame = None,
+                     max_distance: float = None, k_nearest: int = None):
+        self.profile.clear(PIVOTING, MODEL_BUILDING, SOLVING, EXTRACTION)
+        with self.profile.phase(PIVOTING):
+            distance_matrix = self._get_distance_matrix(distance_data)
+            if frequency_data is None:
+                frequency_data = self.event_frequency_data
+            if distance_matrix is None or frequency_data is None:
+                raise ValueError("""
+                    Please specify distance_data and frequency_data or run related functions.
+                """)
+
+            supplies = frequency_data[HEXAGON_ID].tolist()
+            demands = frequency_data[HEXAGON_ID].tolist()
+            weights = frequency_data[TOTAL_EVENT].to_numpy()
+            distances = distance_matrix.reindex(supplies, demands).values
+
+        with self.profile.phase(MODEL_BUILDING):
+            supply_positions, demand_positions = candidate_pairs(distances, max_distance, k_nearest)
+            check_candidate_pairs(demand_positions, len(demands), demands)
+
+            model = PMedianModel(distances, weights, supply_positions, demand_positions, number_of_loc)
+        return model, supplies, demands, frequency_data
+
     def calculate_optimal_locations(self, number_of_loc: int,
                                     distance_data: DataFrame = None,
-                                    frequency_data: DataFrame = None
+                                    frequency_data: DataFrame = None,
+                                    max_distance: float = None,
+                                    k_nearest: int = None,
+                                    solver: str = "auto",
+                                    time_limit: float = None,
+                                    mip_gap: float = None,
+                                    threads: int = None,
+                                    warm_start=False
                                     ):
         """
         Calculates the optimal locations based on the given number of locations and distance/frequency data.
 
         Parameters:
             number_of_loc (int): The number of optimal locations to calculate.
-            distance_data (DataFrame): A pandas DataFrame containing distance data. Default is None.
+            distance_data (DataFrame or DistanceMatrix): The distances, either long-form or as a DistanceMatrix.
+                Default is None, which uses the distances of the object.
             frequency_data (DataFrame): A pandas DataFrame containing frequency data. Default is None.
+            max_distance (float): A demand hexagon can only be assigned to a supply hexagon within this distance.
+                Default is None (no limit).
+            k_nearest (int): A demand hexagon can only be assigned to one of its k nearest candidate supply
+                hexagons. Default is None (all of them).
+            solver (str): "highs" builds the exact model as sparse matrices and solves it in-process with HiGHS
+                (scipy.optimize.milp). "cbc" solves the same model with PuLP/CBC. "heuristic" runs a NumPy p-median
+                heuristic (greedy construction and vertex substitution) which is much faster on large instances and
+                reports a Lagrangian lower bound. Default is "auto": HiGHS if scipy is installed, CBC otherwise.
+            time_limit (float): Seconds after which the solver stops and the best solution found so far is used.
+                Default is None (no limit).
+            mip_gap (float): Relative gap between the objective and the lower bound at which the solver stops, e.g.
+                0.01 accepts a solution within 1% of the optimum. Default is None (the solver default).
+            threads (int): Number of CBC threads. Default is None (the CBC default).
+            warm_start (bool or PMedianSolution): Start CBC from a heuristic solution (True) or from the given
+                solution. Default is False.
 
         Raises:
             ValueError: If `distance_data` or `frequency_data` is None or not provided.
+            ValueError: If max_distance / k_nearest make the problem infeasible.
 
         Returns:
             None
 
         Note:
             This function assumes that the necessary data has been provided either through the function parameters or through previous function calls.
+            Only the supply-demand pairs kept by max_distance / k_nearest (and with a known distance) become
+            assignment variables and constraints, which keeps large models small enough to be solved.
+            The objective (total weighted distance) and its lower bound are stored in the 'objective' and
+            'lower_bound' attributes. For HiGHS the lower bound is its dual bound and for the heuristic a Lagrangian
+            bound. CBC does not report its bound, so when it stops on the gap the lower bound is
+            objective * (1 - mip_gap), i.e. the objective without mip_gap. When CBC stops on time_limit, the lower
+            bound is None.
+            The time spent per phase (indexing, distance_matrix, pivoting, model_building, solving, extraction)
+            and the model size, solver status, objective, lower bound and gap are recorded in the 'profile'
+            attribute and logged on the "optimal_loc.profiling" logger.
+            The tables and a manifest with the number of locations, resolution, objective and timings are saved
+            as a new run of the 'results' store, its id is in the 'run_id' attribute.
 
         Example:
             object = OptimalLoc()
             object.calculate_optimal_locations(number_of_loc=3, distance_data=distances_df, frequency_data=frequency_df)
         """
 
-        if distance_data is None:
-            distance_data = self.hex_distance_data
-        if frequency_data is None:
-            frequency_data = self.event_frequency_data
-        if distance_data is None or frequency_data is None:
-            raise ValueError("""
-                Please specify distance_data and frequency_data or run related functions.
-            """)
-
-        distance_matrix = pivot_table(
-            distance_data, 
-            values=DISTANCE,
-            index=FROMHEX,
-            columns=TOHEX
-        )
-        
-        distance_matrix.columns.name = None
-        distance_matrix.index.name = None
+        model, supplies, demands, frequency_data = self._build_model(
+            number_of_loc, distance_data, frequency_data, max_distance, k_nearest)
+        solution = solve_model(model, solver, supplies, demands, threads, time_limit, mip_gap, warm_start,
+                               self.profile)
+        self._store_solution(solution, model, frequency_data, solver, max_distance, k_nearest)
+
+    def _store_solution(self, solution, model: PMedianModel, frequency_data: DataFrame, solver: str,
+                        max_distance: float = None, k_nearest: int = None) -> None:
+        self.objective = solution.objective
+        self.lower_bound = solution.lower_bound
+        self.profile.update(solver=solver, n_variables=model.n_variables, n_constraints=model.n_constraints,
+                            status=solution.status, objective=solution.objective,
+                            lower_bound=solution.lower_bound, gap=solution.gap)
+
+        with self.profile.phase(EXTRACTION):
+            self.optimal_data, self.supply_data = solution_tables(solution, frequency_data, model.distances)
+        self._save_results({NUMBER_OF_LOC: model.number_of_loc, "resolution": self.resolution,
+                            "n_hexagons": len(frequency_data), "n_events": frequency_data[TOTAL_EVENT].sum(),
+                            "max_distance": max_distance, "k_nearest": k_nearest, **self.profile.to_dict()})
+
+    def sweep_optimal_locations(self, numbers_of_loc,
+                                distance_data: DataFrame = None,
+                                frequency_data: DataFrame = None,
+                                max_distance: float = None,
+                                k_nearest: int = None,
+                                solver: str = "auto",
+                                time_limit: float = None,
+                                mip_gap: float = None,
+                                threads: int = None):
+        """
+        Calculates the optimal locations for several numbers of locations, e.g. the best 3, 4, ... 15 sites.
+
+        Parameters:
+            numbers_of_loc (iterable): The numbers of locations to calculate, e.g. range(3, 16).
+            distance_data, frequency_data, max_distance, k_nearest, solver, time_limit, mip_gap, threads: As in
+                'calculate_optimal_locations'. The time limit applies to every number of locations, with CBC at most
+                half of it goes to the heuristic warm start.
+
+        Returns:
+            tuple: (curve, results)
+                - curve (DataFrame): One row per number of locations with the "objective", "lower_bound", "gap"
+                  and "seconds" columns, i.e. the cost-vs-k curve.
+                - results (dict): For every number of locations, a dictionary with the "optimal_data" and
+                  "supply_data" DataFrames.
+
+        Note:
+            The model is built once and only the number of locations changes between the solves. Every solve is
+            warm started from the solution of the previous number of locations (see
+            'optimal_loc.optimization.sweep_p_median'). The object's result attributes and the result store are not
+            changed.
+
+        Example:
+            object = OptimalLoc()
+            curve, results = object.sweep_optimal_locations(range(3, 16), solver="heuristic")
+            curve.plot(x="number_of_loc", y="objective")
+        """
+        numbers_of_loc = sorted(set(numbers_of_loc))
+        model, supplies, demands, frequency_data = self._build_model(
+            numbers_of_loc[0], distance_data, frequency_data, max_distance, k_nearest)
+
+        curve = []
+        results = {}
+        for number_of_loc, solution, seconds in sweep_p_median(model, numbers_of_loc, solver, supplies, demands,
+                                                               threads, time_limit, mip_gap):
+            optimal_data, supply_data = solution_tables(solution, frequency_data, model.distances)
+            results[number_of_loc] = {OPTIMAL_DATA_COLUMN: optimal_data, SUPPLY_DATA_COLUMN: supply_data}
+            curve.append({NUMBER_OF_LOC: number_of_loc,
+                          OBJECTIVE: solution.objective,
+                          LOWER_BOUND: solution.lower_bound,
+                          GAP: solution.gap,
+                          SECONDS: seconds})
+
+        return DataFrame(curve), results
+
+    def update_events(self, new_events,
+                      number_of_loc: int = None,
+                      distance_method="haversine",
+                      max_distance: float = None,
+                      k_nearest: int = None,
+                      solver: str = "heuristic",
+                      time_limit: float = None,
+                      mip_gap: float = None,
+                      threads: int = None) -> DataFrame:
+        """
+        Adds a delta of new events to the current run and re-optimises from the current sites.
+
+        Parameters:
+            new_events: The new events, a DataFrame with "latitude" and "longitude" columns or any other chunk
+                'optimal_loc.streaming.chunk_coordinates' accepts.
+            number_of_loc (int): The number of locations. Default is None, the number of the current sites.
+            distance_method (str or DistanceProvider): The distances of the newly seen hexagons, see
+                'create_hexagon_distance_data'. Pairs in the 'distance_store' are read from it. Default is "haversine".
+            max_distance, k_nearest, time_limit, mip_gap, threads: As in 'calculate_optimal_locations'.
+            solver (str): "heuristic" runs the local search from the current sites, "cbc" gets them as a warm
+                start. "highs" solves from scratch, as scipy.optimize.milp takes no start. Default is "heuristic".
+
+        Returns:
+            DataFrame: The "supply_hexagon_id" of every site of the old and the new solution, with its "change":
+            "opened", "closed" or "kept".
+
+        Raises:
+            ValueError: If there are no event frequencies or distances to update yet.
+
+        Note:
+            Only the new events are indexed. Their counts are added to 'event_frequency_data', where newly seen
+            hexagons are appended at the end, with their centroids. The distance matrix only gets the rows and
+            columns of the new hexagons, so (new hexagons x all hexagons) distances are computed instead of all N².
+            The result attributes, the 'profile' and the result store are updated like in
+            'calculate_optimal_locations'.
+
+        Example:
+            object = OptimalLoc()
+            object.create_hexagon_distance_data(history, hex_size='medium')
+            object.calculate_optimal_locations(number_of_loc=10)
+            changes = object.update_events(todays_events)
+            changes[changes["change"] != "kept"]
+        """
+        distance_matrix = self._get_distance_matrix()
+        if self.event_frequency_data is None or distance_matrix is None:
+            raise ValueError("Please create the event frequencies and the distances before updating them.")
+        if not distance_matrix.is_square:
+            raise ValueError("The distances must be a square matrix over the hexagons to be updated.")
+        old_sites = [] if self.supply_data is None else self.supply_data[SUPPLY_HEXAGON_ID].tolist()
+        if number_of_loc is None:
+            number_of_loc = len(old_sites)
+        self.profile = RunProfile(self.profile_callback)
+
+        with self.profile.phase(INDEXING):
+            latitudes, longitudes = chunk_coordinates(new_events)
+            cells, counts = unique(geo_to_cells(latitudes, longitudes, self.resolution, **self._indexing_options()),
+                                   return_counts=True)
+            hexagon_ids = cells_to_strings(cells)
+            positions = Index(self.event_frequency_data[HEXAGON_ID]).get_indexer(hexagon_ids)
+            seen = positions >= 0
+
+            event_data = self.event_frequency_data.copy()
+            totals = event_data[TOTAL_EVENT].to_numpy().copy()
+            add.at(totals, positions[seen], counts[seen])
+            event_data[TOTAL_EVENT] = totals
+            new_hexagons = frequency_table(cells[~seen], counts[~seen])
+            event_data = concat([event_data, new_hexagons], ignore_index=True)
+
+        with self.profile.phase(DISTANCE_MATRIX):
+            new_hexagons = new_hexagons[~new_hexagons[HEXAGON_ID].isin(distance_matrix.from_hexagons)]
+            if len(new_hexagons):
+                if distance_matrix.from_coordinates is None:
+                    known = event_data.set_index(HEXAGON_ID).loc[distance_matrix.from_hexagons].reset_index()
+                else:
+                    known = DataFrame({HEXAGON_ID: distance_matrix.from_hexagons.to_numpy(),
+                                       HEX_LAT: distance_matrix.from_coordinates[0],
+                                       HEX_LON: distance_matrix.from_coordinates[1]})
+                all_hexagons = concat([known, new_hexagons], ignore_index=True)
+                distance_matrix = distance_matrix.extend(self._distance_block(new_hexagons, all_hexagons,
+                                                                              distance_method),
+                                                         self._distance_block(known, new_hexagons, distance_method))
+            self.distance_matrix = distance_matrix
+        self.event_frequency_data = event_data
+
+        model, supplies, demands, frequency_data = self._build_model(number_of_loc, None, None, max_distance,
+                                                                     k_nearest)
+        # The current sites are the start of the local search, or the CBC warm start if their number is unchanged.
+        start = False
+        sites = Index(supplies).get_indexer(old_sites)
+        if len(sites) and (sites >= 0).all() and (len(sites) == number_of_loc or solver == "heuristic"):
+            start = model.solution_from_sites(sites)
+        solution = solve_model(model, solver, supplies, demands, threads, time_limit, mip_gap, start, self.profile)
+        self._store_solution(solution, model, frequency_data, solver, max_distance, k_nearest)
+
+        new_sites = self.supply_data[SUPPLY_HEXAGON_ID].tolist()
+        changes = DataFrame({SUPPLY_HEXAGON_ID: sorted(set(old_sites) | set(new_sites))})
+        opened = changes[SUPPLY_HEXAGON_ID].isin(new_sites)
+        closed = changes[SUPPLY_HEXAGON_ID].isin(old_sites)
+        changes[CHANGE] = select([opened & closed, opened], [KEPT, OPENED], CLOSED)
+        return changes
+
+    def hierarchical_optimal_locations(self, number_of_loc: int,
+                                       raw_data: DataFrame = None,
+                                       hex_size: str = 'small',
+                                       resolution: int = None,
+                                       coarse_resolution: int = None,
+                                       max_hexagons: int = AUTO_MAX_HEXAGONS,
+                                       neighbours: int = 1,
+                                       distance_method="haversine",
+                                       max_distance: float = None,
+                                       k_nearest: int = None,
+                                       solver: str = "auto",
+                                       time_limit: float = None,
+                                       mip_gap: float = None,
+                                       threads: int = None) -> DataFrame:
+        """
+        Calculates the optimal locations at a fine resolution by refining the solution of a coarse one.
 
-        event_matrix = frequency_data[[HEXAGON_ID, TOTAL_EVENT]].set_index(HEXAGON_ID)
-        event_matrix.index.name = None
-        event_matrix = event_matrix.to_dict(INDEX)
+        Parameters:
+            number_of_loc (int): The number of optimal locations to calculate.
+            raw_data (DataFrame): Events with "latitude" and "longitude" columns. If None, the existing
+                'event_frequency_data' is used as the target level, e.g. after 'stream_event_frequency'.
+            hex_size (string): small, medium or big, the target resolution. Default is small.
+            resolution (int): H3 target resolution to use instead of hex_size.
+            coarse_resolution (int): Resolution of the first, full solve. Default is None: the finest resolution
+                with fewer than `max_hexagons` hexagons, like hex_size='auto'.
+            max_hexagons (int): See coarse_resolution. Default is 150.
+            neighbours (int): The sites of a level and the hexagons within this many grid steps of them are
+                refined on the next level. Default is 1.
+            distance_method (str or DistanceProvider): The distances of every level, see
+                'create_hexagon_distance_data'. Default is "haversine".
+            max_distance, k_nearest, solver, time_limit, mip_gap, threads: As in 'calculate_optimal_locations',
+                applied on every level, except k_nearest, which only prunes the coarse level. The finer levels
+                have few candidates, and keeping only the nearest ones of a few clustered candidates could leave
+                the chosen sites unable to serve a demand.
 
-        supplies = distance_data.fromhex.unique().tolist()
-        demands = distance_data.fromhex.unique().tolist()
-        distance = distance_matrix.to_dict(INDEX)
+        Returns:
+            DataFrame: One row per level with its "resolution", "n_hexagons", "n_candidates", "n_variables",
+            "status", "objective", "lower_bound", "gap" and "seconds". The objective of a level is the weighted
+            distance at its own resolution, the lower bound only holds for its restricted candidates.
 
-        prob = LpProblem("Transportation", LpMinimize)
-        routes = [(i, j) for i in supplies for j in demands]
+        Raises:
+            ValueError: If hex_size is not small, medium or big and no resolution is given.
+            ValueError: If the coarse resolution has fewer hexagons than number_of_loc.
 
-        # DECISION VARIABLES
-        amount_vars = LpVariable.dicts("X", (supplies, demands), lowBound=0, upBound=1, cat='Binary')
-        wh_vars = LpVariable.dicts("Supply", supplies, lowBound=0, upBound=1, cat='Binary')
+        Note:
+            The events are indexed once at the target resolution and rolled up to the coarser levels. The coarse
+            level is solved over all its hexagons. On every finer level, only the hexagons whose parent is a site
+            of the level above, or one of its neighbours, are candidate supplies, while every hexagon is still a
+            demand, so the distance matrix and the model have (candidates x hexagons) instead of
+            (hexagons x hexagons) entries. The distance store is not used here.
+            The result attributes, the 'profile' (summed over the levels) and the result store are updated like in
+            'calculate_optimal_locations', 'distance_matrix' holds the candidate distances of the target level.
 
-        prob += lpSum(amount_vars[i][j] * distance[i][j] * event_matrix[j][TOTAL_EVENT] for (i, j) in routes)
+        Example:
+            object = OptimalLoc()
+            levels = object.hierarchical_optimal_locations(10, raw_event_data, hex_size='small')
+            levels[["resolution", "n_candidates", "objective", "seconds"]]
+        """
+        if raw_data is not None:
+            if not resolution:
+                if hex_size not in HEX_SIZE_RESOLUTIONS:
+                    raise ValueError("The hierarchical solve needs a hex_size (small, medium or big) or a resolution.")
+                resolution = HEX_SIZE_RESOLUTIONS[hex_size]
+            self.profile = RunProfile(self.profile_callback)
+            with self.profile.phase(INDEXING):
+                cells, counts = count_events(raw_data, resolution, **self._indexing_options())
+        elif self.event_frequency_data is None:
+            raise ValueError("Please give raw_data or run event_frequency / stream_event_frequency first.")
+        else:
+            resolution = self.resolution
+            cells = strings_to_cells(self.event_frequency_data[HEXAGON_ID])
+            counts = self.event_frequency_data[TOTAL_EVENT].to_numpy()
+            self.profile.clear(DISTANCE_MATRIX, PIVOTING, MODEL_BUILDING, SOLVING, EXTRACTION)
+
+        with self.profile.phase(INDEXING):
+            if coarse_resolution is None:
+                coarse_resolution, _, _ = select_auto_resolution(cells, counts, max_hexagons, resolution)
+            coarse_resolution = min(coarse_resolution, resolution)
+            tables = level_tables(cells, counts, resolution, coarse_resolution)
+        if len(tables[coarse_resolution]) < number_of_loc:
+            raise ValueError(f"Resolution {coarse_resolution} has only {len(tables[coarse_resolution])} hexagons, "
+                             f"please use a finer coarse_resolution for {number_of_loc} locations.")
+
+        levels = []
+        sites = None
+        for level in range(coarse_resolution, resolution + 1):
+            start = perf_counter()
+            frequency_data = tables[level]
+            hexagon_ids = frequency_data[HEXAGON_ID].to_numpy()
+            with self.profile.phase(DISTANCE_MATRIX):
+                if sites is None:
+                    candidates = arange(len(frequency_data))
+                else:
+                    candidates = candidate_positions(hexagon_ids, level - 1, expand_sites(sites, neighbours))
+                distance_matrix = DistanceMatrix.from_frequency_data(frequency_data.iloc[candidates], level,
+                                                                     distance_method, frequency_data)
+
+            with self.profile.phase(MODEL_BUILDING):
+                supply_positions, demand_positions = candidate_pairs(distance_matrix.values, max_distance,
+                                                                     k_nearest if sites is None else None)
+                check_candidate_pairs(demand_positions, len(hexagon_ids), hexagon_ids)
+                model = PMedianModel(distance_matrix.values, frequency_data[TOTAL_EVENT].to_numpy(),
+                                     supply_positions, demand_positions, number_of_loc)
+            solution = solve_model(model, solver, hexagon_ids[candidates].tolist(), hexagon_ids.tolist(), threads,
+                                   time_limit, mip_gap, profile=self.profile)
+            sites = hexagon_ids[candidates[solution.supply_positions]]
+
+            levels.append({RESOLUTION: level, N_HEXAGONS: len(hexagon_ids), N_CANDIDATES: len(candidates),
+                           N_VARIABLES: model.n_variables, STATUS: solution.status, OBJECTIVE: solution.objective,
+                           LOWER_BOUND: solution.lower_bound, GAP: solution.gap, SECONDS: perf_counter() - start})
+
+        self.resolution = resolution
+        self.event_frequency_data = frequency_data
+        self.distance_matrix = distance_matrix
+        self.objective = solution.objective
+        self.lower_bound = solution.lower_bound
+        self.profile.update(solver=solver, n_variables=model.n_variables, n_constraints=model.n_constraints,
+                            status=solution.status, objective=solution.objective,
+                            lower_bound=solution.lower_bound, gap=solution.gap)
+
+        with self.profile.phase(EXTRACTION):
+            self.optimal_data, self.supply_data = solution_tables(solution, frequency_data, model.distances,
+                                                                  candidates)
+        self._save_results({NUMBER_OF_LOC: number_of_loc, "resolution": resolution,
+                            "coarse_resolution": coarse_resolution, "neighbours": neighbours,
+                            "n_hexagons": len(frequency_data), "n_events": frequency_data[TOTAL_EVENT].sum(),
+                            "max_distance": max_distance, "k_nearest": k_nearest, **self.profile.to_dict()})
+        return DataFrame(levels)
+
+    def decomposed_optimal_locations(self, number_of_loc: int,
+                                     frequency_data: DataFrame = None,
+                                     partition: str = "h3",
+                                     n_partitions: int = None,
+                                     max_partition_size: int = DEFAULT_MAX_PARTITION_SIZE,
+                                     allocation: str = "demand",
+                                     distance_method="haversine",
+                                     max_distance: float = None,
+                                     k_nearest: int = None,
+                                     solver: str = "auto",
+                                     time_limit: float = None,
+                                     mip_gap: float = None,
+                                     threads: int = None,
+                                     n_workers: int = None) -> DataFrame:
+        """
+        Calculates the optimal locations of a large area by solving spatial partitions of it separately.
 
-        # CONSTRAINTS
+        Parameters:
+            number_of_loc (int): The total number of optimal locations to calculate.
+            frequency_data (DataFrame): The hexagons. Default is None, which uses 'event_frequency_data'.
+            partition (str): "h3" groups the hexagons by H3 parent cell, "kmeans" clusters their centroids.
+                Default is "h3".
+            n_partitions (int): The (maximum) number of partitions. Default is None: as many as needed to keep the
+                partitions at about `max_partition_size` hexagons.
+            max_partition_size (int): See n_partitions. Default is 5,000.
+            allocation (str): "demand" splits the sites by the events and sizes of the partitions, see
+                'optimal_loc.decomposition.allocate_by_demand'. "marginal" gives every partition one site and every
+                further site to the partition whose heuristic cost it reduces the most, which is slower but usually
+                better. With fewer sites than partitions, the sites are always split by demand. Default is "demand".
+            distance_method (str or DistanceProvider): The distances within the partitions and to the sites, see
+                'create_hexagon_distance_data'. Default is "haversine".
+            max_distance, k_nearest, solver, time_limit, mip_gap, threads: As in 'calculate_optimal_locations',
+                applied to every partition.
+            n_workers (int): Number of partitions solved at the same time, on the object's thread or process pool
+                type. Default is None, which uses the n_workers of the object.
 
-        for j in demands:
-            prob += lpSum(amount_vars[i][j] for i in supplies) == 1
+        Returns:
+            DataFrame: One row per partition with its "n_hexagons", "n_events", "number_of_loc", "objective",
+            "status" and "seconds".
 
-        for i in demands:
-            for j in supplies:
-                prob += amount_vars[j][i] <= event_matrix[i][TOTAL_EVENT] * wh_vars[j]
+        Raises:
+            ValueError: If there is no frequency data or number_of_loc is larger than the number of hexagons.
 
-        prob += lpSum(wh_vars[i] for i in supplies) == number_of_loc
+        Note:
+            No distance matrix over the whole area is built: every partition gets its own (partition x partition)
+            matrix and model, and the boundary repair computes the (sites x hexagons) distances in chunks. Memory
+            and wall time therefore grow with the partition size, and the partitions run concurrently.
+            The boundary repair assigns every hexagon to its nearest chosen site, so demand close to a partition
+            border can be served from the neighbouring partition. The final objective is the weighted distance of
+            that assignment. It has no lower bound, as the partitions do not bound the whole problem.
+            The result attributes, the 'profile' and the result store are updated like in
+            'calculate_optimal_locations'.
 
-        prob.solve(PULP_CBC_CMD(msg=0))
+        Example:
+            object = OptimalLoc(n_workers=8)
+            object.event_frequency(country_events, hex_size='medium')
+            partitions = object.decomposed_optimal_locations(200, partition="kmeans", solver="heuristic")
+        """
+        if frequency_data is None:
+            frequency_data = self.event_frequency_data
+        if frequency_data is None:
+            raise ValueError("Please specify frequency_data or run event_frequency first.")
+        frequency_data = frequency_data.reset_index(drop=True)
+        resolution = h3_get_resolution(frequency_data[HEXAGON_ID].iloc[0])
+        self.profile.clear(DISTANCE_MATRIX, PIVOTING, MODEL_BUILDING, SOLVING, EXTRACTION)
+
+        with self.profile.phase(PIVOTING):
+            labels = partition_labels(frequency_data, resolution, partition, n_partitions, max_partition_size)
+        with self.profile.phase(SOLVING):
+            site_positions, partitions = solve_partitions(
+                frequency_data, labels, number_of_loc, resolution, allocation, distance_method, max_distance,
+                k_nearest, solver, time_limit, mip_gap, threads, n_workers or self.n_workers, self.executor)
+
+        with self.profile.phase(EXTRACTION):
+            nearest, distances = nearest_site_assignment(frequency_data, site_positions, resolution, distance_method)
+            events = frequency_data[TOTAL_EVENT].to_numpy()
+            solution = PMedianSolution(arange(len(site_positions)), nearest, float((events * distances).sum()),
+                                       status="decomposition")
+            self.optimal_data, self.supply_data = solution_tables(solution, frequency_data, distances, site_positions)
+
+        self.objective = solution.objective
+        self.lower_bound = None
+        self.profile.update(solver=solver, n_partitions=len(partitions), status=solution.status,
+                            objective=solution.objective, lower_bound=None, gap=None)
+        self._save_results({NUMBER_OF_LOC: number_of_loc, "resolution": resolution, "partition": partition,
+                            "allocation": allocation, "n_hexagons": len(frequency_data), "n_events": events.sum(),
+                            "max_distance": max_distance, "k_nearest": k_nearest, **self.profile.to_dict()})
+        return partitions
+
+    def calculate_coverage_locations(self, objective: str = MAX_COVERAGE,
+                                     number_of_loc: int = None,
+                                     radius: float = None,
+                                     k_ring: int = None,
+                                     frequency_data: DataFrame = None,
+                                     distance_data: DataFrame = None,
+                                     solver: str = "auto",
+                                     time_limit: float = None,
+                                     mip_gap: float = None,
+                                     threads: int = None):
+        """
+        Calculates the locations which cover the most events, or the fewest locations which cover every hexagon.
+
+        Parameters:
+            objective (str): "max_coverage" opens number_of_loc sites which cover as many events as possible.
+                "set_cover" opens as few sites as possible such that every hexagon is covered. Default is
+                "max_coverage".
+            number_of_loc (int): The number of sites to open, needed for "max_coverage".
+            radius (float): A site covers the hexagons within this distance. The distances of the object (or of
+                distance_data) are used if there are any, otherwise the great-circle distances between the
+                centroids of nearby hexagons, without a distance matrix.
+            k_ring (int): A site covers the hexagons within k_ring H3 grid steps instead. Default is None.
+            frequency_data (DataFrame): The hexagons. Default is None, which uses 'event_frequency_data'.
+            distance_data (DataFrame or DistanceMatrix): The distances for the radius. Default is None, which uses
+                the distances of the object.
+            solver (str): "highs", "cbc", "heuristic" (the greedy construction) or "auto", see
+                'calculate_optimal_locations'. Default is "auto".
+            time_limit, mip_gap, threads: As in 'calculate_optimal_locations'.
+
+        Raises:
+            ValueError: If there is no frequency data, neither radius nor k_ring is given, or "set_cover" has
+                hexagons which no site can cover.
 
-        results = self.prepare_data_tables(prob, frequency_data)
+        Returns:
+            None
+
+        Note:
+            The models only have one variable per hexagon (and one per hexagon and coverage pair in the
+            constraints), not one per hexagon pair like the p-median model, so they stay small for large areas
+            with a short coverage radius. Small models are not always quick to solve, though. The solve time
+            depends on how spread out the events are: "set_cover" over evenly spread events with a wide coverage
+            can take minutes, even after the dominated hexagons and sites are removed (see
+            'optimal_loc.coverage.CoverageModel.reduce'). "max_coverage" slows down once number_of_loc sites can
+            cover almost every event. Pass a time_limit and a mip_gap for such areas, the 'profile' holds the
+            bound. The "heuristic" solver is instant, but only gives a bound on the optimum (at most as many events
+            covered by "max_coverage", at least as many sites for "set_cover").
+            Every hexagon is assigned to its nearest site in the 'optimal_data' table, whose "covered" column
+            tells whether a site covers it. The "covered_events" of a site in 'supply_data' are the covered events
+            of the hexagons assigned to it.
+            The 'objective' attribute holds the covered events ("max_coverage") or the number of sites
+            ("set_cover"). The 'profile' and the result store are updated like in 'calculate_optimal_locations',
+            with the solver "bound" in the profile.
 
-        with open(FILENAME, 'wb') as handle:
-            pickle.dump(results, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        Example:
+            object = OptimalLoc()
+            object.event_frequency(events, hex_size='medium')
+            object.calculate_coverage_locations("max_coverage", number_of_loc=10, radius=2_000)
+            object.calculate_coverage_locations("set_cover", k_ring=2)
+        """
+        if frequency_data is None:
+            frequency_data = self.event_frequency_data
+        if frequency_data is None:
+            raise ValueError("Please specify frequency_data or run event_frequency first.")
+        if radius is None and k_ring is None:
+            raise ValueError("Please specify the coverage radius or k_ring.")
+        frequency_data = frequency_data.reset_index(drop=True)
+        hexagon_ids = frequency_data[HEXAGON_ID].tolist()
+        resolution = h3_get_resolution(hexagon_ids[0])
+        events = frequency_data[TOTAL_EVENT].to_numpy()
+        self.profile.clear(PIVOTING, MODEL_BUILDING, SOLVING, EXTRACTION)
+
+        with self.profile.phase(PIVOTING):
+            distance_matrix = self._get_distance_matrix(distance_data)
+            distances = None
+            if distance_matrix is not None:
+                distances = distance_matrix.reindex(hexagon_ids, hexagon_ids).values
+
+        with self.profile.phase(MODEL_BUILDING):
+            if k_ring is not None:
+                pairs = ring_coverage_pairs(hexagon_ids, k_ring)
+            elif distances is not None:
+                pairs = candidate_pairs(distances, max_distance=radius)
+            else:
+                pairs = radius_coverage_pairs(hexagon_ids, frequency_data[HEX_LAT], frequency_data[HEX_LON],
+                                              resolution, radius)
+            model = CoverageModel(len(hexagon_ids), events, *pairs, objective, number_of_loc)
+        solution = solve_coverage(model, solver, hexagon_ids, hexagon_ids, threads, time_limit, mip_gap,
+                                  self.profile)
+
+        with self.profile.phase(EXTRACTION):
+            site_positions = solution.supply_positions
+            if distances is not None:
+                site_distances = where(isfinite(distances[site_positions]), distances[site_positions], inf)
+                nearest = argmin(site_distances, axis=0)
+                nearest_distances = site_distances[nearest, arange(len(hexagon_ids))]
+            else:
+                nearest, nearest_distances = nearest_site_assignment(frequency_data, site_positions, resolution)
+            assignment = PMedianSolution(arange(len(site_positions)), nearest,
+                                         float((events * nearest_distances).sum()), status=solution.status)
+            self.optimal_data, self.supply_data = solution_tables(assignment, frequency_data, nearest_distances,
+                                                                  site_positions)
+            self.optimal_data[COVERED] = solution.covered
+            covered_events = bincount(nearest, events * solution.covered, minlength=len(site_positions))
+            served = Index(site_positions).get_indexer(
+                Index(hexagon_ids).get_indexer(self.supply_data[SUPPLY_HEXAGON_ID]))
+            self.supply_data[COVERED_EVENTS] = covered_events[served].astype(events.dtype)
+
+        self.objective = solution.objective
+        self.lower_bound = solution.bound if objective == SET_COVER else None
+        self.profile.update(solver=solver, n_variables=model.n_variables, n_constraints=model.n_constraints,
+                            status=solution.status, objective=solution.objective, bound=solution.bound,
+                            gap=solution.gap)
+        self._save_results({NUMBER_OF_LOC: len(site_positions), "resolution": resolution, "coverage": objective,
+                            "radius": radius, "k_ring": k_ring, "n_hexagons": len(frequency_data),
+                            "n_events": events.sum(), "covered_events": events[solution.covered].sum(),
+                            **self.profile.to_dict()})
+
+    def _save_results(self, metadata: dict) -> None:
+        self.run_id = self.results.save({OPTIMAL_DATA_COLUMN: self.optimal_data, SUPPLY_DATA_COLUMN: self.supply_data},
+                                        metadata)
 
         print(
-            """
+            f"""
             You have successfully run the algorithm. To see the optimization results, you can run 
             object_name.supply_data or object_name.optimal_data 
             OR
             You can run optimal_loc.visualize() command to see the results on a map.
+            The results were saved as run {self.run_id} in {self.results.root}.
             """
         )
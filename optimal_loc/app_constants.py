@@ -1,3 +1,6 @@
+CHANGE = "change"
+CLOSED = "closed"
+
 COLOURS_LIST = [
     'darkred',
     'orange',
@@ -7,8 +10,10 @@ COLOURS_LIST = [
     'black'
 ]
 
+COVERED = "covered"
+COVERED_EVENTS = "covered_events"
+
 DISTANCE = 'distance'
-FILENAME = 'optimal_locations.pickle'
 FROMHEX = 'fromhex'
 TOHEX = 'tohex'
 
@@ -18,20 +23,29 @@ FROMHEX_LON = 'fromhex_lon'
 TOHEX_LAT = 'tohex_lat'
 TOHEX_LON = 'tohex_lon'
 
+GAP = "gap"
+
 HAVESINE_DIST = 'haversine_dist'
-HEXAGON = "hexagon"
 HEXAGON_ID = "hexagon_id"
-HEX_ID = "hex_id"
 
 HEX_LAT = "hex_lat"
 HEX_LON = "hex_lon"
-HEX_LOCATION = "hex_location"
 
-INDEX = "index"
+KEPT = "kept"
 LATITUDE = "latitude"
 LONGITUDE = "longitude"
+LOWER_BOUND = "lower_bound"
+
+MAX_DISTANCE = "max_distance"
+MEAN_DISTANCE = "mean_distance"
+
+NUMBER_OF_LOC = "number_of_loc"
+OBJECTIVE = "objective"
 
+OPENED = "opened"
 OPTIMAL_DATA_COLUMN = "optimal_data"
+SECONDS = "seconds"
+SERVED_EVENTS = "served_events"
 SUPPLY_DATA_COLUMN = "supply_data"
 SUPPLY_HEXAGON_ID = "supply_hexagon_id"
 
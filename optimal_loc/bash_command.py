@@ -1,16 +1,28 @@
 import logging
 import os
+import shlex
 
-from optimal_loc.app_constants import FILENAME
+from optimal_loc.results import RESULTS_DIR, ResultStore
 
 PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
-def visualize():
+def visualize(run_id: str = None, results_dir: str = RESULTS_DIR):
+    """
+    Opens the Streamlit app on the results of a run.
+
+    Parameters:
+        run_id (str): The run to show first, the latest one by default. The other runs can be picked in the app.
+        results_dir (str): The result store directory. Default is "optimal_loc_results".
+    """
     app_file = os.path.join(PACKAGE_DIR, 'st_app.py')
-    if os.path.exists(FILENAME):
-        os.system(f"streamlit run {app_file}")
+    run_ids = ResultStore(results_dir).run_ids()
+    if not run_ids:
+        logging.info(f"There are no results in {os.path.abspath(results_dir)}")
+    elif run_id is not None and run_id not in run_ids:
+        logging.info(f"There is no run {run_id} in {os.path.abspath(results_dir)}")
     else:
-        logging.info(
-            f"The file {FILENAME} does not exist in the current path {os.getcwd()}"
-        )
+        arguments = f"--results-dir {shlex.quote(results_dir)}"
+        if run_id is not None:
+            arguments += f" --run-id {shlex.quote(run_id)}"
+        os.system(f"streamlit run {shlex.quote(app_file)} -- {arguments}")
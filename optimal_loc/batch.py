@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from numpy import ix_, load, save, unique
+from pandas import DataFrame, concat
+
+from optimal_loc.app import HEX_SIZE_RESOLUTIONS, set_resolution, solution_tables
+from optimal_loc.app_constants import (
+    GAP, HEXAGON_ID, LOWER_BOUND, NUMBER_OF_LOC, OBJECTIVE, OPTIMAL_DATA_COLUMN, SECONDS, SUPPLY_DATA_COLUMN,
+    TOTAL_EVENT
+)
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.indexing import frequency_table, index_events
+from optimal_loc.optimization import PMedianModel, candidate_pairs, check_candidate_pairs, solve_model
+from optimal_loc.results import ResultStore
+
+SCENARIO = "scenario"
+RESOLUTION = "resolution"
+N_HEXAGONS = "n_hexagons"
+N_EVENTS = "n_events"
+SOLVER = "solver"
+OUTPUT_PATH = "output_path"
+ERROR = "error"
+
+
+class Scenario:
+    """
+    One variant of the optimisation.
+
+    Parameters:
+        name (str): Unique name, also the name of the output directory of the scenario.
+        number_of_loc (int): The number of optimal locations to calculate.
+        hex_size (str): small, medium, big or auto. Default is 'medium'.
+        resolution (int): H3 resolution to use instead of hex_size.
+        query (str): Optional event filter, a pandas query over the raw data, e.g. "weekday < 5" or "shift == 'night'".
+        solver (str): "auto", "highs", "cbc" or "heuristic". Default is "auto".
+        max_distance (float): Optional candidate pruning, see 'OptimalLoc.calculate_optimal_locations'.
+        k_nearest (int): Optional candidate pruning, see 'OptimalLoc.calculate_optimal_locations'.
+    """
+
+    def __init__(self, name: str, number_of_loc: int, hex_size: str = 'medium', resolution: int = None,
+                 query: str = None, solver: str = "auto", max_distance: float = None, k_nearest: int = None):
+        self.name = name
+        self.number_of_loc = number_of_loc
+        self.hex_size = hex_size
+        self.resolution = resolution
+        self.query = query
+        self.solver = solver
+        self.max_distance = max_distance
+        self.k_nearest = k_nearest
+
+    def __repr__(self):
+        return f"Scenario(name={self.name!r}, number_of_loc={self.number_of_loc}, query={self.query!r})"
+
+
+def _solve_scenario(task: dict) -> dict:
+    scenario = task["scenario"]
+    start = perf_counter()
+    summary = {SCENARIO: scenario.name, NUMBER_OF_LOC: scenario.number_of_loc, RESOLUTION: task["resolution"],
+               N_HEXAGONS: len(task["frequency_data"]), N_EVENTS: int(task["frequency_data"][TOTAL_EVENT].sum()),
+               SOLVER: scenario.solver}
+    try:
+        # Every worker maps the same read-only file, only the rows/columns of this scenario are copied.
+        shared_values = load(task["matrix_path"], mmap_mode="r")
+        positions = task["positions"]
+        distances = shared_values[ix_(positions, positions)]
+
+        frequency_data = task["frequency_data"]
+        weights = frequency_data[TOTAL_EVENT].to_numpy()
+        hexagons = frequency_data[HEXAGON_ID].tolist()
+        supply_positions, demand_positions = candidate_pairs(distances, scenario.max_distance, scenario.k_nearest)
+        check_candidate_pairs(demand_positions, len(hexagons), hexagons)
+        model = PMedianModel(distances, weights, supply_positions, demand_positions, scenario.number_of_loc)
+        solution = solve_model(model, scenario.solver, hexagons, hexagons, task["solver_threads"])
+
+        optimal_data, supply_data = solution_tables(solution, frequency_data, distances)
+        summary.update({OBJECTIVE: solution.objective, LOWER_BOUND: solution.lower_bound, GAP: solution.gap})
+        store = ResultStore(task["output_dir"])
+        store.save({OPTIMAL_DATA_COLUMN: optimal_data, SUPPLY_DATA_COLUMN: supply_data},
+                   {**summary, "query": scenario.query, "status": solution.status,
+                    SECONDS: perf_counter() - start}, run_id=scenario.name)
+
+        summary.update({OUTPUT_PATH: os.path.join(store.root, scenario.name), ERROR: None})
+    except (ValueError, ImportError) as error:
+        summary.update({OBJECTIVE: None, LOWER_BOUND: None, GAP: None, OUTPUT_PATH: None, ERROR: str(error)})
+    summary[SECONDS] = perf_counter() - start
+    return summary
+
+
+def run_scenarios(raw_data: DataFrame, scenarios, output_dir: str = "optimal_loc_scenarios",
+                  max_workers: int = None, solver_threads: int = 1,
+                  distance_data: DistanceMatrix = None) -> DataFrame:
+    """
+    Solves several scenarios concurrently on a process pool.
+
+    Parameters:
+        raw_data (DataFrame): Event data with "latitude" and "longitude" columns, plus any column the scenario
+            queries use.
+        scenarios (list): Scenario objects with unique names.
+        output_dir (str): A ResultStore directory, every scenario is saved as the run <scenario name> in it.
+        max_workers (int): Size of the process pool. Default is None (the number of CPUs).
+        solver_threads (int): CBC threads per worker. Default is 1.
+        distance_data (DistanceMatrix): Optional distances to use instead of haversine distances. It must cover
+            every hexagon of the scenarios at its resolution, so it only makes sense for single resolution batches.
+
+    Returns:
+        DataFrame: One summary row per scenario with its objective, lower bound, gap, run time, output path and
+        the error message if it failed.
+
+    Note:
+        The events are indexed once per resolution. All scenarios of a resolution share one distance matrix over
+        the union of their hexagons. It is written once to a temporary .npy file which every worker memory-maps
+        read-only, so it is not pickled per task.
+
+    Example:
+        scenarios = [Scenario(f"{shift}_{k}", k, query=f"shift == '{shift}'")
+                     for shift in ("day", "night") for k in (5, 10)]
+        summary = run_scenarios(events, scenarios, max_workers=4)
+    """
+    names = [scenario.name for scenario in scenarios]
+    if len(set(names)) != len(names):
+        raise ValueError("Scenario names must be unique, they are used as output directories.")
+
+    masks = {}
+    resolutions = {}
+    for scenario in scenarios:
+        masks[scenario.name] = None if scenario.query is None else raw_data.eval(scenario.query).to_numpy(dtype=bool)
+        if scenario.resolution:
+            resolutions[scenario.name] = scenario.resolution
+        elif scenario.hex_size in HEX_SIZE_RESOLUTIONS:
+            resolutions[scenario.name] = HEX_SIZE_RESOLUTIONS[scenario.hex_size]
+        else:
+            selected = raw_data if masks[scenario.name] is None else raw_data[masks[scenario.name]]
+            resolutions[scenario.name] = set_resolution(selected, scenario.hex_size)
+
+    with TemporaryDirectory() as matrix_dir:
+        tasks = []
+        for resolution in sorted(set(resolutions.values())):
+            group = [scenario for scenario in scenarios if resolutions[scenario.name] == resolution]
+            cells = index_events(raw_data, resolution)
+
+            frequencies = {}
+            for scenario in group:
+                mask = masks[scenario.name]
+                frequencies[scenario.name] = frequency_table(*unique(cells if mask is None else cells[mask],
+                                                                     return_counts=True))
+
+            hexagons = concat(frequencies.values()).drop_duplicates(HEXAGON_ID).reset_index(drop=True)
+            if distance_data is None:
+                matrix = DistanceMatrix.from_frequency_data(hexagons, resolution)
+            else:
+                matrix = distance_data.reindex(hexagons[HEXAGON_ID], hexagons[HEXAGON_ID])
+            matrix_path = os.path.join(matrix_dir, f"distances_{resolution}.npy")
+            save(matrix_path, matrix.values)
+
+            for scenario in group:
+                frequency_data = frequencies[scenario.name]
+                tasks.append({"scenario": scenario,
+                              "resolution": resolution,
+                              "frequency_data": frequency_data,
+                              "positions": matrix.from_hexagons.get_indexer(frequency_data[HEXAGON_ID]),
+                              "matrix_path": matrix_path,
+                              "solver_threads": solver_threads,
+                              "output_dir": output_dir})
+
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            summaries = list(pool.map(_solve_scenario, tasks))
+
+    return DataFrame(summaries).set_index(SCENARIO).loc[names].reset_index()
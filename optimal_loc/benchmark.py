@@ -0,0 +1,426 @@
+import argparse
+import io
+import json
+import platform
+import sys
+import tracemalloc
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timezone
+from itertools import product
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from numpy import __version__ as numpy_version, arange, clip, concatenate, unique
+from numpy.random import default_rng
+from pandas import __version__ as pandas_version, DataFrame, Index, isna, option_context
+
+from optimal_loc import __version__
+from optimal_loc.app import OptimalLoc
+from optimal_loc.app_constants import HEXAGON_ID, LATITUDE, LONGITUDE, OBJECTIVE, SUPPLY_HEXAGON_ID
+from optimal_loc.coverage import SET_COVER
+from optimal_loc.heuristics import PMedianSolution
+
+# (south, north, west, east), about 28 x 28 km of New York City.
+DEFAULT_BOUNDS = (40.60, 40.85, -74.05, -73.72)
+STAGES = ("event_frequency", "create_hexagon_distance_data", "calculate_optimal_locations", "prepare_data_tables",
+          "calculate_coverage_locations")
+CASE = "case"
+GENERATOR = "generator"
+N_EVENTS = "n_events"
+RESOLUTION = "resolution"
+NUMBER_OF_LOC = "number_of_loc"
+SOLVER = "solver"
+SEED = "seed"
+N_HEXAGONS = "n_hexagons"
+ERROR = "error"
+SECONDS_SUFFIX = "_seconds"
+PEAK_MB_SUFFIX = "_peak_mb"
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_OBJECTIVE_TOLERANCE = 1e-6
+DEFAULT_MIN_SECONDS = 0.05
+DEFAULT_MIN_MB = 1.0
+
+
+def _frame(latitudes, longitudes, bounds) -> DataFrame:
+    south, north, west, east = bounds
+    return DataFrame({LATITUDE: clip(latitudes, south, north), LONGITUDE: clip(longitudes, west, east)})
+
+
+def uniform_events(n_events: int, seed: int = 0, bounds: tuple = DEFAULT_BOUNDS) -> DataFrame:
+    """Events spread uniformly over the bounds (south, north, west, east), every hexagon about equally busy."""
+    rng = default_rng(seed)
+    south, north, west, east = bounds
+    return _frame(rng.uniform(south, north, n_events), rng.uniform(west, east, n_events), bounds)
+
+
+def clustered_events(n_events: int, seed: int = 0, bounds: tuple = DEFAULT_BOUNDS, n_clusters: int = 20,
+                     spread: float = 0.01) -> DataFrame:
+    """
+    Events around `n_clusters` uniformly placed centres, with a normal spread of `spread` degrees, equally many
+    per cluster on average. Few busy hexagons and many empty ones.
+    """
+    rng = default_rng(seed)
+    south, north, west, east = bounds
+    centres = rng.uniform((south, west), (north, east), (n_clusters, 2))
+    cluster = rng.integers(0, n_clusters, n_events)
+    points = centres[cluster] + rng.normal(0, spread, (n_events, 2))
+    return _frame(points[:, 0], points[:, 1], bounds)
+
+
+def city_events(n_events: int, seed: int = 0, bounds: tuple = DEFAULT_BOUNDS, n_hotspots: int = 50) -> DataFrame:
+    """
+    City-like events: 30% in a wide downtown core, 60% in hotspots whose sizes follow a power law (a few very busy
+    places and a long tail) and 10% uniform background, so the hexagon counts are heavily skewed.
+    """
+    rng = default_rng(seed)
+    south, north, west, east = bounds
+    centre = ((south + north) / 2, (west + east) / 2)
+    n_core, n_hotspot = int(n_events * 0.3), int(n_events * 0.6)
+    n_background = n_events - n_core - n_hotspot
+
+    core = rng.normal(centre, ((north - south) / 10, (east - west) / 10), (n_core, 2))
+    hotspots = rng.uniform((south, west), (north, east), (n_hotspots, 2))
+    weights = 1 / arange(1, n_hotspots + 1) ** 1.2
+    hotspot = rng.choice(n_hotspots, n_hotspot, p=weights / weights.sum())
+    spots = hotspots[hotspot] + rng.normal(0, 0.003, (n_hotspot, 2))
+    background = rng.uniform((south, west), (north, east), (n_background, 2))
+
+    points = concatenate([core, spots, background])[rng.permutation(n_events)]
+    return _frame(points[:, 0], points[:, 1], bounds)
+
+
+GENERATORS = {"uniform": uniform_events, "clustered": clustered_events, "city": city_events}
+
+
+class BenchmarkCase:
+    """
+    One benchmark configuration: a synthetic event set and the optimisation run on it.
+
+    Parameters:
+        generator (str): "uniform", "clustered" or "city", see GENERATORS.
+        n_events (int): Number of generated events.
+        resolution (int): H3 resolution, which sets the number of hexagons together with the events.
+        number_of_loc (int): The number of optimal locations.
+        solver (str): "auto", "highs", "cbc" or "heuristic". Default is "heuristic".
+        seed (int): Seed of the generator, the same seed always gives the same events. Default is 0.
+        max_distance (float): Optional candidate pruning, see 'OptimalLoc.calculate_optimal_locations'.
+        k_nearest (int): Optional candidate pruning, see 'OptimalLoc.calculate_optimal_locations'.
+        k_ring (int): Solves the set covering model with this coverage ring instead of the p-median model, see
+            'OptimalLoc.calculate_coverage_locations'. number_of_loc is not used then. Default is None.
+        time_limit (float): Optional time limit of the solver in seconds. Default is None.
+    """
+
+    def __init__(self, generator: str, n_events: int, resolution: int, number_of_loc: int,
+                 solver: str = "heuristic", seed: int = 0, max_distance: float = None, k_nearest: int = None,
+                 k_ring: int = None, time_limit: float = None):
+        if generator not in GENERATORS:
+            raise ValueError(f"generator must be one of {sorted(GENERATORS)}.")
+        self.generator = generator
+        self.n_events = n_events
+        self.resolution = resolution
+        self.number_of_loc = number_of_loc
+        self.solver = solver
+        self.seed = seed
+        self.max_distance = max_distance
+        self.k_nearest = k_nearest
+        self.k_ring = k_ring
+        self.time_limit = time_limit
+
+    @property
+    def name(self) -> str:
+        """Stable id of the case, the key runs are compared on."""
+        model = f"k{self.number_of_loc}" if self.k_ring is None else f"cover{self.k_ring}"
+        name = f"{self.generator}-{self.n_events}-r{self.resolution}-{model}-{self.solver}-s{self.seed}"
+        if self.max_distance is not None:
+            name += f"-d{self.max_distance:g}"
+        if self.k_nearest is not None:
+            name += f"-n{self.k_nearest}"
+        if self.time_limit is not None:
+            name += f"-t{self.time_limit:g}"
+        return name
+
+    def events(self) -> DataFrame:
+        return GENERATORS[self.generator](self.n_events, self.seed)
+
+    def __repr__(self):
+        return f"BenchmarkCase({self.name!r})"
+
+
+def benchmark_cases(generators=tuple(GENERATORS), n_events=(10_000, 100_000), resolutions=(7, 8),
+                    numbers_of_loc=(5, 20), solver: str = "heuristic", seed: int = 0, k_rings=None,
+                    time_limit: float = None) -> list:
+    """
+    Every combination of the given generators, event counts, resolutions and numbers of locations, or of the
+    coverage rings of set covering cases if k_rings are given.
+    """
+    models = [(number_of_loc, None) for number_of_loc in numbers_of_loc] if k_rings is None else \
+        [(None, k_ring) for k_ring in k_rings]
+    return [BenchmarkCase(generator, events, resolution, number_of_loc, solver, seed, k_ring=k_ring,
+                          time_limit=time_limit)
+            for generator, events, resolution, (number_of_loc, k_ring) in product(generators, n_events, resolutions,
+                                                                                   models)]
+
+
+DEFAULT_CASES = benchmark_cases()
+QUICK_CASES = benchmark_cases(n_events=(10_000,), resolutions=(7,), numbers_of_loc=(5,))
+# About 600 to 1,100 hexagons at resolution 8, each covering the 37 hexagons within 3 grid steps. The uniform
+# events are the hard case: HiGHS usually stops at the time limit a few sites above its bound.
+SET_COVER_CASES = [BenchmarkCase(generator, events, 8, None, "highs", k_ring=3, time_limit=120)
+                   for generator, events in (("clustered", 20_000), ("city", 20_000), ("uniform", 5_000))]
+
+
+@contextmanager
+def measured(record: dict, stage: str, memory: bool = True):
+    """
+    Records the wall time of the block as "<stage>_seconds" and, with memory, the peak memory it allocated on top
+    of what existed before as "<stage>_peak_mb".
+
+    Note:
+        The memory is traced with tracemalloc, which sees the Python and NumPy allocations but not the memory of
+        native solvers (HiGHS) or solver processes (CBC). Tracing also slows Python heavy code down a little, so
+        only compare runs made with the same memory setting.
+    """
+    if memory:
+        tracemalloc.start()
+    start = perf_counter()
+    try:
+        yield record
+    finally:
+        record[stage + SECONDS_SUFFIX] = perf_counter() - start
+        if memory:
+            record[stage + PEAK_MB_SUFFIX] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+
+def _solution(sol: OptimalLoc) -> PMedianSolution:
+    # The optimal_data rows are the demand hexagons in frequency order, so the supply column is the assignment.
+    hexagons = Index(sol.event_frequency_data[HEXAGON_ID])
+    assignment = hexagons.get_indexer(sol.optimal_data[SUPPLY_HEXAGON_ID])
+    return PMedianSolution(unique(assignment), assignment, sol.objective, sol.lower_bound)
+
+
+def run_case(case: BenchmarkCase, memory: bool = True) -> dict:
+    """
+    Runs the stages of the pipeline on the events of the case.
+
+    Returns:
+        dict: The case parameters, "n_hexagons", the model size and solution from the profile ("n_variables",
+        "n_constraints", "status", "objective", ...), "<stage>_seconds" and "<stage>_peak_mb" of every stage in
+        STAGES which ran (set covering cases only run event_frequency and calculate_coverage_locations),
+        "<phase>_seconds" of the model_building, solving and extraction phases, and the "error" message if the case
+        failed, e.g. because max_distance / k_nearest made it infeasible.
+    """
+    record = {CASE: case.name, GENERATOR: case.generator, N_EVENTS: case.n_events, RESOLUTION: case.resolution,
+              NUMBER_OF_LOC: case.number_of_loc, SOLVER: case.solver, SEED: case.seed}
+    events = case.events()
+    with TemporaryDirectory() as results_dir, redirect_stdout(io.StringIO()):
+        sol = OptimalLoc(results_dir=results_dir)
+        try:
+            with measured(record, "event_frequency", memory):
+                sol.event_frequency(events, resolution=case.resolution)
+            record[N_HEXAGONS] = len(sol.event_frequency_data)
+            if case.k_ring is not None:
+                with measured(record, "calculate_coverage_locations", memory):
+                    sol.calculate_coverage_locations(SET_COVER, k_ring=case.k_ring, solver=case.solver,
+                                                     time_limit=case.time_limit)
+            else:
+                with measured(record, "create_hexagon_distance_data", memory):
+                    sol.create_hexagon_distance_data()
+                with measured(record, "calculate_optimal_locations", memory):
+                    sol.calculate_optimal_locations(case.number_of_loc, max_distance=case.max_distance,
+                                                    k_nearest=case.k_nearest, solver=case.solver,
+                                                    time_limit=case.time_limit)
+            record.update(sol.profile.info)
+            for phase in ("model_building", "solving", "extraction"):
+                record[phase + SECONDS_SUFFIX] = sol.profile.phases.get(phase)
+
+            if case.k_ring is None:
+                frequency_data = sol.event_frequency_data
+                hexagon_ids = frequency_data[HEXAGON_ID].tolist()
+                distances = sol.distance_matrix.reindex(hexagon_ids, hexagon_ids).values
+                solution = _solution(sol)
+                with measured(record, "prepare_data_tables", memory):
+                    sol.prepare_data_tables(solution, frequency_data, distances)
+            record[ERROR] = None
+        except (ValueError, ImportError) as error:
+            record[ERROR] = str(error)
+    return record
+
+
+def run_benchmarks(cases=None, repeat: int = 1, memory: bool = True, progress=None) -> DataFrame:
+    """
+    Runs every case `repeat` times.
+
+    Parameters:
+        cases (list): BenchmarkCase objects. Default is None, which runs DEFAULT_CASES.
+        repeat (int): Runs per case. The fastest time and the largest memory of the runs are kept. Default is 1.
+        memory (bool): Trace the peak memory of every stage, see 'measured'. Default is True.
+        progress (callable): Optional hook, called as progress(record) after every run.
+
+    Returns:
+        DataFrame: One row per case, see 'run_case'.
+
+    Example:
+        results = run_benchmarks(benchmark_cases(generators=("city",), n_events=(1_000_000,)), repeat=3)
+    """
+    records = []
+    for case in DEFAULT_CASES if cases is None else cases:
+        for _ in range(repeat):
+            record = run_case(case, memory)
+            records.append(record)
+            if progress is not None:
+                progress(record)
+    results = DataFrame(records)
+    if repeat > 1 and len(results):
+        aggregations = {column: "min" if column.endswith(SECONDS_SUFFIX) else
+                        "max" if column.endswith(PEAK_MB_SUFFIX) else "first"
+                        for column in results.columns if column != CASE}
+        results = results.groupby(CASE, sort=False).agg(aggregations).reset_index()
+    return results
+
+
+def environment() -> dict:
+    """The versions a benchmark ran with, saved next to a baseline."""
+    return {"python": platform.python_version(), "platform": platform.platform(), "machine": platform.machine(),
+            "numpy": numpy_version, "pandas": pandas_version, "optimal_loc": __version__}
+
+
+def save_baseline(results: DataFrame, path: str) -> None:
+    """Writes the results as a JSON baseline, with the creation time and the 'environment'."""
+    baseline = {"created": datetime.now(timezone.utc).isoformat(), "environment": environment(),
+                "results": json.loads(results.to_json(orient="records"))}
+    with open(path, "w") as handle:
+        json.dump(baseline, handle, indent=1)
+
+
+def load_baseline(path: str) -> DataFrame:
+    with open(path) as handle:
+        return DataFrame(json.load(handle)["results"])
+
+
+def compare_to_baseline(results: DataFrame, baseline: DataFrame, tolerance: float = DEFAULT_TOLERANCE,
+                        min_seconds: float = DEFAULT_MIN_SECONDS, min_mb: float = DEFAULT_MIN_MB,
+                        objective_tolerance: float = DEFAULT_OBJECTIVE_TOLERANCE) -> DataFrame:
+    """
+    Compares the time, memory and objective of every case with the baseline.
+
+    Parameters:
+        results (DataFrame): The output of 'run_benchmarks'.
+        baseline (DataFrame): Earlier results, e.g. from 'load_baseline'.
+        tolerance (float): A time or memory metric regressed when it grew by more than this fraction. Default is
+            0.25.
+        min_seconds (float): Times below this in both runs are noise and never regress. Default is 0.05.
+        min_mb (float): Memory below this in both runs never regresses. Default is 1 MB.
+        objective_tolerance (float): The objective regressed when it grew by more than this fraction, e.g. the
+            mip_gap of the runs. Default is 1e-6, the seeded cases are deterministic.
+
+    Returns:
+        DataFrame: One row per case and metric with the "baseline" and "current" values, their "ratio" and
+        whether it is a "regression". Cases missing from either side are left out.
+
+    Note:
+        The objective is compared too, so a faster but worse heuristic shows up as a regression. A case which
+        fails now but did not fail in the baseline is an "error" regression.
+    """
+    metrics = [column for column in results.columns
+               if column.endswith(SECONDS_SUFFIX) or column.endswith(PEAK_MB_SUFFIX) or column == OBJECTIVE]
+    metrics = [metric for metric in metrics if metric in baseline.columns]
+    current = results.set_index(CASE)[metrics].astype(float)
+    previous = baseline.set_index(CASE)[metrics].astype(float)
+    cases = current.index.intersection(previous.index)
+
+    rows = []
+    for metric in metrics:
+        floor = min_seconds if metric.endswith(SECONDS_SUFFIX) else min_mb if metric.endswith(PEAK_MB_SUFFIX) else 0
+        allowed = objective_tolerance if metric == OBJECTIVE else tolerance
+        for case in cases:
+            old, new = previous.at[case, metric], current.at[case, metric]
+            if isna(old) or isna(new):
+                continue
+            ratio = new / old if old else None
+            regression = max(old, new) >= floor and new > old * (1 + allowed)
+            rows.append({CASE: case, "metric": metric, "baseline": old, "current": new, "ratio": ratio,
+                         "regression": bool(regression)})
+    if ERROR in results.columns:
+        failed = results.set_index(CASE)[ERROR].reindex(cases)
+        passed = baseline.set_index(CASE)[ERROR].reindex(cases).isna() if ERROR in baseline.columns else True
+        for case in cases[(failed.notna() & passed).to_numpy()]:
+            rows.append({CASE: case, "metric": ERROR, "baseline": None, "current": failed[case], "ratio": None,
+                         "regression": True})
+    return DataFrame(rows, columns=[CASE, "metric", "baseline", "current", "ratio", "regression"])
+
+
+def main(argv=None) -> int:
+    """
+    Command line entry point, `python -m optimal_loc.benchmark`.
+
+    Example:
+        python -m optimal_loc.benchmark --quick --save-baseline baseline.json
+        python -m optimal_loc.benchmark --quick --baseline baseline.json  # exits with 1 on a regression
+        python -m optimal_loc.benchmark --generators city --events 20000 --resolutions 8 --k-ring 3 --solver highs
+    """
+    parser = argparse.ArgumentParser(prog="python -m optimal_loc.benchmark",
+                                     description="Runs the optimal_loc benchmark suite on synthetic events.")
+    parser.add_argument("--quick", action="store_true", help="only run one small case per generator")
+    parser.add_argument("--generators", nargs="+", choices=sorted(GENERATORS), default=list(GENERATORS))
+    parser.add_argument("--events", nargs="+", type=int, help="event counts, e.g. 10000 100000")
+    parser.add_argument("--resolutions", nargs="+", type=int, help="H3 resolutions, e.g. 7 8")
+    parser.add_argument("--k", nargs="+", type=int, help="numbers of locations, e.g. 5 20")
+    parser.add_argument("--k-ring", nargs="+", type=int,
+                        help="solve the set covering model with these coverage rings instead, e.g. 2 3")
+    parser.add_argument("--solver", default="heuristic")
+    parser.add_argument("--time-limit", type=float, help="time limit of the solver in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="do not trace the peak memory")
+    parser.add_argument("--output", help="write the results to this CSV file")
+    parser.add_argument("--baseline", help="compare the results with this baseline JSON file")
+    parser.add_argument("--save-baseline", help="write the results as a baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--objective-tolerance", type=float, default=DEFAULT_OBJECTIVE_TOLERANCE)
+    arguments = parser.parse_args(argv)
+
+    grid = {"n_events": (10_000,), "resolutions": (7,), "numbers_of_loc": (5,)} if arguments.quick else {}
+    for option, key in ((arguments.events, "n_events"), (arguments.resolutions, "resolutions"),
+                        (arguments.k, "numbers_of_loc")):
+        if option:
+            grid[key] = tuple(option)
+    cases = benchmark_cases(tuple(arguments.generators), solver=arguments.solver, seed=arguments.seed,
+                            k_rings=arguments.k_ring, time_limit=arguments.time_limit, **grid)
+
+    def progress(record):
+        if record[ERROR] is not None:
+            print(f"{record[CASE]} failed: {record[ERROR]}", file=sys.stderr)
+            return
+        seconds = ", ".join(f"{stage}={record[stage + SECONDS_SUFFIX]:.3f}s" for stage in STAGES
+                            if stage + SECONDS_SUFFIX in record)
+        print(f"{record[CASE]}: {record[N_HEXAGONS]} hexagons, {seconds}", file=sys.stderr)
+
+    results = run_benchmarks(cases, arguments.repeat, not arguments.no_memory, progress)
+    if arguments.output:
+        results.to_csv(arguments.output, index=False)
+    if arguments.save_baseline:
+        save_baseline(results, arguments.save_baseline)
+
+    columns = [CASE, N_HEXAGONS, "n_variables", OBJECTIVE] + [stage + SECONDS_SUFFIX for stage in STAGES]
+    if not arguments.no_memory:
+        columns += [stage + PEAK_MB_SUFFIX for stage in STAGES]
+    if results[ERROR].notna().any():
+        columns.append(ERROR)
+    with option_context("display.width", 200, "display.max_columns", None):
+        print(results[[column for column in columns if column in results.columns]].to_string(index=False))
+
+    if arguments.baseline:
+        comparison = compare_to_baseline(results, load_baseline(arguments.baseline), arguments.tolerance,
+                                         objective_tolerance=arguments.objective_tolerance)
+        regressions = comparison[comparison["regression"]]
+        if len(regressions):
+            print(f"\n{len(regressions)} regressions against {arguments.baseline}:")
+            print(regressions.to_string(index=False))
+            return 1
+        print(f"\nNo regressions against {arguments.baseline} ({len(comparison)} metrics compared).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
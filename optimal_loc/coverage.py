@@ -0,0 +1,353 @@
+from math import ceil
+
+from numpy import (
+    arange, argmax, asarray, bincount, concatenate, flatnonzero, float64, full, inf, ones, r_, repeat, zeros
+)
+from pandas import Index
+from pulp import (
+    LpAffineExpression, LpConstraint, LpConstraintEQ, LpConstraintGE, LpConstraintLE, LpMaximize, LpMinimize,
+    LpProblem, LpSolutionIntegerFeasible, LpSolutionOptimal, LpStatus, LpStatusNotSolved, LpVariable, PULP_CBC_CMD
+)
+from h3 import edge_length, k_ring
+
+from optimal_loc.distances import haversine_pairs
+from optimal_loc.optimization import NUMBER_OF_LOC_CONSTRAINT, OPTIMAL, TIME_LIMIT, resolve_solver
+from optimal_loc.profiling import SOLVING, timed
+
+try:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import coo_matrix, hstack, identity, vstack
+except ImportError:
+    milp = None
+
+MAX_COVERAGE = "max_coverage"
+SET_COVER = "set_cover"
+COVERAGE_OBJECTIVES = (MAX_COVERAGE, SET_COVER)
+
+
+def ring_coverage_pairs(hexagon_ids, k: int):
+    """
+    Coverage pairs from H3 neighbourhoods: every hexagon covers itself and the hexagons within k grid steps.
+
+    Returns:
+        tuple: (site positions, demand positions) of the pairs, both positions in hexagon_ids.
+    """
+    hexagon_ids = list(hexagon_ids)
+    rings = [list(k_ring(hexagon_id, k)) for hexagon_id in hexagon_ids]
+    site_positions = repeat(arange(len(hexagon_ids)), [len(ring) for ring in rings])
+    demand_positions = Index(hexagon_ids).get_indexer(concatenate(rings)) if rings else zeros(0, dtype=int)
+    keep = demand_positions >= 0
+    return site_positions[keep], demand_positions[keep]
+
+
+def radius_coverage_pairs(hexagon_ids, latitudes, longitudes, resolution: int, radius: float):
+    """
+    Coverage pairs within `radius` metres (great-circle distance between the centroids), without a distance matrix.
+
+    Only the hexagons of a k-ring around every hexagon which is large enough to hold the radius are measured, so
+    the work grows with the number of hexagons times the ring size, not with the number of hexagons squared.
+    """
+    # Centroids k grid steps apart are at least k * 1.5 edge lengths apart, plus one ring for the distortion.
+    k = ceil(radius / (1.5 * edge_length(resolution, "m"))) + 1
+    site_positions, demand_positions = ring_coverage_pairs(hexagon_ids, k)
+    latitudes, longitudes = asarray(latitudes, dtype=float64), asarray(longitudes, dtype=float64)
+    keep = haversine_pairs(latitudes[site_positions], longitudes[site_positions],
+                           latitudes[demand_positions], longitudes[demand_positions]) <= radius
+    return site_positions[keep], demand_positions[keep]
+
+
+def contained_pairs(matrix):
+    """
+    Pairs of rows of a sparse 0/1 matrix where the first row is contained in the second one, from the overlaps of
+    every two rows. Of two equal rows only the pair (first, later) is returned.
+
+    Returns:
+        tuple: (positions of the contained rows, positions of the rows containing them).
+    """
+    matrix = matrix.tocsr()
+    sizes = asarray(matrix.sum(axis=1)).ravel()
+    overlaps = (matrix @ matrix.T).tocoo()
+    smaller, larger = overlaps.row, overlaps.col
+    contained = (overlaps.data == sizes[smaller]) & ((sizes[larger] > sizes[smaller]) | (larger > smaller))
+    return smaller[contained], larger[contained]
+
+
+class CoverageSolution:
+    """
+    A coverage solution in matrix positions.
+
+    Attributes:
+        supply_positions (ndarray): Sorted positions of the chosen sites.
+        covered (ndarray): Whether each demand is covered by one of the sites.
+        objective (float): The covered events (max_coverage) or the number of sites (set_cover).
+        bound (float): The best possible objective proven by the solver, an upper bound for max_coverage and a lower
+            bound for set_cover, or None.
+        status (str): "optimal", "time_limit" or "heuristic".
+    """
+
+    def __init__(self, supply_positions, covered, objective: float, bound: float = None, status: str = None):
+        self.supply_positions = supply_positions
+        self.covered = covered
+        self.objective = objective
+        self.bound = bound
+        self.status = status
+
+    @property
+    def gap(self):
+        """Relative gap between the objective and the bound."""
+        if self.bound is None or self.objective == 0:
+            return None
+        return abs(self.bound - self.objective) / abs(self.objective)
+
+    def __repr__(self):
+        return (f"CoverageSolution(number_of_loc={len(self.supply_positions)}, objective={self.objective:.6g}, "
+                f"bound={self.bound}, status={self.status!r})")
+
+
+class CoverageModel:
+    """
+    The maximal covering and the location set covering model over coverage pairs.
+
+    Variables are the sites y (one per supply) and, for max_coverage, one coverage variable z per demand. There
+    are no assignment variables, so the model grows with the number of hexagons and coverage pairs, not with the
+    number of hexagons squared.
+        - max_coverage: maximise sum_j w_j z_j  s.t.  z_j <= sum_(i covers j) y_i,  sum_i y_i == number_of_loc
+        - set_cover:    minimise sum_i y_i      s.t.  sum_(i covers j) y_i >= 1
+
+    Parameters:
+        n_supplies (int): Number of candidate sites.
+        weights (array-like): Demand weights, i.e. total events per demand hexagon.
+        supply_positions (ndarray): Site positions of the coverage pairs.
+        demand_positions (ndarray): Demand positions of the coverage pairs.
+        objective (str): "max_coverage" or "set_cover". Default is "max_coverage".
+        number_of_loc (int): Number of sites to open, needed for max_coverage.
+
+    Raises:
+        ValueError: If the objective is unknown, or max_coverage has no number_of_loc.
+    """
+
+    def __init__(self, n_supplies: int, weights, supply_positions, demand_positions, objective: str = MAX_COVERAGE,
+                 number_of_loc: int = None):
+        if objective not in COVERAGE_OBJECTIVES:
+            raise ValueError(f"objective must be one of {COVERAGE_OBJECTIVES}.")
+        if objective == MAX_COVERAGE and number_of_loc is None:
+            raise ValueError("max_coverage needs the number_of_loc.")
+        self.objective = objective
+        self.n_supplies = n_supplies
+        self.weights = asarray(weights, dtype=float64)
+        self.n_demands = len(self.weights)
+        self.supply_positions = asarray(supply_positions)
+        self.demand_positions = asarray(demand_positions)
+        self.number_of_loc = number_of_loc
+
+    @property
+    def n_pairs(self) -> int:
+        return len(self.supply_positions)
+
+    @property
+    def n_variables(self) -> int:
+        return self.n_supplies + (self.n_demands if self.objective == MAX_COVERAGE else 0)
+
+    @property
+    def n_constraints(self) -> int:
+        return self.n_demands + (1 if self.objective == MAX_COVERAGE else 0)
+
+    def uncovered_demands(self):
+        """Positions of the demands which no site can cover."""
+        covered = zeros(self.n_demands, dtype=bool)
+        covered[self.demand_positions] = True
+        return flatnonzero(~covered)
+
+    def coverage_matrix(self):
+        """Sparse (n_demands, n_supplies) matrix, 1 where the site covers the demand."""
+        return coo_matrix((ones(self.n_pairs), (self.demand_positions, self.supply_positions)),
+                          shape=(self.n_demands, self.n_supplies)).tocsr()
+
+    def reduce(self):
+        """
+        Removes the dominated demands and sites of a set_cover model until there are none left:
+            - a demand whose sites include all the sites of another demand is covered whenever that one is,
+            - a site whose demands are all demands of another site can be swapped for that site.
+
+        Returns:
+            tuple: (positions of the remaining sites, positions of the remaining demands, the reduced CoverageModel
+            in these positions). An optimal solution of the reduced model is an optimal solution of this one.
+
+        Note:
+            The overlaps of every two demands and every two sites are counted, which is cheap for short coverage
+            radii but grows with the square of the number of sites covering a demand.
+        """
+        coverage = self.coverage_matrix()
+        sites, demands = arange(self.n_supplies), arange(self.n_demands)
+        while True:
+            _, dominated = contained_pairs(coverage)
+            keep = ones(len(demands), dtype=bool)
+            keep[dominated] = False
+            coverage, demands = coverage[keep], demands[keep]
+
+            site_coverage = coverage.T.tocsr()
+            dominated, _ = contained_pairs(site_coverage)
+            keep_sites = site_coverage.getnnz(axis=1) > 0
+            keep_sites[dominated] = False
+            coverage, sites = coverage[:, keep_sites], sites[keep_sites]
+            if keep.all() and keep_sites.all():
+                break
+
+        coverage = coverage.tocoo()
+        return sites, demands, CoverageModel(len(sites), self.weights[demands], coverage.col, coverage.row,
+                                             self.objective, self.number_of_loc)
+
+    def solution_from_sites(self, sites, bound: float = None, status: str = None) -> CoverageSolution:
+        sites = asarray(sorted(sites), dtype=int)
+        is_site = zeros(self.n_supplies, dtype=bool)
+        is_site[sites] = True
+        covered = zeros(self.n_demands, dtype=bool)
+        covered[self.demand_positions[is_site[self.supply_positions]]] = True
+        objective = float(self.weights[covered].sum()) if self.objective == MAX_COVERAGE else float(len(sites))
+        return CoverageSolution(sites, covered, objective, bound, status)
+
+    def solve_greedy(self) -> CoverageSolution:
+        """
+        Opens the site which covers the most uncovered events (max_coverage) or demands (set_cover) until
+        number_of_loc sites are open or every demand is covered. For set_cover, the sites whose demands are all
+        covered by other sites are then closed again, the last opened first.
+        """
+        covered = zeros(self.n_demands, dtype=bool)
+        available = ones(self.n_supplies, dtype=bool)
+        sites = []
+        weights = self.weights if self.objective == MAX_COVERAGE else ones(self.n_demands)
+        while available.any() and (len(sites) < self.number_of_loc if self.objective == MAX_COVERAGE
+                                   else not covered.all()):
+            gains = bincount(self.supply_positions, weights=(weights * ~covered)[self.demand_positions],
+                             minlength=self.n_supplies)
+            gains[~available] = -inf
+            site = int(argmax(gains))
+            sites.append(site)
+            available[site] = False
+            covered[self.demand_positions[self.supply_positions == site]] = True
+        if self.objective == SET_COVER:
+            is_site = zeros(self.n_supplies, dtype=bool)
+            is_site[sites] = True
+            cover_counts = bincount(self.demand_positions[is_site[self.supply_positions]], minlength=self.n_demands)
+            for site in reversed(sites):
+                site_demands = self.demand_positions[self.supply_positions == site]
+                if (cover_counts[site_demands] > 1).all():
+                    cover_counts[site_demands] -= 1
+                    is_site[site] = False
+            sites = flatnonzero(is_site)
+        return self.solution_from_sites(sites, status="heuristic")
+
+    def solve_highs(self, time_limit: float = None, mip_gap: float = None) -> CoverageSolution:
+        """Solves the model in-process with HiGHS through scipy.optimize.milp."""
+        options = {}
+        if time_limit is not None:
+            options["time_limit"] = time_limit
+        if mip_gap is not None:
+            options["mip_rel_gap"] = mip_gap
+
+        coverage = self.coverage_matrix()
+        if self.objective == MAX_COVERAGE:
+            # z_j - sum_i a_ji y_i <= 0, then sum_i y_i == number_of_loc. Maximising is minimising -w z.
+            number_of_loc_row = coo_matrix(r_[ones(self.n_supplies), zeros(self.n_demands)][None, :])
+            matrix = vstack([hstack([-coverage, identity(self.n_demands)]), number_of_loc_row]).tocsr()
+            lower = r_[full(self.n_demands, -inf), self.number_of_loc]
+            upper = r_[zeros(self.n_demands), self.number_of_loc]
+            costs = r_[zeros(self.n_supplies), -self.weights]
+            integrality = r_[ones(self.n_supplies), zeros(self.n_demands)]
+        else:
+            matrix, lower, upper = coverage, ones(self.n_demands), full(self.n_demands, inf)
+            costs = ones(self.n_supplies)
+            integrality = ones(self.n_supplies)
+
+        result = milp(c=costs, constraints=LinearConstraint(matrix, lower, upper), integrality=integrality,
+                      bounds=Bounds(0, 1), options=options)
+        if result.x is None:
+            raise ValueError(f"The solver could not find a solution: {result.message}")
+        bound = getattr(result, "mip_dual_bound", None)
+        if bound is not None:
+            bound = -float(bound) if self.objective == MAX_COVERAGE else float(bound)
+        return self.solution_from_sites(flatnonzero(result.x[:self.n_supplies] > 0.5), bound,
+                                        OPTIMAL if result.status == 0 else TIME_LIMIT)
+
+    def solve_cbc(self, supplies, demands, threads: int = None, time_limit: float = None,
+                  mip_gap: float = None) -> CoverageSolution:
+        """
+        Solves the model with CBC through PuLP.
+
+        Parameters:
+            supplies (list): Site ids, used in the variable names.
+            demands (list): Demand ids, used in the variable names.
+        """
+        maximise = self.objective == MAX_COVERAGE
+        prob = LpProblem("Coverage", LpMaximize if maximise else LpMinimize)
+        site_vars = [LpVariable(f"Supply_{supply}", cat='Binary') for supply in supplies]
+        covering = [[] for _ in range(self.n_demands)]
+        for s, d in zip(self.supply_positions.tolist(), self.demand_positions.tolist()):
+            covering[d].append((site_vars[s], 1))
+
+        if maximise:
+            cover_vars = [LpVariable(f"Covered_{demand}", lowBound=0, upBound=1) for demand in demands]
+            prob += LpAffineExpression(zip(cover_vars, self.weights.tolist()))
+            for cover_var, sites in zip(cover_vars, covering):
+                prob += LpConstraint(LpAffineExpression([(cover_var, 1)] + [(var, -1) for var, _ in sites]),
+                                     LpConstraintLE, rhs=0)
+            prob += LpConstraint(LpAffineExpression([(var, 1) for var in site_vars]), LpConstraintEQ,
+                                 name=NUMBER_OF_LOC_CONSTRAINT, rhs=self.number_of_loc)
+        else:
+            prob += LpAffineExpression([(var, 1) for var in site_vars])
+            for sites in covering:
+                prob += LpConstraint(LpAffineExpression(sites), LpConstraintGE, rhs=1)
+
+        prob.solve(PULP_CBC_CMD(msg=0, threads=threads, timeLimit=time_limit, gapRel=mip_gap))
+        if prob.sol_status not in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+            if time_limit is not None and prob.status == LpStatusNotSolved:
+                raise ValueError(f"CBC did not find a solution within {time_limit} seconds, please increase "
+                                 f"time_limit.")
+            raise ValueError(f"The solver could not find a solution, status: {LpStatus[prob.status]}.")
+        solution = self.solution_from_sites(flatnonzero(asarray([var.varValue or 0 for var in site_vars]) > 0.5))
+        if prob.sol_status == LpSolutionOptimal:
+            # CBC only stops early on the gap, so the bound is at most that far from the objective.
+            gap = mip_gap or 0.0
+            solution.bound = solution.objective * (1 + gap) if maximise else solution.objective * (1 - gap)
+            solution.status = OPTIMAL
+        else:
+            solution.status = TIME_LIMIT
+        return solution
+
+
+def solve_coverage(model: CoverageModel, solver: str = "auto", supplies=None, demands=None, threads: int = None,
+                   time_limit: float = None, mip_gap: float = None, profile=None) -> CoverageSolution:
+    """
+    Solves the coverage model with the given solver.
+
+    Parameters:
+        model (CoverageModel): The model.
+        solver (str): "auto", "highs", "cbc" or "heuristic" (the greedy construction).
+        supplies, demands, threads, time_limit, mip_gap, profile: As in 'optimal_loc.optimization.solve_model'.
+
+    Raises:
+        ValueError: If set_cover has demands which no site can cover.
+    """
+    solver = resolve_solver(solver)
+    if model.objective == SET_COVER:
+        uncovered = model.uncovered_demands()
+        if len(uncovered):
+            examples = [demands[i] for i in uncovered[:5]] if demands is not None else list(uncovered[:5])
+            raise ValueError(f"The problem is infeasible: {len(uncovered)} demand hexagons can not be covered by "
+                             f"any site, e.g. {examples}. Please increase the radius or k_ring.")
+    with timed(profile, SOLVING):
+        if solver == "heuristic":
+            return model.solve_greedy()
+        if model.objective == MAX_COVERAGE:
+            if solver == "highs":
+                return model.solve_highs(time_limit, mip_gap)
+            return model.solve_cbc(supplies, demands, threads, time_limit, mip_gap)
+
+        # The solvers get the set_cover model without the dominated demands and sites, see 'CoverageModel.reduce'.
+        sites, demand_positions, reduced = model.reduce()
+        if solver == "highs":
+            solution = reduced.solve_highs(time_limit, mip_gap)
+        else:
+            solution = reduced.solve_cbc([supplies[i] for i in sites], [demands[i] for i in demand_positions],
+                                         threads, time_limit, mip_gap)
+        return model.solution_from_sites(sites[solution.supply_positions], solution.bound, solution.status)
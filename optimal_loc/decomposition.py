@@ -0,0 +1,285 @@
+from math import ceil
+from time import perf_counter
+
+from numpy import (
+    arange, argmax, argmin, asarray, bincount, cos, float64, floor, full, inf, minimum, radians, unique, zeros
+)
+from numpy.random import default_rng
+from pandas import DataFrame
+
+from optimal_loc.app_constants import HEX_LAT, HEX_LON, HEXAGON_ID, NUMBER_OF_LOC, OBJECTIVE, SECONDS, TOTAL_EVENT
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.indexing import EXECUTORS, cells_to_parent, strings_to_cells
+from optimal_loc.optimization import (
+    PMedianModel, candidate_pairs, check_candidate_pairs, solve_model, sweep_p_median
+)
+
+PARTITION = "partition"
+N_HEXAGONS = "n_hexagons"
+N_EVENTS = "n_events"
+STATUS = "status"
+PARTITION_METHODS = ("h3", "kmeans")
+ALLOCATION_METHODS = ("demand", "marginal")
+DEFAULT_MAX_PARTITION_SIZE = 5_000
+
+
+def h3_partitions(hexagon_ids, resolution: int, n_partitions: int = None,
+                  max_partition_size: int = DEFAULT_MAX_PARTITION_SIZE):
+    """
+    Groups the hexagons by their H3 parent.
+
+    The parent resolution is the finest one with at most `n_partitions` parents or, without n_partitions, the
+    coarsest one whose largest partition has at most `max_partition_size` hexagons.
+
+    Returns:
+        tuple: (partition label of every hexagon, parent resolution)
+    """
+    cells = strings_to_cells(hexagon_ids)
+    labels, parent_resolution = arange(len(cells)), resolution
+    for parent_resolution in range(resolution) if n_partitions is None else range(resolution - 1, -1, -1):
+        _, labels, sizes = unique(cells_to_parent(cells, parent_resolution), return_inverse=True,
+                                  return_counts=True)
+        if n_partitions is None and sizes.max() <= max_partition_size:
+            break
+        if n_partitions is not None and len(sizes) <= n_partitions:
+            break
+    # If no resolution satisfies the limit, the last one tried (the finest or the coarsest) is used.
+    return labels, parent_resolution
+
+
+def _nearest_centre(points, centres, chunk_size: int = 100_000):
+    labels = zeros(len(points), dtype=int)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        labels[start:start + chunk_size] = argmin(((chunk[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2), axis=1)
+    return labels
+
+
+def kmeans_partitions(latitudes, longitudes, n_partitions: int, max_iterations: int = 100, random_state: int = 0):
+    """
+    Clusters the hexagon centroids with k-means (k-means++ seeding, Lloyd iterations).
+
+    The longitudes are scaled by the cosine of the mean latitude, so the clusters are compact on the ground.
+
+    Returns:
+        ndarray: Partition label of every hexagon, 0 to n_partitions - 1. Clusters which end up empty are dropped
+        and the labels renumbered.
+    """
+    points = zeros((len(latitudes), 2))
+    points[:, 0] = latitudes
+    points[:, 1] = asarray(longitudes, dtype=float64) * cos(radians(asarray(latitudes, dtype=float64).mean()))
+    n_partitions = min(n_partitions, len(points))
+    generator = default_rng(random_state)
+
+    centres = [points[generator.integers(len(points))]]
+    closest = ((points - centres[0]) ** 2).sum(axis=1)
+    for _ in range(1, n_partitions):
+        total = closest.sum()
+        centre = points[generator.choice(len(points), p=closest / total)] if total > 0 else \
+            points[generator.integers(len(points))]
+        centres.append(centre)
+        closest = minimum(closest, ((points - centre) ** 2).sum(axis=1))
+    centres = asarray(centres)
+
+    labels = full(len(points), -1)
+    for _ in range(max_iterations):
+        new_labels = _nearest_centre(points, centres)
+        if (new_labels == labels).all():
+            break
+        labels = new_labels
+        counts = bincount(labels, minlength=n_partitions)
+        used = counts > 0
+        for axis in range(2):
+            centres[used, axis] = bincount(labels, points[:, axis], minlength=n_partitions)[used] / counts[used]
+    return unique(labels, return_inverse=True)[1]
+
+
+def allocate_by_demand(events, sizes, number_of_loc: int):
+    """
+    Splits number_of_loc over the partitions by their events and sizes (largest remainder method).
+
+    The shares follow the continuous approximation of the p-median, in which the best number of sites of a region
+    grows with events^(2/3) * area^(1/3). The number of hexagons stands in for the area. A partition never gets
+    more sites than it has hexagons.
+    """
+    events = asarray(events, dtype=float64)
+    sizes = asarray(sizes)
+    weights = events ** (2 / 3) * sizes ** (1 / 3)
+    shares = weights / weights.sum() * number_of_loc
+    allocation = minimum(floor(shares).astype(int), sizes)
+    while allocation.sum() < number_of_loc:
+        remainders = shares - allocation
+        remainders[allocation >= sizes] = -inf
+        allocation[argmax(remainders)] += 1
+    return allocation
+
+
+def allocate_by_marginal_cost(curves, number_of_loc: int):
+    """
+    Gives every partition one site, then each further site to the partition whose cost it reduces the most.
+
+    Parameters:
+        curves (list): For every partition, the objectives of 1, 2, ... sites.
+        number_of_loc (int): The number of sites to allocate, at least the number of partitions.
+    """
+    allocation = [1] * len(curves)
+    for _ in range(number_of_loc - len(curves)):
+        savings = [curve[sites - 1] - curve[sites] if sites < len(curve) else -inf
+                   for curve, sites in zip(curves, allocation)]
+        allocation[int(argmax(savings))] += 1
+    return asarray(allocation)
+
+
+def _partition_model(task: dict):
+    frequency_data = task["frequency_data"]
+    hexagons = frequency_data[HEXAGON_ID].tolist()
+    distances = DistanceMatrix.from_frequency_data(frequency_data, task["resolution"], task["distance_method"]).values
+    supply_positions, demand_positions = candidate_pairs(distances, task["max_distance"], task["k_nearest"])
+    check_candidate_pairs(demand_positions, len(hexagons), hexagons)
+    model = PMedianModel(distances, frequency_data[TOTAL_EVENT].to_numpy(), supply_positions, demand_positions,
+                         task["number_of_loc"])
+    return model, hexagons
+
+
+def _partition_curve(task: dict) -> list:
+    model, _ = _partition_model(task)
+    return [solution.objective for _, solution, _ in sweep_p_median(model, range(1, task["number_of_loc"] + 1),
+                                                                    "heuristic", time_limit=task["time_limit"])]
+
+
+def _solve_partition(task: dict) -> dict:
+    start = perf_counter()
+    model, hexagons = _partition_model(task)
+    solution = solve_model(model, task["solver"], hexagons, hexagons, task["threads"], task["time_limit"],
+                           task["mip_gap"])
+    return {"sites": task["positions"][solution.supply_positions], OBJECTIVE: solution.objective,
+            STATUS: solution.status, SECONDS: perf_counter() - start}
+
+
+def solve_partitions(frequency_data: DataFrame, labels, number_of_loc: int, resolution: int,
+                     allocation: str = "demand", distance_method="haversine", max_distance: float = None,
+                     k_nearest: int = None, solver: str = "auto", time_limit: float = None, mip_gap: float = None,
+                     threads: int = None, n_workers: int = None, executor: str = "thread"):
+    """
+    Allocates the sites over the partitions and solves the p-median of every partition concurrently.
+
+    Parameters:
+        frequency_data (DataFrame): The hexagons, see 'OptimalLoc.event_frequency_data'.
+        labels (ndarray): The partition of every hexagon.
+        number_of_loc (int): The total number of sites.
+        resolution (int): H3 resolution of the hexagons.
+        allocation (str): "demand" splits the sites by the events and sizes of the partitions. "marginal"
+            gives every partition one site and every further site to the partition whose heuristic cost it
+            reduces the most, which needs a cost curve per partition first. Default is "demand".
+        distance_method, max_distance, k_nearest, solver, time_limit, mip_gap, threads: As in
+            'OptimalLoc.calculate_optimal_locations', applied to every partition.
+        n_workers (int): Number of partitions solved at the same time. Default is None (one at a time).
+        executor (str): "thread" or "process" pool. Default is "thread".
+
+    Returns:
+        tuple: (positions of all the chosen sites in frequency_data, one summary row per partition)
+
+    Note:
+        Only the distance matrix and the model of the partitions in progress are in memory, so the memory use
+        grows with the partition size and `n_workers`, not with the whole area.
+    """
+    if allocation not in ALLOCATION_METHODS:
+        raise ValueError(f"allocation must be one of {ALLOCATION_METHODS}.")
+    labels = asarray(labels)
+    n_partitions = labels.max() + 1
+    sizes = bincount(labels, minlength=n_partitions)
+    events = bincount(labels, frequency_data[TOTAL_EVENT].to_numpy(), minlength=n_partitions)
+    if number_of_loc > len(frequency_data):
+        raise ValueError(f"number_of_loc must be at most the number of hexagons ({len(frequency_data)}).")
+
+    tasks = []
+    for partition in range(n_partitions):
+        positions = (labels == partition).nonzero()[0]
+        tasks.append({"frequency_data": frequency_data.iloc[positions].reset_index(drop=True),
+                      "positions": positions, "resolution": resolution, "distance_method": distance_method,
+                      "max_distance": max_distance, "k_nearest": k_nearest, "solver": solver,
+                      "time_limit": time_limit, "mip_gap": mip_gap, "threads": threads})
+
+    def run(function, selected):
+        if n_workers is None or n_workers <= 1 or len(selected) <= 1:
+            return [function(task) for task in selected]
+        with EXECUTORS[executor](max_workers=n_workers) as pool:
+            return list(pool.map(function, selected))
+
+    if allocation == "marginal" and number_of_loc >= n_partitions:
+        for task, size in zip(tasks, sizes):
+            task[NUMBER_OF_LOC] = int(min(size, number_of_loc - n_partitions + 1))
+        sites_per_partition = allocate_by_marginal_cost(run(_partition_curve, tasks), number_of_loc)
+    else:
+        # With fewer sites than partitions, some partitions get none and are served from their neighbours.
+        sites_per_partition = allocate_by_demand(events, sizes, number_of_loc)
+
+    for task, sites in zip(tasks, sites_per_partition):
+        task[NUMBER_OF_LOC] = int(sites)
+    solved = [task for task in tasks if task[NUMBER_OF_LOC] > 0]
+    results = iter(run(_solve_partition, solved))
+
+    summary = []
+    site_positions = []
+    for partition, task in enumerate(tasks):
+        row = {PARTITION: partition, N_HEXAGONS: int(sizes[partition]), N_EVENTS: int(events[partition]),
+               NUMBER_OF_LOC: task[NUMBER_OF_LOC], OBJECTIVE: None, STATUS: None, SECONDS: 0.0}
+        if task[NUMBER_OF_LOC] > 0:
+            result = next(results)
+            site_positions.append(result.pop("sites"))
+            row.update(result)
+        summary.append(row)
+    return asarray(sorted(int(site) for sites in site_positions for site in sites)), DataFrame(summary)
+
+
+def nearest_site_assignment(frequency_data: DataFrame, site_positions, resolution: int, distance_method="haversine",
+                            chunk_size: int = 50_000):
+    """
+    Assigns every hexagon to its nearest chosen site, across the partition borders.
+
+    Parameters:
+        frequency_data (DataFrame): The hexagons.
+        site_positions (ndarray): Positions of the sites in frequency_data.
+        resolution (int): H3 resolution of the hexagons.
+        distance_method (str or DistanceProvider): See 'OptimalLoc.create_hexagon_distance_data'.
+        chunk_size (int): Number of hexagons whose distances to the sites are computed at once.
+
+    Returns:
+        tuple: (index of the nearest site in site_positions for every hexagon, the distance to it)
+    """
+    sites = frequency_data.iloc[site_positions]
+    nearest = zeros(len(frequency_data), dtype=int)
+    distances = zeros(len(frequency_data))
+    for start in range(0, len(frequency_data), chunk_size):
+        chunk = frequency_data.iloc[start:start + chunk_size]
+        values = DistanceMatrix.from_frequency_data(sites, resolution, distance_method, chunk).values
+        nearest[start:start + len(chunk)] = argmin(values, axis=0)
+        distances[start:start + len(chunk)] = values[nearest[start:start + len(chunk)], arange(len(chunk))]
+    return nearest, distances
+
+
+def partition_labels(frequency_data: DataFrame, resolution: int, method: str = "h3", n_partitions: int = None,
+                     max_partition_size: int = DEFAULT_MAX_PARTITION_SIZE, random_state: int = 0):
+    """
+    Splits the hexagons into spatially coherent partitions.
+
+    Parameters:
+        frequency_data (DataFrame): The hexagons.
+        resolution (int): H3 resolution of the hexagons.
+        method (str): "h3" groups them by H3 parent, "kmeans" clusters their centroids. Default is "h3".
+        n_partitions (int): The (maximum) number of partitions. Default is None: as many as needed for
+            partitions of about `max_partition_size` hexagons.
+        max_partition_size (int): See n_partitions. Default is 5,000.
+        random_state (int): Seed of the k-means seeding.
+
+    Returns:
+        ndarray: The partition of every hexagon, 0 to the number of partitions - 1.
+    """
+    if method not in PARTITION_METHODS:
+        raise ValueError(f"method must be one of {PARTITION_METHODS}.")
+    if method == "h3":
+        return h3_partitions(frequency_data[HEXAGON_ID], resolution, n_partitions, max_partition_size)[0]
+    if n_partitions is None:
+        n_partitions = ceil(len(frequency_data) / max_partition_size)
+    return kmeans_partitions(frequency_data[HEX_LAT].to_numpy(), frequency_data[HEX_LON].to_numpy(), n_partitions,
+                             random_state=random_state)
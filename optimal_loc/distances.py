@@ -0,0 +1,325 @@
+from numpy import (
+    arcsin, arange, asarray, ascontiguousarray, concatenate, cos, empty, float32, float64, full, iinfo, int8, int16,
+    int32, int64, nan, radians, repeat, sin, sqrt, tile, zeros
+)
+from pandas import Categorical, CategoricalDtype, DataFrame, Index, factorize
+from h3 import edge_length, h3_distance
+
+from optimal_loc.app_constants import (
+    DISTANCE, FROMHEX, FROMHEX_LAT, FROMHEX_LON, HEXAGON_ID, HEX_LAT, HEX_LON, TOHEX, TOHEX_LAT, TOHEX_LON
+)
+from optimal_loc.indexing import cell_centroids
+
+EARTH_RADIUS = 6_371_008.8  # metres
+DISTANCE_METHODS = ("haversine", "h3", None)
+
+
+def haversine_distances(from_lat, from_lon, to_lat, to_lon):
+    """
+    Great-circle distances in metres between every "from" point and every "to" point.
+
+    Returns:
+        ndarray: float32 matrix of shape (len(from_lat), len(to_lat)).
+    """
+    return haversine_pairs(asarray(from_lat, dtype=float64)[:, None], asarray(from_lon, dtype=float64)[:, None],
+                           asarray(to_lat, dtype=float64)[None, :], asarray(to_lon, dtype=float64)[None, :])
+
+
+def haversine_pairs(from_lat, from_lon, to_lat, to_lon):
+    """Great-circle distances in metres between the points pair by pair, as float32 (with NumPy broadcasting)."""
+    from_lat, from_lon = radians(asarray(from_lat, dtype=float64)), radians(asarray(from_lon, dtype=float64))
+    to_lat, to_lon = radians(asarray(to_lat, dtype=float64)), radians(asarray(to_lon, dtype=float64))
+
+    a = sin((to_lat - from_lat) / 2) ** 2 + cos(from_lat) * cos(to_lat) * sin((to_lon - from_lon) / 2) ** 2
+    return (2 * EARTH_RADIUS * arcsin(sqrt(a))).astype(float32)
+
+
+def _grid_steps(origin: str, hexagon: str) -> float:
+    try:
+        return h3_distance(origin, hexagon)
+    except ValueError:
+        return nan
+
+
+def h3_grid_distances(from_hexagons, to_hexagons, resolution: int):
+    """
+    Distances in metres along the H3 grid: the number of grid steps between two hexagons times the distance
+    between the centres of neighbouring hexagons.
+
+    Returns:
+        ndarray: float32 matrix of shape (len(from_hexagons), len(to_hexagons)), NaN for the pairs H3 can not
+        measure, e.g. across a pentagon or too far apart.
+    """
+    spacing = edge_length(resolution, "m") * sqrt(3)
+    to_hexagons = list(to_hexagons)
+    steps = [[_grid_steps(origin, hexagon) for hexagon in to_hexagons] for origin in from_hexagons]
+    return (asarray(steps, dtype=float64).reshape(-1, len(to_hexagons)) * spacing).astype(float32)
+
+
+def category_codes(size: int):
+    """
+    The codes 0 ... size - 1 of `size` categories, in the smallest integer dtype pandas keeps categorical codes in.
+
+    Repeating these builds the codes of a long categorical column without an int64 copy of it.
+    """
+    for dtype in (int8, int16, int32):
+        if size < iinfo(dtype).max:
+            return arange(size, dtype=dtype)
+    return arange(size, dtype=int64)
+
+
+def within_hexagon_distance(resolution: int) -> int:
+    # Average distance between two random points within a circle according to its diameter = (2 * radius) / 3
+    return int((edge_length(resolution, "m") * 2) / 3)
+
+
+class DistanceMatrix:
+    """
+    Distances between hexagons as a dense float32 matrix.
+
+    Rows are the "from" (supply) hexagons and columns the "to" (demand) hexagons. The long-form
+    "fromhex"/"tohex" DataFrame is only produced on request with `to_frame`.
+
+    Parameters:
+        values (array-like): Matrix of shape (len(from_hexagons), len(to_hexagons)).
+        from_hexagons (array-like): Hexagon ids of the rows.
+        to_hexagons (array-like): Hexagon ids of the columns. Default is from_hexagons.
+        from_coordinates (tuple): Optional (latitudes, longitudes) of the row hexagons.
+        to_coordinates (tuple): Optional (latitudes, longitudes) of the column hexagons. Default is from_coordinates
+            when the matrix is square over the same hexagons.
+        estimated (ndarray or bool): Optional boolean matrix of the pairs which only hold an estimate, e.g. a
+            haversine distance filled in for a pair missing from a 'DistanceStore', and are not stored by it. True
+            when every pair is an estimate. Default is None, every pair is a real distance.
+    """
+
+    def __init__(self, values, from_hexagons, to_hexagons=None, from_coordinates: tuple = None,
+                 to_coordinates: tuple = None, estimated=None):
+        self.from_hexagons = Index(from_hexagons)
+        self.to_hexagons = self.from_hexagons if to_hexagons is None else Index(to_hexagons)
+        self.values = ascontiguousarray(values, dtype=float32)
+        if self.values.shape != (len(self.from_hexagons), len(self.to_hexagons)):
+            raise ValueError(f"The distance values have the shape {self.values.shape}, expected "
+                             f"{(len(self.from_hexagons), len(self.to_hexagons))}.")
+        self.from_coordinates = from_coordinates
+        if to_coordinates is None and to_hexagons is None:
+            to_coordinates = from_coordinates
+        self.to_coordinates = to_coordinates
+        self.estimated = estimated
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def is_square(self) -> bool:
+        return self.from_hexagons.equals(self.to_hexagons)
+
+    def __len__(self):
+        return len(self.from_hexagons)
+
+    def __repr__(self):
+        return f"DistanceMatrix(shape={self.shape})"
+
+    @classmethod
+    def from_frequency_data(cls, frequency_data: DataFrame, resolution: int, method="haversine",
+                            to_frequency_data: DataFrame = None):
+        """
+        Builds the matrix from the hexagons of `event_frequency_data` to themselves, or to other hexagons.
+
+        Parameters:
+            frequency_data (DataFrame): Row hexagons with "hexagon_id", "hex_lat" and "hex_lon" columns.
+            resolution (int): H3 resolution of the hexagons, used for the distance within a hexagon.
+            method (str or DistanceProvider): "haversine" fills the pairs with great-circle distances in metres,
+                "h3" with distances along the H3 grid, None leaves them NaN. Any object with a 'distances' method,
+                e.g. an 'optimal_loc.providers.OSRMTableProvider', is called for the distances. Default is "haversine".
+            to_frequency_data (DataFrame): Column hexagons, in the same layout. Default is None (the row hexagons).
+
+        Note:
+            The distance of a hexagon to itself is the average distance between two points of the hexagon
+            with every method. The "haversine" and "h3" distances are marked as 'estimated'.
+        """
+        if method not in DISTANCE_METHODS and not hasattr(method, "distances"):
+            raise ValueError(f"method must be one of {DISTANCE_METHODS} or a distance provider.")
+
+        square = to_frequency_data is None
+        to_data = frequency_data if square else to_frequency_data
+        from_hexagons = frequency_data[HEXAGON_ID].to_numpy()
+        to_hexagons = to_data[HEXAGON_ID].to_numpy()
+        from_lat, from_lon = frequency_data[HEX_LAT].to_numpy(), frequency_data[HEX_LON].to_numpy()
+        to_lat, to_lon = to_data[HEX_LAT].to_numpy(), to_data[HEX_LON].to_numpy()
+        if method is None:
+            values = full((len(from_hexagons), len(to_hexagons)), nan, dtype=float32)
+        elif method == "haversine":
+            values = haversine_distances(from_lat, from_lon, to_lat, to_lon)
+        elif method == "h3":
+            values = h3_grid_distances(from_hexagons, to_hexagons, resolution)
+        else:
+            values = asarray(method.distances(from_lat, from_lon, to_lat, to_lon, from_hexagons, to_hexagons,
+                                              resolution), dtype=float32)
+
+        if square:
+            matrix = cls(values, from_hexagons, from_coordinates=(from_lat, from_lon))
+        else:
+            matrix = cls(values, from_hexagons, to_hexagons, (from_lat, from_lon), (to_lat, to_lon))
+        matrix.values[matrix.same_hexagon_pairs()] = within_hexagon_distance(resolution)
+        if method in ("haversine", "h3"):
+            matrix.estimated = True
+        return matrix
+
+    def same_hexagon_pairs(self) -> tuple:
+        """Row and column positions of the pairs of a hexagon to itself."""
+        if self.is_square:
+            return arange(len(self)), arange(len(self))
+        same = self.to_hexagons.get_indexer(self.from_hexagons)
+        rows = (same >= 0).nonzero()[0]
+        return rows, same[rows]
+
+    @classmethod
+    def from_frame(cls, distance_data: DataFrame):
+        """
+        Builds the matrix from long-form data with "fromhex", "tohex" and "distance" columns.
+
+        Missing pairs are NaN. The coordinates are kept when the "fromhex_lat" ... "tohex_lon" columns exist,
+        otherwise they are the centroids of the hexagons.
+        Categorical hexagon columns are used through their codes, without materialising the ids per pair. Other
+        hexagon columns are factorized by hashing, and the hexagons keep the order in which they first appear.
+        """
+        from_hexagons, from_codes = cls._hexagon_codes(distance_data[FROMHEX])
+        to_hexagons, to_codes = cls._hexagon_codes(distance_data[TOHEX])
+
+        values = full((len(from_hexagons), len(to_hexagons)), nan, dtype=float32)
+        values[from_codes, to_codes] = distance_data[DISTANCE].to_numpy(dtype=float32)
+
+        if {FROMHEX_LAT, FROMHEX_LON, TOHEX_LAT, TOHEX_LON}.issubset(distance_data.columns):
+            from_coordinates = cls._frame_coordinates(distance_data, from_codes, len(from_hexagons),
+                                                      FROMHEX_LAT, FROMHEX_LON)
+            to_coordinates = cls._frame_coordinates(distance_data, to_codes, len(to_hexagons), TOHEX_LAT, TOHEX_LON)
+        else:
+            from_coordinates, to_coordinates = cell_centroids(from_hexagons), cell_centroids(to_hexagons)
+
+        return cls(values, from_hexagons, to_hexagons, from_coordinates, to_coordinates)
+
+    @staticmethod
+    def _hexagon_codes(column):
+        if isinstance(column.dtype, CategoricalDtype):
+            column = column.cat.remove_unused_categories()
+            return column.cat.categories.to_numpy(), column.cat.codes.to_numpy()
+        codes, hexagons = factorize(column.to_numpy())
+        return asarray(hexagons), codes
+
+    @staticmethod
+    def _frame_coordinates(distance_data: DataFrame, codes, size: int, lat_column: str, lon_column: str):
+        latitudes = full(size, nan)
+        longitudes = full(size, nan)
+        latitudes[codes] = distance_data[lat_column].to_numpy()
+        longitudes[codes] = distance_data[lon_column].to_numpy()
+        return latitudes, longitudes
+
+    def reindex(self, from_hexagons=None, to_hexagons=None) -> "DistanceMatrix":
+        """
+        Returns the sub-matrix for the given row and column hexagons, in that order.
+
+        Raises:
+            ValueError: If any of the hexagons is not in the matrix.
+        """
+        from_positions = self._positions(self.from_hexagons, from_hexagons)
+        to_positions = self._positions(self.to_hexagons, to_hexagons)
+        if from_positions is None and to_positions is None:
+            return self
+
+        values, estimated = self.values, self.estimated
+        from_coordinates, to_coordinates = self.from_coordinates, self.to_coordinates
+        if from_positions is not None:
+            values = values[from_positions]
+            estimated = estimated if estimated is None or estimated is True else estimated[from_positions]
+            from_coordinates = self._take(from_coordinates, from_positions)
+        if to_positions is not None:
+            values = values[:, to_positions]
+            estimated = estimated if estimated is None or estimated is True else estimated[:, to_positions]
+            to_coordinates = self._take(to_coordinates, to_positions)
+
+        return DistanceMatrix(values,
+                              self.from_hexagons if from_hexagons is None else from_hexagons,
+                              self.to_hexagons if to_hexagons is None else to_hexagons,
+                              from_coordinates, to_coordinates, estimated)
+
+    def extend(self, new_rows: "DistanceMatrix", new_columns: "DistanceMatrix") -> "DistanceMatrix":
+        """
+        Returns the square matrix with new hexagons appended, e.g. hexagons seen for the first time in new events.
+
+        Parameters:
+            new_rows (DistanceMatrix): From the new hexagons to all the hexagons, the existing ones first.
+            new_columns (DistanceMatrix): From the existing hexagons to the new ones.
+
+        Raises:
+            ValueError: If the matrix is not square or the blocks do not fit it.
+
+        Note:
+            Only the new blocks are computed by the caller, the existing distances are copied over as they are.
+        """
+        if not self.is_square:
+            raise ValueError("Only a square distance matrix can be extended.")
+        hexagons = self.from_hexagons.append(new_rows.from_hexagons)
+        if not (new_rows.to_hexagons.equals(hexagons) and new_columns.from_hexagons.equals(self.from_hexagons)
+                and new_columns.to_hexagons.equals(new_rows.from_hexagons)):
+            raise ValueError("The new rows must go to the existing and new hexagons, the new columns from the "
+                             "existing to the new hexagons.")
+
+        n_old = len(self)
+        values = empty((len(hexagons), len(hexagons)), dtype=float32)
+        values[:n_old, :n_old] = self.values
+        values[:n_old, n_old:] = new_columns.values
+        values[n_old:] = new_rows.values
+        estimated = None
+        if any(matrix.estimated is not None for matrix in (self, new_rows, new_columns)):
+            estimated = zeros(values.shape, dtype=bool)
+            for matrix, block in ((self, estimated[:n_old, :n_old]), (new_columns, estimated[:n_old, n_old:]),
+                                  (new_rows, estimated[n_old:])):
+                if matrix.estimated is not None:
+                    block[:] = matrix.estimated
+        coordinates = None
+        if self.from_coordinates is not None and new_rows.from_coordinates is not None:
+            coordinates = (concatenate([self.from_coordinates[0], new_rows.from_coordinates[0]]),
+                           concatenate([self.from_coordinates[1], new_rows.from_coordinates[1]]))
+        return DistanceMatrix(values, hexagons, from_coordinates=coordinates, estimated=estimated)
+
+    @staticmethod
+    def _positions(index: Index, hexagons):
+        if hexagons is None or index.equals(Index(hexagons)):
+            return None
+        positions = index.get_indexer(hexagons)
+        if (positions < 0).any():
+            missing = asarray(hexagons)[positions < 0]
+            raise ValueError(f"{len(missing)} hexagons have no distances, e.g. {list(missing[:5])}")
+        return positions
+
+    @staticmethod
+    def _take(coordinates, positions):
+        if coordinates is None:
+            return None
+        return asarray(coordinates[0])[positions], asarray(coordinates[1])[positions]
+
+    def to_frame(self) -> DataFrame:
+        """
+        Returns the long-form data with one row per pair, in the `hex_distance_data` layout:
+        "fromhex", "tohex", "fromhex_lat", "fromhex_lon", "tohex_lat", "tohex_lon", "distance".
+
+        Note:
+            "fromhex" and "tohex" are categorical columns: per pair they only hold a small integer code, and the
+            hexagon ids of the matrix are their categories, rendered as strings when the column is read. The
+            distances and the coordinates are float32, about 1 m precise for coordinates.
+        """
+        n_from, n_to = self.shape
+        distance_data = DataFrame({
+            FROMHEX: Categorical.from_codes(repeat(category_codes(n_from), n_to),
+                                            dtype=CategoricalDtype(self.from_hexagons)),
+            TOHEX: Categorical.from_codes(tile(category_codes(n_to), n_from), dtype=CategoricalDtype(self.to_hexagons))
+        })
+        if self.from_coordinates is not None and self.to_coordinates is not None:
+            distance_data[FROMHEX_LAT] = repeat(asarray(self.from_coordinates[0], dtype=float32), n_to)
+            distance_data[FROMHEX_LON] = repeat(asarray(self.from_coordinates[1], dtype=float32), n_to)
+            distance_data[TOHEX_LAT] = tile(asarray(self.to_coordinates[0], dtype=float32), n_from)
+            distance_data[TOHEX_LON] = tile(asarray(self.to_coordinates[1], dtype=float32), n_from)
+        distance_data[DISTANCE] = self.values.ravel()
+
+        return distance_data
@@ -0,0 +1,231 @@
+from numpy import (
+    arange, argmin, argpartition, asarray, flatnonzero, float64, inf, isfinite, minimum, ones, setdiff1d, sort, where,
+    zeros
+)
+from numpy.random import default_rng
+from time import perf_counter
+
+
+class PMedianSolution:
+    """
+    A p-median solution in matrix positions.
+
+    Attributes:
+        supply_positions (ndarray): Sorted row positions of the chosen supply hexagons.
+        assignment (ndarray): For every demand column, the row position of the supply serving it.
+        objective (float): Total weighted distance of the solution.
+        lower_bound (float): A lower bound of the optimal objective, or None if it was not computed.
+        iterations (int): Number of local search sweeps.
+        status (str): How the solution was found, e.g. "optimal", "time_limit" or "heuristic".
+    """
+
+    def __init__(self, supply_positions, assignment, objective: float, lower_bound: float = None,
+                 iterations: int = 0, status: str = None):
+        self.supply_positions = supply_positions
+        self.assignment = assignment
+        self.objective = objective
+        self.lower_bound = lower_bound
+        self.iterations = iterations
+        self.status = status
+
+    @property
+    def gap(self):
+        """Relative gap between the objective and the lower bound."""
+        if self.lower_bound is None or self.objective == 0:
+            return None
+        return max(self.objective - self.lower_bound, 0.0) / abs(self.objective)
+
+    def __repr__(self):
+        return (f"PMedianSolution(number_of_loc={len(self.supply_positions)}, objective={self.objective:.6g}, "
+                f"lower_bound={self.lower_bound}, status={self.status!r})")
+
+
+def _penalised(costs):
+    # An uncovered demand costs more than any covered solution, so the sums stay finite and comparable.
+    finite = isfinite(costs)
+    penalty = where(finite, costs, 0).max(axis=0).sum() + 1.0
+    return where(finite, costs, penalty), penalty
+
+
+def _nearest_two(costs, sites):
+    site_costs = costs[sites]
+    if len(sites) == 1:
+        return sites[zeros(costs.shape[1], dtype=int)], site_costs[0], zeros(costs.shape[1]) + inf
+    order = argpartition(site_costs, 1, axis=0)[:2]
+    columns = arange(costs.shape[1])
+    return sites[order[0]], site_costs[order[0], columns], site_costs[order[1], columns]
+
+
+def greedy_construction(costs, number_of_loc: int, initial=None):
+    """Adds the supply hexagon which reduces the total cost the most, until number_of_loc are chosen."""
+    sites = [] if initial is None else list(initial)[:number_of_loc]
+    best = costs[sites].min(axis=0) if sites else zeros(costs.shape[1]) + inf
+    available = ones(costs.shape[0], dtype=bool)
+    available[sites] = False
+    while len(sites) < number_of_loc:
+        totals = minimum(costs, best[None, :]).sum(axis=1)
+        totals[~available] = inf
+        site = int(argmin(totals))
+        sites.append(site)
+        available[site] = False
+        best = minimum(best, costs[site])
+    return asarray(sorted(sites))
+
+
+def _expired(deadline: float) -> bool:
+    return deadline is not None and perf_counter() >= deadline
+
+
+def interchange(costs, sites, max_iterations: int = 100, deadline: float = None):
+    """
+    Vertex substitution local search (Teitz-Bart).
+
+    Every chosen site is tried against every other candidate, using the nearest and second nearest chosen sites
+    of each demand, so one candidate/site swap is evaluated for all candidates in one vectorized step.
+    The search stops early once `deadline` (a time.perf_counter value) has passed.
+
+    Returns:
+        tuple: (sites, number of sweeps)
+    """
+    sites = asarray(sites)
+    total = costs[sites].min(axis=0).sum()
+    for iteration in range(1, max_iterations + 1):
+        improved = False
+        for position in range(len(sites)):
+            nearest, first, second = _nearest_two(costs, sites)
+            without = where(nearest == sites[position], second, first)
+            totals = minimum(costs, without[None, :]).sum(axis=1)
+            totals[sites] = inf
+            candidate = int(argmin(totals))
+            if totals[candidate] < total * (1 - 1e-12):
+                sites = sites.copy()
+                sites[position] = candidate
+                total = totals[candidate]
+                improved = True
+        if not improved or _expired(deadline):
+            return sort(sites), iteration
+    return sort(sites), max_iterations
+
+
+def shake_and_search(costs, sites, n_restarts: int = 10, max_iterations: int = 100, random_state: int = 0,
+                     deadline: float = None):
+    """
+    Variable neighbourhood search around the interchange local optimum.
+
+    Each restart replaces one or two random chosen sites with random candidates and runs the interchange again,
+    keeping the result if it is better.
+
+    Returns:
+        tuple: (sites, total number of interchange sweeps)
+    """
+    rng = default_rng(random_state)
+    best_sites = asarray(sites)
+    best_total = costs[best_sites].min(axis=0).sum()
+    iterations = 0
+    others_size = costs.shape[0] - len(best_sites)
+    for _ in range(n_restarts if others_size > 0 else 0):
+        if _expired(deadline):
+            break
+        size = min(int(rng.integers(1, 3)), len(best_sites), others_size)
+        sites = best_sites.copy()
+        sites[rng.choice(len(sites), size, replace=False)] = rng.choice(
+            setdiff1d(arange(costs.shape[0]), best_sites), size, replace=False)
+        sites, sweeps = interchange(costs, sites, max_iterations, deadline)
+        iterations += sweeps
+        total = costs[sites].min(axis=0).sum()
+        if total < best_total:
+            best_sites, best_total = sites, total
+    return best_sites, iterations
+
+
+def lagrangian_lower_bound(costs, number_of_loc: int, upper_bound: float, multipliers,
+                           max_iterations: int = 100, mip_gap: float = 1e-6, deadline: float = None):
+    """
+    Lagrangian relaxation bound of the p-median problem, improved by subgradient optimisation.
+
+    The assignment constraints are relaxed with one multiplier per demand. For fixed multipliers the relaxed
+    problem opens the number_of_loc sites with the most negative reduced costs, which gives a valid lower bound.
+    """
+    multipliers = asarray(multipliers, dtype=float64).copy()
+    step_scale = 2.0
+    best_bound = -inf
+    stalled = 0
+    for _ in range(max_iterations):
+        reduced = minimum(costs - multipliers[None, :], 0.0)
+        site_values = reduced.sum(axis=1)
+        opened = argpartition(site_values, number_of_loc - 1)[:number_of_loc]
+        bound = multipliers.sum() + site_values[opened].sum()
+
+        if bound > best_bound + 1e-9 * abs(best_bound if isfinite(best_bound) else 1.0):
+            best_bound = bound
+            stalled = 0
+        else:
+            stalled += 1
+            if stalled >= 5:
+                step_scale /= 2
+                stalled = 0
+        if upper_bound - best_bound <= mip_gap * abs(upper_bound) or step_scale < 1e-4 or _expired(deadline):
+            break
+
+        subgradient = 1.0 - (reduced[opened] < 0).sum(axis=0)
+        norm = (subgradient ** 2).sum()
+        if norm == 0:
+            break
+        multipliers += step_scale * (upper_bound - bound) / norm * subgradient
+    return min(best_bound, upper_bound)
+
+
+def solve_p_median(costs, number_of_loc: int, initial=None, max_iterations: int = 100,
+                   n_restarts: int = 10, bound_iterations: int = 100, random_state: int = 0,
+                   time_limit: float = None, mip_gap: float = None) -> PMedianSolution:
+    """
+    Solves the p-median problem heuristically.
+
+    Parameters:
+        costs (ndarray): (n_supplies, n_demands) weighted distances, infinity for pairs which are not allowed.
+        number_of_loc (int): Number of supply hexagons to open.
+        initial (array-like): Optional row positions to start from, e.g. the sites of a previous solution.
+        max_iterations (int): Maximum number of interchange sweeps. Default is 100.
+        n_restarts (int): Number of random perturbations of the local optimum which are searched again. Default is 10.
+        bound_iterations (int): Subgradient iterations of the Lagrangian lower bound, 0 to skip it. Default is 100.
+        random_state (int): Seed of the perturbations. Default is 0.
+        time_limit (float): Seconds after which the local search and the bound stop with what they have.
+        mip_gap (float): The bound stops improving once the relative gap is below this. Default is 1e-6.
+
+    Returns:
+        PMedianSolution
+
+    Raises:
+        ValueError: If number_of_loc is not between 1 and the number of supplies, or some demand can not be served.
+
+    Note:
+        Greedy construction followed by vertex substitution and a few perturbation restarts. The result is not
+        guaranteed to be optimal, the lower bound tells how far from optimal it can be at most.
+    """
+    deadline = None if time_limit is None else perf_counter() + time_limit
+    costs = asarray(costs, dtype=float64)
+    if not 1 <= number_of_loc <= costs.shape[0]:
+        raise ValueError(f"number_of_loc must be between 1 and the number of candidate supplies ({costs.shape[0]}).")
+
+    search_costs, penalty = _penalised(costs)
+    sites = greedy_construction(search_costs, number_of_loc, initial)
+    sites, iterations = interchange(search_costs, sites, max_iterations, deadline)
+    sites, restart_iterations = shake_and_search(search_costs, sites, n_restarts, max_iterations, random_state,
+                                                 deadline)
+    iterations += restart_iterations
+
+    nearest, first, _ = _nearest_two(search_costs, sites)
+    uncovered = flatnonzero(first >= penalty)
+    if len(uncovered):
+        raise ValueError(f"The problem is infeasible: {len(uncovered)} demand hexagons can not be served by "
+                         f"{number_of_loc} supply hexagons with the allowed pairs.")
+    objective = float(first.sum())
+
+    lower_bound = None
+    if bound_iterations:
+        lower_bound = float(lagrangian_lower_bound(costs, number_of_loc, objective, first, bound_iterations,
+                                                   1e-6 if mip_gap is None else mip_gap, deadline))
+
+    status = "time_limit" if _expired(deadline) else "heuristic"
+    return PMedianSolution(sites, nearest, objective, lower_bound, iterations, status)
+
@@ -0,0 +1,55 @@
+from numpy import flatnonzero, isin
+from h3 import k_ring
+
+from optimal_loc.indexing import cells_to_parent, frequency_table, rollup_counts, strings_to_cells
+
+RESOLUTION = "resolution"
+N_CANDIDATES = "n_candidates"
+N_HEXAGONS = "n_hexagons"
+N_VARIABLES = "n_variables"
+STATUS = "status"
+
+
+def level_tables(cells, counts, resolution: int, coarse_resolution: int) -> dict:
+    """
+    Builds the event frequency table of every resolution from `coarse_resolution` to `resolution`.
+
+    Parameters:
+        cells (array-like): Unique uint64 cells at `resolution`.
+        counts (array-like): Event counts of the cells.
+        resolution (int): Resolution of `cells`, the finest level.
+        coarse_resolution (int): The coarsest level.
+
+    Returns:
+        dict: Resolution to frequency table. Every coarser level is the parent rollup of the next finer one, so
+        each hexagon of a level has at least one child with events on the level below.
+    """
+    tables = {resolution: frequency_table(cells, counts)}
+    for level in range(resolution - 1, coarse_resolution - 1, -1):
+        cells, counts = rollup_counts(cells, counts, level)
+        tables[level] = frequency_table(cells, counts)
+    return tables
+
+
+def expand_sites(site_ids, neighbours: int = 1) -> list:
+    """Returns the sites and every hexagon within `neighbours` grid steps of them."""
+    expanded = set()
+    for site_id in site_ids:
+        expanded.update(k_ring(str(site_id), neighbours))
+    return sorted(expanded)
+
+
+def candidate_positions(hexagon_ids, parent_resolution: int, parent_ids):
+    """
+    Positions of the hexagons whose parent at `parent_resolution` is one of `parent_ids`.
+
+    Parameters:
+        hexagon_ids (array-like): Hexagons of the finer level.
+        parent_resolution (int): Resolution of the parents.
+        parent_ids (array-like): The parent hexagons, e.g. the expanded sites of the coarser level.
+
+    Returns:
+        ndarray: Sorted positions in `hexagon_ids`.
+    """
+    parents = cells_to_parent(strings_to_cells(hexagon_ids), parent_resolution)
+    return flatnonzero(isin(parents, strings_to_cells(parent_ids)))
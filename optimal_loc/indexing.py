@@ -0,0 +1,177 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from numpy import array, asarray, argsort, bincount, concatenate, empty, float64, int64, uint64, unique
+from pandas import DataFrame
+from h3 import geo_to_h3, h3_to_geo, h3_to_parent, h3_to_string, string_to_h3
+
+from optimal_loc.app_constants import HEXAGON_ID, HEX_LAT, HEX_LON, LATITUDE, LONGITUDE, TOTAL_EVENT
+
+try:
+    # h3 >= 3.7 ships array versions of the hot functions. They live under `unstable`,
+    # which warns on import, so we silence that once here.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        from h3.unstable import vect as h3_vect
+except ImportError:
+    h3_vect = None
+
+DEFAULT_CHUNK_SIZE = 1_000_000
+AUTO_MAX_HEXAGONS = 150
+FINEST_RESOLUTION = 15
+EXECUTORS = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+
+def _index_chunk(chunk):
+    latitudes, longitudes, resolution = chunk
+    if h3_vect is not None:
+        return h3_vect.geo_to_h3(latitudes, longitudes, resolution)
+    return array([string_to_h3(geo_to_h3(lat, lon, resolution)) for lat, lon in zip(latitudes, longitudes)],
+                 dtype=uint64)
+
+
+def geo_to_cells(latitudes, longitudes, resolution: int,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 n_workers: int = None,
+                 executor: str = "thread"):
+    """
+    Converts latitude/longitude arrays to H3 cells in bulk.
+
+    Parameters:
+        latitudes (array-like): Latitudes of the events.
+        longitudes (array-like): Longitudes of the events.
+        resolution (int): H3 resolution of the output cells.
+        chunk_size (int): Number of points indexed per task. Default is 1,000,000.
+        n_workers (int): Number of workers used to index the chunks. None or 1 indexes in the calling thread.
+        executor (str): "thread" or "process". Default is "thread".
+
+    Returns:
+        ndarray: uint64 H3 cells, one per input point.
+    """
+    latitudes = asarray(latitudes, dtype=float64)
+    longitudes = asarray(longitudes, dtype=float64)
+    if latitudes.shape != longitudes.shape:
+        raise ValueError("latitudes and longitudes must have the same length.")
+    if executor not in EXECUTORS:
+        raise ValueError(f"executor must be one of {sorted(EXECUTORS)}.")
+
+    chunks = [(latitudes[start:start + chunk_size], longitudes[start:start + chunk_size], resolution)
+              for start in range(0, len(latitudes), chunk_size)]
+    if not chunks:
+        return empty(0, dtype=uint64)
+
+    if n_workers is None or n_workers <= 1 or len(chunks) == 1:
+        cells = [_index_chunk(chunk) for chunk in chunks]
+    else:
+        with EXECUTORS[executor](max_workers=n_workers) as pool:
+            cells = list(pool.map(_index_chunk, chunks))
+
+    return concatenate(cells).astype(uint64, copy=False)
+
+
+def cells_to_parent(cells, resolution: int):
+    """Returns the parent of every uint64 cell at the given (coarser) resolution."""
+    cells = asarray(cells, dtype=uint64)
+    if h3_vect is not None:
+        return h3_vect.h3_to_parent(cells, resolution).astype(uint64, copy=False)
+    return array([string_to_h3(h3_to_parent(h3_to_string(int(cell)), resolution)) for cell in cells], dtype=uint64)
+
+
+def rollup_counts(cells, counts, resolution: int):
+    """
+    Aggregates the event counts of unique cells into their parents at `resolution`.
+
+    Returns:
+        tuple: (unique parent cells, summed counts)
+    """
+    parents, inverse = unique(cells_to_parent(cells, resolution), return_inverse=True)
+    return parents, bincount(inverse, weights=counts, minlength=len(parents)).astype(int64)
+
+
+def select_auto_resolution(cells, counts, max_hexagons: int = AUTO_MAX_HEXAGONS,
+                           resolution: int = FINEST_RESOLUTION):
+    """
+    Finds the finest resolution with fewer than `max_hexagons` unique hexagons.
+
+    Parameters:
+        cells (array-like): Unique uint64 cells at `resolution`.
+        counts (array-like): Event counts of the cells.
+        max_hexagons (int): The number of hexagons the auto resolution has to stay below. Default is 150.
+        resolution (int): Resolution of `cells`. Default is 15.
+
+    Returns:
+        tuple: (resolution, unique cells at that resolution, their event counts)
+
+    Note:
+        The raw points are not touched here. Each coarser level is a parent rollup of the unique cells of the
+        previous one, so the work shrinks with every step.
+    """
+    while len(cells) >= max_hexagons and resolution > 0:
+        resolution = resolution - 1
+        cells, counts = rollup_counts(cells, counts, resolution)
+    return resolution, cells, counts
+
+
+def cells_to_strings(cells):
+    """Renders uint64 H3 cells as the usual hexadecimal string ids."""
+    return array([h3_to_string(int(cell)) for cell in cells], dtype=object)
+
+
+def strings_to_cells(hexagon_ids):
+    """Parses hexadecimal string ids into uint64 H3 cells."""
+    return array([int(hexagon_id, 16) for hexagon_id in hexagon_ids], dtype=uint64)
+
+
+def cell_centroids(hexagon_ids):
+    """
+    Returns the centroid latitudes and longitudes of the given hexagons.
+
+    Call this on unique hexagons only, it runs one `h3_to_geo` per id.
+    """
+    centroids = array([h3_to_geo(h) for h in hexagon_ids], dtype=float64).reshape(-1, 2)
+    return centroids[:, 0], centroids[:, 1]
+
+
+def frequency_table(cells, counts) -> DataFrame:
+    """
+    Builds the event frequency table from unique cells and their event counts.
+
+    The rows are ordered by descending `total_event`, like `Series.value_counts`.
+    """
+    order = argsort(-asarray(counts), kind="stable")
+    cells = asarray(cells)[order]
+    hexagon_ids = cells_to_strings(cells)
+    hex_lat, hex_lon = cell_centroids(hexagon_ids)
+
+    return DataFrame({
+        HEXAGON_ID: hexagon_ids,
+        TOTAL_EVENT: asarray(counts)[order],
+        HEX_LAT: hex_lat,
+        HEX_LON: hex_lon
+    })
+
+
+def index_events(raw_data: DataFrame, resolution: int, **kwargs):
+    """Indexes the "latitude" and "longitude" columns of `raw_data`. Keyword arguments go to `geo_to_cells`."""
+    return geo_to_cells(raw_data[LATITUDE].to_numpy(), raw_data[LONGITUDE].to_numpy(), resolution, **kwargs)
+
+
+def count_events(raw_data: DataFrame, resolution: int, **kwargs):
+    """Returns the unique cells of `raw_data` at `resolution` and their event counts."""
+    return unique(index_events(raw_data, resolution, **kwargs), return_counts=True)
+
+
+def auto_resolution_counts(raw_data: DataFrame, max_hexagons: int = AUTO_MAX_HEXAGONS, **kwargs):
+    """
+    Indexes `raw_data` once at the finest resolution and rolls it up to the auto resolution.
+
+    Returns:
+        tuple: (resolution, unique cells, event counts)
+    """
+    cells, counts = count_events(raw_data, FINEST_RESOLUTION, **kwargs)
+    return select_auto_resolution(cells, counts, max_hexagons)
+
+
+def event_frequency_table(raw_data: DataFrame, resolution: int, **kwargs) -> DataFrame:
+    """Counts the events of `raw_data` per hexagon. Keyword arguments go to `geo_to_cells`."""
+    return frequency_table(*count_events(raw_data, resolution, **kwargs))
@@ -0,0 +1,157 @@
+from numpy import asarray, bincount, float64, int64, lexsort, ones, percentile, select, take, unique
+from pandas import DataFrame, factorize
+from folium import plugins, CircleMarker, FeatureGroup, GeoJson, GeoJsonTooltip, Icon, Map, Marker
+from h3 import h3_get_resolution, h3_to_geo_boundary
+
+from optimal_loc.app_constants import COLOURS_LIST, HEX_LAT, HEX_LON, HEXAGON_ID, TOTAL_EVENT
+from optimal_loc.indexing import cell_centroids, cells_to_parent, cells_to_strings, strings_to_cells
+
+COLOUR = "colour"
+DEFAULT_MAX_CELLS = 5_000
+RENDER_MODES = ("polygons", "points", "markers")
+
+# Draws every clustered point as a small circle in the colour given as the third value of its row.
+POINT_CALLBACK = """
+function (row) {
+    return L.circleMarker(new L.LatLng(row[0], row[1]), {radius: 5, color: row[2], fillOpacity: 0.6});
+}
+"""
+
+
+def frequency_colours(events):
+    """Red above the 90th percentile of the events, green above the 75th, blue for the rest."""
+    events = asarray(events, dtype=float64)
+    if len(events) == 0:
+        return asarray([], dtype=object)
+    return select([events > percentile(events, 90), events > percentile(events, 75)], ["red", "green"],
+                  "blue").astype(object)
+
+
+def group_colours(groups):
+    """Cycles through COLOURS_LIST by the sorted order of the groups, like `groupby(...).ngroup()`."""
+    _, codes = unique(asarray(groups), return_inverse=True)
+    return take(asarray(COLOURS_LIST, dtype=object), codes % len(COLOURS_LIST))
+
+
+def coarsen_hexagons(data: DataFrame, max_cells: int = DEFAULT_MAX_CELLS, weight: str = None, group: str = None):
+    """
+    Aggregates the hexagons into their H3 parents until at most `max_cells` cells remain.
+
+    Parameters:
+        data (DataFrame): Hexagons with a "hexagon_id" column.
+        max_cells (int): The number of cells the result has to stay at or below. Default is 5,000.
+        weight (str): Optional column summed into "total_event" of the parents, each hexagon counts one without it.
+        group (str): Optional column, a parent gets the group with the largest total weight of its children (the
+            group of most children without `weight`).
+
+    Returns:
+        tuple: (DataFrame with "hexagon_id", "total_event", "hex_lat", "hex_lon" and the group column,
+                resolution of its hexagons). The data is returned as it is if it has few enough hexagons.
+    """
+    hexagon_ids = data[HEXAGON_ID].to_numpy()
+    if len(hexagon_ids) == 0:
+        return data, None
+    resolution = h3_get_resolution(hexagon_ids[0])
+    if len(hexagon_ids) <= max_cells:
+        return data, resolution
+
+    cells = strings_to_cells(hexagon_ids)
+    parents = unique(cells)
+    while len(parents) > max_cells and resolution > 0:
+        resolution = resolution - 1
+        cells = cells_to_parent(cells, resolution)
+        parents = unique(cells)
+    _, inverse = unique(cells, return_inverse=True)
+
+    weights = ones(len(cells)) if weight is None else data[weight].to_numpy(dtype=float64)
+    parent_ids = cells_to_strings(parents)
+    hex_lat, hex_lon = cell_centroids(parent_ids)
+    coarse = DataFrame({HEXAGON_ID: parent_ids,
+                        TOTAL_EVENT: bincount(inverse, weights, minlength=len(parents)).astype(
+                            int64 if weight is None else data[weight].dtype),
+                        HEX_LAT: hex_lat,
+                        HEX_LON: hex_lon})
+    if group is not None:
+        # The total weight of every (parent, group) pair, sorted by parent and total: the last pair of every parent
+        # is its largest group, e.g. the site serving most of its children.
+        codes, groups = factorize(data[group])
+        pairs, pair_inverse = unique(inverse * len(groups) + codes, return_inverse=True)
+        pair_parents = pairs // len(groups)
+        order = lexsort((bincount(pair_inverse, weights), pair_parents))
+        last = bincount(pair_parents, minlength=len(parents)).cumsum() - 1
+        coarse[group] = asarray(groups)[pairs[order[last]] % len(groups)]
+    return coarse, resolution
+
+
+def hexagon_features(hexagon_ids, colours, properties: dict = None) -> dict:
+    """
+    Builds one GeoJSON FeatureCollection of the hexagon polygons.
+
+    Parameters:
+        hexagon_ids (array-like): The hexagons.
+        colours (array-like): Fill colour of every hexagon, stored as its "colour" property.
+        properties (dict): Optional further properties, column name to array-like, e.g. for the tooltips.
+    """
+    properties = {name: asarray(values).tolist() for name, values in (properties or {}).items()}
+    hexagon_ids = asarray(hexagon_ids).tolist()
+    colours = asarray(colours).tolist()
+    features = []
+    for position, hexagon_id in enumerate(hexagon_ids):
+        feature_properties = {HEXAGON_ID: hexagon_id, COLOUR: colours[position]}
+        feature_properties.update({name: values[position] for name, values in properties.items()})
+        features.append({"type": "Feature", "id": hexagon_id, "properties": feature_properties,
+                         "geometry": {"type": "Polygon",
+                                      "coordinates": [h3_to_geo_boundary(hexagon_id, geo_json=True)]}})
+    return {"type": "FeatureCollection", "features": features}
+
+
+def hexagon_layer(data: DataFrame, colours, mode: str = "polygons", tooltip_columns=(), name: str = None):
+    """
+    Returns the hexagons as one folium layer.
+
+    Parameters:
+        data (DataFrame): Hexagons with "hexagon_id", "hex_lat" and "hex_lon" columns.
+        colours (array-like): The colour of every hexagon.
+        mode (str): "polygons" draws one GeoJSON layer of the hexagon outlines, "points" one FastMarkerCluster of
+            the centroids, which clusters them in the browser by zoom level, and "markers" one CircleMarker per
+            hexagon. Default is "polygons".
+        tooltip_columns (iterable): Columns shown when hovering over a polygon, or in the popup of a marker.
+        name (str): Optional name of the layer in the layer control.
+
+    Raises:
+        ValueError: If the mode is unknown.
+    """
+    if mode not in RENDER_MODES:
+        raise ValueError(f"mode must be one of {RENDER_MODES}.")
+    colours = asarray(colours, dtype=object)
+    tooltip_columns = list(tooltip_columns)
+
+    if mode == "polygons":
+        features = hexagon_features(data[HEXAGON_ID], colours, {column: data[column] for column in tooltip_columns})
+        return GeoJson(features, name=name,
+                       style_function=lambda feature: {"fillColor": feature["properties"][COLOUR],
+                                                       "color": feature["properties"][COLOUR],
+                                                       "weight": 1, "fillOpacity": 0.5},
+                       tooltip=GeoJsonTooltip(fields=[HEXAGON_ID] + tooltip_columns) if tooltip_columns else None)
+
+    if mode == "points":
+        rows = DataFrame({HEX_LAT: data[HEX_LAT].to_numpy(), HEX_LON: data[HEX_LON].to_numpy(), COLOUR: colours})
+        return plugins.FastMarkerCluster(rows.values.tolist(), callback=POINT_CALLBACK, name=name)
+
+    layer = FeatureGroup(name=name)
+    popups = zip(*[data[column].tolist() for column in tooltip_columns]) if tooltip_columns else None
+    for position, (lat, lon) in enumerate(zip(data[HEX_LAT].tolist(), data[HEX_LON].tolist())):
+        popup = dict(zip(tooltip_columns, next(popups))) if popups is not None else None
+        CircleMarker((lat, lon), radius=5, color=colours[position], popup=popup).add_to(layer)
+    return layer
+
+
+def site_markers(supply_data: DataFrame, map_object: Map) -> Map:
+    """Adds a red marker for every site of `supply_data`."""
+    for lat, lon in zip(supply_data[HEX_LAT].tolist(), supply_data[HEX_LON].tolist()):
+        Marker([lat, lon], icon=Icon(color='red', icon='info-sign')).add_to(map_object)
+    return map_object
+
+
+def map_center(data: DataFrame) -> list:
+    return [data[HEX_LAT].median(), data[HEX_LON].median()]
@@ -0,0 +1,144 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import array, concatenate, float32, float64
+from pandas import Categorical, DataFrame
+from pandas.api.types import union_categoricals
+
+from optimal_loc.app_constants import DISTANCE, FROMHEX, FROMHEX_LAT, FROMHEX_LON, TOHEX, TOHEX_LAT, TOHEX_LON
+
+DEFAULT_BATCH_SIZE = 50_000
+ID_FIELD = "_id"
+HEXAGON_FIELDS = (FROMHEX, TOHEX)
+COORDINATE_FIELDS = (FROMHEX_LAT, FROMHEX_LON, TOHEX_LAT, TOHEX_LON)
+FIELD_TYPES = {DISTANCE: float32, FROMHEX_LAT: float64, FROMHEX_LON: float64, TOHEX_LAT: float64, TOHEX_LON: float64}
+
+
+def distance_query(hexagons=None, query: dict = None) -> dict:
+    """
+    The filter of the distance documents: the given query, restricted to pairs of the given hexagons.
+
+    The hexagon filter is pushed down to MongoDB as `$in` conditions on "fromhex" and "tohex", so the other pairs
+    are never sent over the network.
+    """
+    query = dict(query or {})
+    if hexagons is not None:
+        hexagons = list(hexagons)
+        query[FROMHEX] = {"$in": hexagons}
+        query[TOHEX] = {"$in": hexagons}
+    return query
+
+
+def _columns(documents, fields) -> dict:
+    try:
+        columns = {field: [document[field] for document in documents] for field in fields}
+    except KeyError as error:
+        raise ValueError(f"The distance documents must have the {list(fields)} fields, {error} is missing.")
+    return {field: Categorical(values) if field in HEXAGON_FIELDS else array(values, dtype=FIELD_TYPES[field])
+            for field, values in columns.items()}
+
+
+def _concat_columns(batches, fields) -> dict:
+    if not batches:
+        return {field: Categorical([]) if field in HEXAGON_FIELDS else array([], dtype=FIELD_TYPES[field])
+                for field in fields}
+    return {field: union_categoricals([batch[field] for batch in batches]) if field in HEXAGON_FIELDS
+            else concatenate([batch[field] for batch in batches]) for field in fields}
+
+
+def read_columns(collection, query: dict = None, fields=HEXAGON_FIELDS + (DISTANCE,) + COORDINATE_FIELDS,
+                 batch_size: int = DEFAULT_BATCH_SIZE) -> dict:
+    """
+    Reads the given fields of the matching documents into typed column arrays.
+
+    Parameters:
+        collection (Collection): The MongoDB collection.
+        query (dict): Filter of the documents. Default is None (all documents).
+        fields (tuple): The fields to read, "_id" is never read.
+        batch_size (int): Number of documents per cursor batch, also the number of documents converted at once.
+
+    Returns:
+        dict: For every field, a Categorical of the hexagon ids or a float32 (distance) / float64 (coordinates) array.
+
+    Raises:
+        ValueError: If a document misses one of the fields.
+
+    Note:
+        Only one batch of documents is held as Python objects at any time, every batch is converted to arrays
+        before the next one is read.
+    """
+    projection = {field: 1 for field in fields}
+    projection[ID_FIELD] = 0
+    cursor = collection.find(query or {}, projection, batch_size=batch_size)
+
+    batches = []
+    documents = []
+    for document in cursor:
+        documents.append(document)
+        if len(documents) == batch_size:
+            batches.append(_columns(documents, fields))
+            documents = []
+    if documents:
+        batches.append(_columns(documents, fields))
+    return _concat_columns(batches, fields)
+
+
+def range_queries(collection, n_partitions: int, query: dict = None, field: str = ID_FIELD) -> list:
+    """
+    Splits the matching documents into about equal ranges of `field`, e.g. the _id or a hashed key.
+
+    The range boundaries are read with sorted, skipped one-document queries, so `field` should be indexed.
+
+    Returns:
+        list: One query per range, at most n_partitions of them.
+    """
+    query = query or {}
+    count = collection.count_documents(query)
+    boundaries = []
+    for partition in range(1, n_partitions):
+        cursor = collection.find(query, {field: 1}).sort(field, 1).skip(partition * count // n_partitions).limit(1)
+        for document in cursor:
+            if not boundaries or document[field] != boundaries[-1]:
+                boundaries.append(document[field])
+
+    queries = []
+    for lower, upper in zip([None] + boundaries, boundaries + [None]):
+        condition = {}
+        if lower is not None:
+            condition["$gte"] = lower
+        if upper is not None:
+            condition["$lt"] = upper
+        queries.append({"$and": [query, {field: condition}]} if condition else query)
+    return queries
+
+
+def read_distance_frame(collection, hexagons=None, query: dict = None, coordinates: bool = False,
+                        batch_size: int = DEFAULT_BATCH_SIZE, n_workers: int = None,
+                        partition_field: str = ID_FIELD) -> DataFrame:
+    """
+    Reads the distance documents of a collection into a long-form distance DataFrame.
+
+    Parameters:
+        collection (Collection): The MongoDB collection with "fromhex", "tohex" and "distance" fields.
+        hexagons (list): Only the pairs between these hexagons are read. Default is None (all pairs).
+        query (dict): Additional filter of the documents.
+        coordinates (bool): Read the "fromhex_lat" ... "tohex_lon" fields too, which every document must have then.
+            Default is False: 'DistanceMatrix.from_frame' takes the coordinates from the H3 centroids.
+        batch_size (int): Cursor batch size. Default is 50,000.
+        n_workers (int): Read this many ranges of `partition_field` in parallel threads. Default is None (one cursor).
+        partition_field (str): The indexed field the parallel reads are split on. Default is "_id".
+
+    Returns:
+        DataFrame: "fromhex" and "tohex" as categorical columns, "distance" as float32 and the coordinates as float64.
+    """
+    fields = HEXAGON_FIELDS + (DISTANCE,) + (COORDINATE_FIELDS if coordinates else ())
+    query = distance_query(hexagons, query)
+
+    if n_workers and n_workers > 1:
+        queries = range_queries(collection, n_workers, query, partition_field)
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            parts = list(pool.map(lambda part: read_columns(collection, part, fields, batch_size), queries))
+        columns = _concat_columns(parts, fields)
+    else:
+        columns = read_columns(collection, query, fields, batch_size)
+
+    return DataFrame(columns, columns=list(fields))
@@ -0,0 +1,385 @@
+from numpy import (
+    arange, argpartition, asarray, bincount, concatenate, flatnonzero, float64, full, inf, isfinite, lexsort, nonzero,
+    ones, ones_like, put_along_axis, r_, zeros, zeros_like
+)
+from time import perf_counter
+
+from pulp import (
+    LpAffineExpression, LpConstraint, LpConstraintEQ, LpConstraintLE, LpMinimize, LpProblem, LpSolutionIntegerFeasible,
+    LpSolutionOptimal, LpStatus, LpStatusNotSolved, LpVariable, PULP_CBC_CMD
+)
+
+from optimal_loc.heuristics import PMedianSolution, solve_p_median
+from optimal_loc.profiling import MODEL_BUILDING, SOLVING, timed
+
+try:
+    from scipy.optimize import Bounds, LinearConstraint, milp
+    from scipy.sparse import coo_matrix
+except ImportError:
+    milp = None
+
+SOLVERS = ("auto", "highs", "cbc", "heuristic")
+NUMBER_OF_LOC_CONSTRAINT = "number_of_loc"
+OPTIMAL = "optimal"
+TIME_LIMIT = "time_limit"
+
+
+def candidate_pairs(distances, max_distance: float = None, k_nearest: int = None):
+    """
+    Selects the supply-demand pairs which become assignment variables.
+
+    Parameters:
+        distances (ndarray): Matrix of shape (n_supplies, n_demands).
+        max_distance (float): Pairs further apart than this are dropped. Default is None (no cutoff).
+        k_nearest (int): Each demand only keeps its k nearest candidate supplies. Default is None (all of them).
+
+    Returns:
+        tuple: (supply positions, demand positions) of the kept pairs, ordered by supply then demand.
+
+    Note:
+        Pairs without a (finite) distance are always dropped.
+    """
+    keep = isfinite(distances)
+    if max_distance is not None:
+        keep &= distances <= max_distance
+    if k_nearest is not None and k_nearest < distances.shape[0]:
+        if k_nearest < 1:
+            raise ValueError("k_nearest must be at least 1.")
+        nearest = argpartition(distances, k_nearest - 1, axis=0)[:k_nearest]
+        in_nearest = zeros_like(keep)
+        put_along_axis(in_nearest, nearest, ones_like(nearest, dtype=bool), axis=0)
+        keep &= in_nearest
+    return nonzero(keep)
+
+
+def check_candidate_pairs(demand_positions, n_demands: int, demands=None) -> None:
+    """
+    Raises a ValueError if pruning left any demand without a candidate supply.
+
+    Parameters:
+        demand_positions (ndarray): Demand positions of the kept pairs.
+        n_demands (int): Number of demands.
+        demands (list): Optional demand ids used in the error message.
+    """
+    unserved = flatnonzero(bincount(demand_positions, minlength=n_demands) == 0)
+    if len(unserved):
+        examples = [demands[i] for i in unserved[:5]] if demands is not None else list(unserved[:5])
+        raise ValueError(
+            f"The problem is infeasible: {len(unserved)} demand hexagons have no candidate supply within "
+            f"max_distance / k_nearest, e.g. {examples}. Please increase max_distance or k_nearest.")
+
+
+def resolve_solver(solver: str) -> str:
+    """Maps "auto" to "highs" when scipy.optimize.milp is available and to "cbc" otherwise."""
+    if solver not in SOLVERS:
+        raise ValueError(f"Unknown solver {solver!r}, please use one of {SOLVERS}.")
+    if solver == "auto":
+        return "cbc" if milp is None else "highs"
+    if solver == "highs" and milp is None:
+        raise ImportError("The highs solver needs scipy >= 1.9, please install it with `pip install scipy`.")
+    return solver
+
+
+class PMedianModel:
+    """
+    The p-median model in matrix form, over the candidate supply-demand pairs.
+
+    Variables are the pair assignments x (one per candidate pair) followed by the site variables y (one per
+    supply). The constraints are, in this row order:
+        - every demand is assigned once:            sum_i x_ij == 1
+        - a pair is only used if its site is open:  x_ij - y_i <= 0
+        - the number of open sites:                 sum_i y_i == number_of_loc
+
+    Parameters:
+        distances (ndarray): (n_supplies, n_demands) distance matrix, kept as the 'distances' attribute.
+        weights (array-like): Demand weights, i.e. total events per demand hexagon.
+        supply_positions (ndarray): Supply positions of the candidate pairs.
+        demand_positions (ndarray): Demand positions of the candidate pairs.
+        number_of_loc (int): Number of sites to open.
+    """
+
+    def __init__(self, distances, weights, supply_positions, demand_positions, number_of_loc: int):
+        self.n_supplies, self.n_demands = distances.shape
+        self.distances = distances
+        self.supply_positions = asarray(supply_positions)
+        self.demand_positions = asarray(demand_positions)
+        self.weights = asarray(weights, dtype=float64)
+        self.costs = (asarray(distances[self.supply_positions, self.demand_positions], dtype=float64)
+                      * self.weights[self.demand_positions])
+        self.number_of_loc = number_of_loc
+        self._matrix = None
+
+    @property
+    def n_pairs(self) -> int:
+        return len(self.supply_positions)
+
+    @property
+    def n_variables(self) -> int:
+        return self.n_pairs + self.n_supplies
+
+    @property
+    def n_constraints(self) -> int:
+        return self.n_demands + self.n_pairs + 1
+
+    def set_number_of_loc(self, number_of_loc: int) -> None:
+        """Changes the right-hand side of the number of sites constraint, the rest of the model is kept."""
+        self.number_of_loc = number_of_loc
+
+    def cost_matrix(self):
+        """Dense (n_supplies, n_demands) weighted costs, infinity for the pairs which are not candidates."""
+        costs = full((self.n_supplies, self.n_demands), inf)
+        costs[self.supply_positions, self.demand_positions] = self.costs
+        return costs
+
+    def constraint_matrix(self):
+        """
+        Sparse constraint matrix and its row bounds (lower, upper).
+
+        The matrix is built in one vectorized step on the first call and reused afterwards, only the bounds
+        depend on number_of_loc.
+        """
+        n_pairs, n_demands = self.n_pairs, self.n_demands
+        if self._matrix is None:
+            pairs = arange(n_pairs)
+            rows = concatenate([self.demand_positions, n_demands + pairs, n_demands + pairs,
+                                full(self.n_supplies, n_demands + n_pairs)])
+            columns = concatenate([pairs, pairs, n_pairs + self.supply_positions, n_pairs + arange(self.n_supplies)])
+            values = concatenate([ones(n_pairs), ones(n_pairs), -ones(n_pairs), ones(self.n_supplies)])
+            self._matrix = coo_matrix((values, (rows, columns)), shape=(self.n_constraints, self.n_variables)).tocsr()
+        matrix = self._matrix
+
+        lower = r_[ones(n_demands), full(n_pairs, -inf), self.number_of_loc]
+        upper = r_[ones(n_demands), zeros(n_pairs), self.number_of_loc]
+        return matrix, lower, upper
+
+    def solution_from_values(self, pair_values, site_values, lower_bound: float = None) -> PMedianSolution:
+        """Builds a PMedianSolution from the variable values, every demand going to its largest assignment."""
+        order = lexsort((pair_values, self.demand_positions))
+        last_of_demand = r_[self.demand_positions[order][1:] != self.demand_positions[order][:-1], True]
+        chosen = order[last_of_demand]
+        assignment = zeros(self.n_demands, dtype=int)
+        assignment[self.demand_positions[chosen]] = self.supply_positions[chosen]
+        objective = float(self.costs[chosen].sum())
+        return PMedianSolution(flatnonzero(asarray(site_values) > 0.5), assignment, objective, lower_bound)
+
+    def solution_from_sites(self, sites) -> PMedianSolution:
+        """Opens the given supply positions and assigns every demand to its cheapest open site, e.g. to warm start."""
+        sites = asarray(sorted(sites), dtype=int)
+        costs = self.cost_matrix()[sites]
+        nearest = costs.argmin(axis=0)
+        objective = float(costs[nearest, arange(self.n_demands)].sum())
+        return PMedianSolution(sites, sites[nearest], objective, status="start")
+
+    def start_values(self, solution: PMedianSolution):
+        """Pair and site values of a solution, e.g. to warm start a solver from it."""
+        pair_values = self.supply_positions == solution.assignment[self.demand_positions]
+        site_values = zeros(self.n_supplies, dtype=bool)
+        site_values[solution.supply_positions] = True
+        return pair_values, site_values
+
+    def solve_highs(self, time_limit: float = None, mip_gap: float = None) -> PMedianSolution:
+        """
+        Solves the model in-process with HiGHS through scipy.optimize.milp, without writing a model file.
+
+        The site variables are integer. The assignments can stay continuous: with the sites fixed, every demand
+        goes to its nearest open site anyway.
+
+        Parameters:
+            time_limit (float): Seconds after which HiGHS returns the best solution found so far.
+            mip_gap (float): Relative gap at which HiGHS stops. Default is the HiGHS default (1e-4).
+
+        Raises:
+            ValueError: If HiGHS does not find a feasible solution.
+        """
+        options = {}
+        if time_limit is not None:
+            options["time_limit"] = time_limit
+        if mip_gap is not None:
+            options["mip_rel_gap"] = mip_gap
+
+        matrix, lower, upper = self.constraint_matrix()
+        result = milp(c=r_[self.costs, zeros(self.n_supplies)],
+                      constraints=LinearConstraint(matrix, lower, upper),
+                      integrality=r_[zeros(self.n_pairs), ones(self.n_supplies)],
+                      bounds=Bounds(0, 1),
+                      options=options)
+        if result.x is None:
+            raise ValueError(f"The solver could not find a solution: {result.message} If you used max_distance / "
+                             f"k_nearest, the pruned problem may be infeasible for {self.number_of_loc} locations, "
+                             f"please loosen them.")
+        lower_bound = getattr(result, "mip_dual_bound", None)
+        solution = self.solution_from_values(result.x[:self.n_pairs], result.x[self.n_pairs:],
+                                             None if lower_bound is None else float(lower_bound))
+        solution.status = OPTIMAL if result.status == 0 else TIME_LIMIT
+        return solution
+
+    def solve_cbc(self, supplies, demands, threads: int = None, time_limit: float = None, mip_gap: float = None,
+                  start: PMedianSolution = None, problem=None) -> PMedianSolution:
+        """
+        Solves the model with CBC through PuLP.
+
+        Parameters:
+            supplies (list): Supply ids, used in the variable names.
+            demands (list): Demand ids, used in the variable names.
+            threads (int): Number of CBC threads.
+            time_limit (float): Seconds after which CBC returns the best solution found so far.
+            mip_gap (float): Relative gap at which CBC stops. Default is None (solve to optimality).
+            start (PMedianSolution): Optional solution CBC is warm started from.
+            problem (tuple): Optional output of 'to_pulp' to solve instead of building the problem again.
+
+        Raises:
+            ValueError: If CBC does not find a feasible solution.
+        """
+        prob, amount_vars, wh_vars = problem or self.to_pulp(supplies, demands)
+        if start is not None:
+            for variables, values in zip((amount_vars, wh_vars), self.start_values(start)):
+                for variable, start_value in zip(variables, values.tolist()):
+                    variable.setInitialValue(int(start_value))
+        prob.solve(PULP_CBC_CMD(msg=0, threads=threads, timeLimit=time_limit, gapRel=mip_gap,
+                                warmStart=start is not None))
+        if prob.sol_status not in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+            if time_limit is not None and prob.status == LpStatusNotSolved:
+                raise ValueError(f"CBC did not find a solution within {time_limit} seconds, please increase "
+                                 f"time_limit or warm start it from a heuristic solution.")
+            raise ValueError(f"The solver could not find a solution, status: {LpStatus[prob.status]}. "
+                             f"If you used max_distance / k_nearest, the pruned problem may be infeasible for "
+                             f"{self.number_of_loc} locations, please loosen them.")
+        solution = self.solution_from_values([v.varValue for v in amount_vars], [v.varValue for v in wh_vars])
+        if prob.sol_status == LpSolutionOptimal:
+            # CBC only stops early on the gap, so the bound is at least objective * (1 - mip_gap).
+            solution.lower_bound = solution.objective * (1 - (mip_gap or 0.0))
+            solution.status = OPTIMAL
+        else:
+            solution.status = TIME_LIMIT
+        return solution
+
+    def to_pulp(self, supplies, demands):
+        """
+        Builds the same model as a PuLP problem, for the CBC fallback.
+
+        Returns:
+            tuple: (problem, assignment variables in pair order, site variables in supply order)
+        """
+        prob = LpProblem("Transportation", LpMinimize)
+
+        # DECISION VARIABLES
+        amount_vars = [LpVariable(f"X_{supplies[s]}_{demands[d]}", lowBound=0, upBound=1, cat='Binary')
+                       for s, d in zip(self.supply_positions, self.demand_positions)]
+        wh_vars = [LpVariable(f"Supply_{supply}", lowBound=0, upBound=1, cat='Binary') for supply in supplies]
+
+        prob += LpAffineExpression(zip(amount_vars, self.costs.tolist()))
+
+        # CONSTRAINTS
+        demand_vars = [[] for _ in range(self.n_demands)]
+        for amount_var, d in zip(amount_vars, self.demand_positions):
+            demand_vars[d].append((amount_var, 1))
+        for assignments in demand_vars:
+            prob += LpConstraint(LpAffineExpression(assignments), LpConstraintEQ, rhs=1)
+
+        for amount_var, s in zip(amount_vars, self.supply_positions):
+            prob += LpConstraint(LpAffineExpression([(amount_var, 1), (wh_vars[s], -1)]), LpConstraintLE, rhs=0)
+
+        prob += LpConstraint(LpAffineExpression([(wh_var, 1) for wh_var in wh_vars]), LpConstraintEQ,
+                             name=NUMBER_OF_LOC_CONSTRAINT, rhs=self.number_of_loc)
+
+        return prob, amount_vars, wh_vars
+
+
+def solve_model(model: PMedianModel, solver: str = "auto", supplies=None, demands=None, threads: int = None,
+                time_limit: float = None, mip_gap: float = None, warm_start=False, profile=None) -> PMedianSolution:
+    """
+    Solves the model with the given solver.
+
+    Parameters:
+        model (PMedianModel): The model.
+        solver (str): "auto", "highs", "cbc" or "heuristic".
+        supplies (list): Supply ids, needed to name the variables of the CBC model.
+        demands (list): Demand ids, needed to name the variables of the CBC model.
+        threads (int): Number of CBC threads. HiGHS through scipy and the heuristic run single threaded.
+        time_limit (float): Seconds after which the solver returns the best solution found so far.
+        mip_gap (float): Relative gap at which the solver stops.
+        warm_start (bool or PMedianSolution): Start CBC from this solution, or from a heuristic solution if True.
+            The heuristic starts its search from the sites of the given solution. Ignored by HiGHS, as
+            scipy.optimize.milp can not take a start solution.
+        profile (RunProfile): Optional profile, the model building and solving times are recorded on it.
+
+    Returns:
+        PMedianSolution: Its status is "optimal", "time_limit" (the best solution found within the time limit)
+        or "heuristic".
+    """
+    solver = resolve_solver(solver)
+    start = warm_start if isinstance(warm_start, PMedianSolution) else None
+    with timed(profile, MODEL_BUILDING):
+        if solver == "cbc":
+            problem = model.to_pulp(supplies, demands)
+        elif solver == "highs":
+            model.constraint_matrix()
+        else:
+            cost_matrix = model.cost_matrix()
+
+    with timed(profile, SOLVING):
+        if solver == "cbc":
+            if warm_start is True:
+                start = solve_p_median(model.cost_matrix(), model.number_of_loc, bound_iterations=0,
+                                       time_limit=time_limit)
+            return model.solve_cbc(supplies, demands, threads, time_limit, mip_gap, start, problem)
+        if solver == "highs":
+            return model.solve_highs(time_limit, mip_gap)
+        return solve_p_median(cost_matrix, model.number_of_loc,
+                              initial=None if start is None else start.supply_positions,
+                              time_limit=time_limit, mip_gap=mip_gap)
+
+
+def sweep_p_median(model: PMedianModel, numbers_of_loc, solver: str = "auto", supplies=None, demands=None,
+                   threads: int = None, time_limit: float = None, mip_gap: float = None):
+    """
+    Solves the model for several numbers of sites, building it only once.
+
+    Parameters:
+        model (PMedianModel): The model, its number_of_loc is changed for every solve.
+        numbers_of_loc (iterable): The numbers of sites, solved in increasing order.
+        solver (str): "auto", "highs", "cbc" or "heuristic".
+        supplies (list): Supply ids, needed to name the variables of the CBC model.
+        demands (list): Demand ids, needed to name the variables of the CBC model.
+        threads (int): Number of CBC threads.
+        time_limit (float): Time limit of every number of sites, in seconds. With CBC the heuristic warm start
+            gets at most half of it and CBC the rest.
+        mip_gap (float): Relative gap at which every solve stops.
+
+    Returns:
+        list: (number_of_loc, PMedianSolution, seconds) for every number of sites.
+
+    Note:
+        Every k starts from the solution of the previous k: the heuristic extends its sites greedily and
+        searches from there, and CBC gets that heuristic solution as a warm start. CBC and HiGHS only change
+        the right-hand side of the number of sites constraint between the solves. scipy.optimize.milp can not
+        take a warm start, so HiGHS only reuses the constraint matrix.
+    """
+    solver = resolve_solver(solver)
+    cost_matrix = None if solver == "highs" else model.cost_matrix()
+    if solver == "cbc":
+        problem = model.to_pulp(supplies, demands)
+
+    results = []
+    previous_sites = None
+    for number_of_loc in sorted(set(numbers_of_loc)):
+        start = perf_counter()
+        model.set_number_of_loc(number_of_loc)
+
+        if solver == "highs":
+            solution = model.solve_highs(time_limit, mip_gap)
+        elif solver == "cbc":
+            solution = solve_p_median(cost_matrix, number_of_loc, initial=previous_sites, bound_iterations=0,
+                                      time_limit=None if time_limit is None else time_limit / 2)
+            problem[0].constraints[NUMBER_OF_LOC_CONSTRAINT].changeRHS(number_of_loc)
+            # CBC still needs a positive time limit when the warm start used up its half
+            remaining = None if time_limit is None else max(time_limit - (perf_counter() - start), 1e-3)
+            solution = model.solve_cbc(supplies, demands, threads, remaining, mip_gap, start=solution,
+                                       problem=problem)
+        else:
+            solution = solve_p_median(cost_matrix, number_of_loc, initial=previous_sites, time_limit=time_limit,
+                                      mip_gap=mip_gap)
+
+        previous_sites = solution.supply_positions
+        results.append((number_of_loc, solution, perf_counter() - start))
+    return results
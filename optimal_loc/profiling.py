@@ -0,0 +1,76 @@
+import logging
+from contextlib import contextmanager
+from time import perf_counter
+
+logger = logging.getLogger(__name__)
+
+INDEXING = "indexing"
+DISTANCE_MATRIX = "distance_matrix"
+PIVOTING = "pivoting"
+MODEL_BUILDING = "model_building"
+SOLVING = "solving"
+EXTRACTION = "extraction"
+
+
+class RunProfile:
+    """
+    Wall time per phase of a run plus information about the model and its solution.
+
+    Attributes:
+        phases (dict): Seconds spent per phase: "indexing", "distance_matrix", "pivoting", "model_building",
+            "solving" and "extraction".
+        info (dict): e.g. solver, n_variables, n_constraints, status, objective, lower_bound, gap.
+        callback (callable): Optional hook, called as callback(phase, seconds, profile) after every phase.
+
+    Every phase is also logged at INFO level on the "optimal_loc.profiling" logger.
+    """
+
+    def __init__(self, callback=None):
+        self.phases = {}
+        self.info = {}
+        self.callback = callback
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        logger.info("%s took %.3f seconds", name, seconds)
+        if self.callback is not None:
+            self.callback(name, seconds, self)
+
+    def clear(self, *names) -> None:
+        """Forgets the given phases (all of them if none are given) and the information of the last solve."""
+        for name in names or list(self.phases):
+            self.phases.pop(name, None)
+        self.info = {}
+
+    def update(self, **info) -> None:
+        self.info.update(info)
+        logger.info("%s", ", ".join(f"{key}={value}" for key, value in info.items()))
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(self.phases.values())
+
+    def to_dict(self) -> dict:
+        return {**{f"{name}_seconds": seconds for name, seconds in self.phases.items()}, **self.info}
+
+    def __repr__(self):
+        phases = ", ".join(f"{name}={seconds:.3f}s" for name, seconds in self.phases.items())
+        return f"RunProfile({phases}, {self.info})"
+
+
+@contextmanager
+def timed(profile: RunProfile, name: str):
+    """Times a phase on the profile, or does nothing when there is no profile."""
+    if profile is None:
+        yield None
+    else:
+        with profile.phase(name):
+            yield profile
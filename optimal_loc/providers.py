@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from numpy import asarray, float32, float64, full, isnan, nan
+
+from optimal_loc.distances import h3_grid_distances, haversine_distances
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class DistanceProvider:
+    """
+    Interface of the distance sources 'create_hexagon_distance_data' can call.
+
+    A provider returns the (n_from, n_to) float32 matrix of distances from every "from" hexagon to every "to"
+    hexagon, NaN for the pairs it has no distance for. It gets both the centroids and the hexagon ids, and uses
+    whichever it needs.
+    """
+
+    def distances(self, from_lat, from_lon, to_lat, to_lon, from_hexagons=None, to_hexagons=None,
+                  resolution: int = None):
+        raise NotImplementedError
+
+
+class HaversineProvider(DistanceProvider):
+    """Great-circle distances in metres between the hexagon centroids."""
+
+    def distances(self, from_lat, from_lon, to_lat, to_lon, from_hexagons=None, to_hexagons=None,
+                  resolution: int = None):
+        return haversine_distances(from_lat, from_lon, to_lat, to_lon)
+
+
+class H3GridProvider(DistanceProvider):
+    """
+    Distances in metres along the H3 grid (grid steps times the distance between neighbouring centroids).
+
+    The pairs H3 can not measure, e.g. across a pentagon, get the haversine distance.
+    """
+
+    def distances(self, from_lat, from_lon, to_lat, to_lon, from_hexagons=None, to_hexagons=None,
+                  resolution: int = None):
+        values = h3_grid_distances(from_hexagons, to_hexagons, resolution)
+        unknown = isnan(values)
+        if unknown.any():
+            values[unknown] = haversine_distances(from_lat, from_lon, to_lat, to_lon)[unknown]
+        return values
+
+
+class OSRMTableProvider(DistanceProvider):
+    """
+    Road network distances (or durations) from an OSRM-style table service, requested concurrently in tiles.
+
+    Parameters:
+        url (str): Base url of the service, e.g. "http://localhost:5000".
+        profile (str): Routing profile in the url. Default is "driving".
+        max_table_size (int): Maximum number of coordinates per request, OSRM's --max-table-size. Each tile has
+            max_table_size // 2 sources and destinations. Default is 100.
+        max_concurrency (int): Maximum number of requests in flight, also the size of the keep-alive
+            connection pool. Default is 8.
+        max_retries (int): Retries of a tile after a connection error, a timeout or a 429/5xx answer. Default is 5.
+        backoff (float): Seconds before the first retry, doubled for every further retry. Default is 0.5.
+        timeout (float): Seconds per request. Default is 60.
+        annotation (str): "distance" (metres) or "duration" (seconds). Default is "distance".
+        progress_path (str): Optional JSON lines file every finished tile is appended to. When the same matrix
+            is requested again, e.g. after a crash, the tiles in it are not requested again.
+
+    Raises:
+        ImportError: If aiohttp is not installed.
+
+    Example:
+        provider = OSRMTableProvider("http://localhost:5000", max_concurrency=16, progress_path="osrm_tiles.jsonl")
+        object.create_hexagon_distance_data(raw_data, distance_method=provider)
+    """
+
+    def __init__(self, url: str, profile: str = "driving", max_table_size: int = 100, max_concurrency: int = 8,
+                 max_retries: int = 5, backoff: float = 0.5, timeout: float = 60, annotation: str = "distance",
+                 progress_path: str = None):
+        if aiohttp is None:
+            raise ImportError("The OSRM provider needs aiohttp, please install it with `pip install aiohttp`.")
+        if max_table_size < 2:
+            raise ValueError("max_table_size must be at least 2.")
+        self.url = url.rstrip("/")
+        self.profile = profile
+        self.tile_size = max_table_size // 2
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.annotation = annotation
+        self.progress_path = progress_path
+
+    def distances(self, from_lat, from_lon, to_lat, to_lon, from_hexagons=None, to_hexagons=None,
+                  resolution: int = None):
+        coroutine = self.distances_async(from_lat, from_lon, to_lat, to_lon)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(coroutine)
+        # Called from a running event loop, e.g. in a notebook: run the requests on a loop of their own.
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(asyncio.run, coroutine).result()
+
+    async def distances_async(self, from_lat, from_lon, to_lat, to_lon):
+        """The coroutine behind 'distances', for callers which already run an event loop."""
+        from_points = list(zip(asarray(from_lon, dtype=float64).tolist(), asarray(from_lat, dtype=float64).tolist()))
+        to_points = list(zip(asarray(to_lon, dtype=float64).tolist(), asarray(to_lat, dtype=float64).tolist()))
+        values = full((len(from_points), len(to_points)), nan, dtype=float32)
+
+        done = self._read_progress(values, from_points, to_points)
+        tiles = [(row, column) for row in range(0, len(from_points), self.tile_size)
+                 for column in range(0, len(to_points), self.tile_size) if (row, column) not in done]
+        if not tiles:
+            return values
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            # Every tile is tried before a failure is raised, so the progress file keeps all the finished tiles.
+            results = await asyncio.gather(*[self._tile(session, semaphore, values, from_points, to_points, row, column)
+                                             for row, column in tiles], return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return values
+
+    async def _tile(self, session, semaphore, values, from_points, to_points, row: int, column: int) -> None:
+        sources = from_points[row:row + self.tile_size]
+        destinations = to_points[column:column + self.tile_size]
+        async with semaphore:
+            table = await self._request(session, sources, destinations)
+        values[row:row + len(sources), column:column + len(destinations)] = asarray(
+            [[nan if value is None else value for value in line] for line in table], dtype=float32)
+        self._write_progress(row, column, table)
+
+    async def _request(self, session, sources, destinations):
+        coordinates = ";".join(f"{lon:.6f},{lat:.6f}" for lon, lat in sources + destinations)
+        params = {"sources": ";".join(map(str, range(len(sources)))),
+                  "destinations": ";".join(map(str, range(len(sources), len(sources) + len(destinations)))),
+                  "annotations": self.annotation}
+        url = f"{self.url}/table/v1/{self.profile}/{coordinates}"
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with session.get(url, params=params) as response:
+                    if response.status not in RETRY_STATUSES:
+                        answer = await response.json(content_type=None)
+                        if response.status != 200 or answer.get("code") != "Ok":
+                            raise ValueError(f"The table service answered {response.status}: "
+                                             f"{answer.get('code')} {answer.get('message', '')}")
+                        return answer[f"{self.annotation}s"]
+                    error = f"status {response.status}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+                error = repr(exception)
+            if attempt < self.max_retries:
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise ConnectionError(f"The table request failed after {self.max_retries + 1} attempts, last error: {error}")
+
+    def _progress_key(self, from_points, to_points) -> str:
+        content = json.dumps([self.url, self.profile, self.annotation, self.tile_size, from_points, to_points])
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _read_progress(self, values, from_points, to_points) -> set:
+        if self.progress_path is None:
+            return set()
+        key = self._progress_key(from_points, to_points)
+        done = set()
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r+") as handle:
+                try:
+                    header = json.loads(handle.readline())
+                except ValueError:
+                    header = {}
+                if header.get("key") == key:
+                    end = handle.tell()
+                    for line in iter(handle.readline, ""):
+                        if not line.endswith("\n"):
+                            break  # the last line of an interrupted write
+                        tile = json.loads(line)
+                        table = asarray([[nan if value is None else value for value in row] for row in tile["table"]],
+                                        dtype=float32)
+                        values[tile["row"]:tile["row"] + table.shape[0],
+                               tile["column"]:tile["column"] + table.shape[1]] = table
+                        done.add((tile["row"], tile["column"]))
+                        end = handle.tell()
+                    handle.truncate(end)
+                    return done
+        with open(self.progress_path, "w") as handle:
+            handle.write(json.dumps({"key": key}) + "\n")
+        return done
+
+    def _write_progress(self, row: int, column: int, table) -> None:
+        if self.progress_path is not None:
+            with open(self.progress_path, "a") as handle:
+                handle.write(json.dumps({"row": row, "column": column, "table": table}) + "\n")
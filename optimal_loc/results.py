@@ -0,0 +1,188 @@
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime, timezone
+
+from numpy import asarray, floating, integer, load, save
+from pandas import DataFrame
+
+from optimal_loc.app_constants import OPTIMAL_DATA_COLUMN, SUPPLY_DATA_COLUMN
+
+RESULTS_DIR = "optimal_loc_results"
+MANIFEST = "manifest.json"
+FORMAT_VERSION = 1
+RUN_ID = "run_id"
+CREATED = "created"
+
+
+def _json_value(value):
+    if isinstance(value, integer):
+        return int(value)
+    if isinstance(value, floating):
+        return float(value)
+    if isinstance(value, dict):
+        return {key: _json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    return value
+
+
+def _column_array(column):
+    values = column.to_numpy()
+    if values.dtype == object:
+        # Fixed width strings, so the file can be memory-mapped and loaded without pickle.
+        return asarray(values.astype(str))
+    return values
+
+
+class RunResult:
+    """
+    The results of one run, read lazily from its directory.
+
+    Every table column is a separate .npy file, which is only read when the column or its table is used.
+
+    Attributes:
+        run_id (str): Id of the run, the name of its directory.
+        path (str): The run directory.
+        manifest (dict): The manifest: "metadata", the tables with their columns and row counts, "created".
+        metadata (dict): number_of_loc, resolution, objective, lower_bound, gap, solver, status, phase seconds, ...
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.run_id = os.path.basename(os.path.normpath(path))
+        with open(os.path.join(path, MANIFEST)) as handle:
+            self.manifest = json.load(handle)
+        self.metadata = self.manifest["metadata"]
+        self._tables = {}
+
+    def __repr__(self):
+        return f"RunResult(run_id={self.run_id!r}, metadata={self.metadata})"
+
+    @property
+    def tables(self) -> list:
+        return list(self.manifest["tables"])
+
+    def column(self, table: str, column: str, mmap: bool = True):
+        """Returns one column as a NumPy array, memory-mapped read-only by default."""
+        if column not in self.manifest["tables"][table]["columns"]:
+            raise ValueError(f"The table {table!r} of run {self.run_id!r} has no column {column!r}.")
+        return load(os.path.join(self.path, table, f"{column}.npy"), mmap_mode="r" if mmap else None,
+                    allow_pickle=False)
+
+    def table(self, table: str, columns=None) -> DataFrame:
+        """Returns the table, or only the given columns of it. Full tables are cached."""
+        if columns is None and table in self._tables:
+            return self._tables[table]
+        if table not in self.manifest["tables"]:
+            raise ValueError(f"Run {self.run_id!r} has no table {table!r}, it has {self.tables}.")
+        names = self.manifest["tables"][table]["columns"] if columns is None else list(columns)
+        data = DataFrame({name: self.column(table, name) for name in names}, columns=names)
+        if columns is None:
+            self._tables[table] = data
+        return data
+
+    @property
+    def optimal_data(self) -> DataFrame:
+        return self.table(OPTIMAL_DATA_COLUMN)
+
+    @property
+    def supply_data(self) -> DataFrame:
+        return self.table(SUPPLY_DATA_COLUMN)
+
+
+class ResultStore:
+    """
+    One directory per run under `root`, holding a manifest.json and one .npy file per table column.
+
+    Parameters:
+        root (str): The directory of the runs. Default is "optimal_loc_results".
+
+    Example:
+        store = ResultStore()
+        store.runs()                          # one row per run with its metadata
+        run = store.load()                    # the latest run, or store.load("20240101-120000-k5-ab12cd")
+        run.supply_data
+        run.column("optimal_data", "hex_lat")  # a single memory-mapped column
+    """
+
+    def __init__(self, root: str = RESULTS_DIR):
+        self.root = root
+
+    def __repr__(self):
+        return f"ResultStore(root={self.root!r})"
+
+    def save(self, tables: dict, metadata: dict = None, run_id: str = None) -> str:
+        """
+        Writes the tables of a run and its manifest, and returns the run id.
+
+        The run is written to a temporary directory which is renamed at the end, so a run directory is always
+        complete. An existing run with the same id is replaced.
+
+        Parameters:
+            tables (dict): DataFrames by name, e.g. {"optimal_data": ..., "supply_data": ...}.
+            metadata (dict): JSON serialisable information about the run.
+            run_id (str): Default is the creation time, the number of locations and a random suffix.
+        """
+        metadata = _json_value(dict(metadata or {}))
+        created = datetime.now(timezone.utc)
+        if run_id is None:
+            suffix = f"-k{metadata['number_of_loc']}" if "number_of_loc" in metadata else ""
+            run_id = f"{created:%Y%m%d-%H%M%S}{suffix}-{uuid.uuid4().hex[:6]}"
+
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, run_id)
+        temporary = os.path.join(self.root, f".{run_id}.{uuid.uuid4().hex}")
+        manifest = {"format_version": FORMAT_VERSION, RUN_ID: run_id, CREATED: created.isoformat(),
+                    "metadata": metadata, "tables": {}}
+        for name, data in tables.items():
+            os.makedirs(os.path.join(temporary, name))
+            for column in data.columns:
+                save(os.path.join(temporary, name, f"{column}.npy"), _column_array(data[column]), allow_pickle=False)
+            manifest["tables"][name] = {"columns": [str(column) for column in data.columns], "n_rows": len(data)}
+        with open(os.path.join(temporary, MANIFEST), "w") as handle:
+            json.dump(manifest, handle, indent=2)
+
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.rename(temporary, path)
+        return run_id
+
+    def run_ids(self) -> list:
+        """The ids of the complete runs, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        runs = []
+        for run_id in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, run_id, MANIFEST)
+            if not run_id.startswith(".") and os.path.exists(manifest_path):
+                with open(manifest_path) as handle:
+                    runs.append((json.load(handle)[CREATED], run_id))
+        return [run_id for _, run_id in sorted(runs)]
+
+    def runs(self) -> DataFrame:
+        """One row per run, oldest first, with its id, creation time and metadata."""
+        rows = []
+        for run_id in self.run_ids():
+            with open(os.path.join(self.root, run_id, MANIFEST)) as handle:
+                manifest = json.load(handle)
+            rows.append({RUN_ID: run_id, CREATED: manifest[CREATED], **manifest["metadata"]})
+        return DataFrame(rows)
+
+    def load(self, run_id: str = None) -> RunResult:
+        """
+        Opens a run, the latest one by default. The tables are only read when they are used.
+
+        Raises:
+            ValueError: If the store has no runs or no run with this id.
+        """
+        if run_id is None:
+            run_ids = self.run_ids()
+            if not run_ids:
+                raise ValueError(f"There are no results in {os.path.abspath(self.root)}.")
+            run_id = run_ids[-1]
+        path = os.path.join(self.root, run_id)
+        if not os.path.exists(os.path.join(path, MANIFEST)):
+            raise ValueError(f"There is no run {run_id!r} in {os.path.abspath(self.root)}.")
+        return RunResult(path)
@@ -1,12 +1,16 @@
+import argparse
 import os
 import streamlit as st
 from pandas import DataFrame
 from streamlit_folium import folium_static
-from pickle import load as pickle_load
-from folium import plugins, Map, CircleMarker, Marker, Icon
+from folium import plugins, Map
 from PIL import Image
 
-from optimal_loc.app_constants import COLOURS_LIST, FILENAME, OPTIMAL_DATA_COLUMN, SUPPLY_DATA_COLUMN, HEX_LAT, HEX_LON
+from optimal_loc.app_constants import SUPPLY_HEXAGON_ID
+from optimal_loc.maps import (
+    DEFAULT_MAX_CELLS, RENDER_MODES, coarsen_hexagons, group_colours, hexagon_layer, map_center, site_markers
+)
+from optimal_loc.results import RESULTS_DIR, ResultStore
 
 PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
 my_algorithm = Image.open(os.path.join(PACKAGE_DIR, 'Modelling Algorithm.png'))
@@ -14,11 +18,17 @@ my_algorithm = Image.open(os.path.join(PACKAGE_DIR, 'Modelling Algorithm.png'))
 st.set_page_config(layout="wide")
 
 
+parser = argparse.ArgumentParser()
+parser.add_argument("--results-dir", default=RESULTS_DIR)
+parser.add_argument("--run-id", default=None)
+arguments, _ = parser.parse_known_args()
+result_store = ResultStore(arguments.results_dir)
+
+
 @st.cache_data
-def read_data(my_json):
-    with open(my_json, 'rb') as handle:
-        output_distances = pickle_load(handle)
-    return output_distances
+def read_data(results_dir, run_id):
+    run = ResultStore(results_dir).load(run_id)
+    return run.optimal_data.copy(), run.supply_data.copy(), run.metadata
 
 
 st.sidebar.text('')
@@ -28,13 +38,16 @@ st.sidebar.text('')
 ### SEASON RANGE ###
 st.sidebar.markdown("**First select the station number you want to analyze:** 👇")
 
-analysis_result = read_data(FILENAME)
+run_ids = result_store.run_ids()[::-1]
+selected_run = st.sidebar.selectbox(
+    "Run", run_ids, index=run_ids.index(arguments.run_id) if arguments.run_id in run_ids else 0)
 
-optimal_data = DataFrame(analysis_result[OPTIMAL_DATA_COLUMN])
-supply_data = DataFrame(analysis_result[SUPPLY_DATA_COLUMN])
+optimal_data, supply_data, run_metadata = read_data(arguments.results_dir, selected_run)
+st.sidebar.caption(", ".join(f"{key}: {run_metadata[key]}" for key in ("number_of_loc", "resolution", "objective")
+                             if key in run_metadata))
 
-optimal_data["supply_group"] = optimal_data.groupby(['supply_hexagon_id']).ngroup()
-optimal_data["my_colours"] = optimal_data["supply_group"].apply(lambda x: COLOURS_LIST[x % (len(COLOURS_LIST))])
+render_mode = st.sidebar.selectbox("Map", RENDER_MODES)
+max_cells = st.sidebar.number_input("Maximum number of hexagons on the map", min_value=1, value=DEFAULT_MAX_CELLS)
 
 st.sidebar.text('')
 agree = st.sidebar.checkbox('Show Model Algorithm')
@@ -57,17 +70,13 @@ def plotting_main_map(optimization_data: DataFrame,
                       optimal_loc_data: DataFrame
                       ):
 
-    plot_center = [optimization_data[HEX_LAT].median(), optimization_data[HEX_LON].median()]
-    my_map = Map(location=plot_center, zoom_start=12)
-
-    for j, i in optimal_data.iterrows():
-        CircleMarker((i[HEX_LAT], i[HEX_LON]),
-                     radius=5,
-                     color=i["my_colours"]).add_to(my_map)
+    my_map = Map(location=map_center(optimization_data), zoom_start=12)
 
-    for j, i in optimal_loc_data.iterrows():
-        Marker([i[HEX_LAT], i[HEX_LON]], radius=5,
-               icon=Icon(color='red', icon='info-sign')).add_to(my_map)
+    # Above max_cells hexagons, their parents are drawn in the colour of the site serving most of their children.
+    plot_data, _ = coarsen_hexagons(optimization_data, max_cells, group=SUPPLY_HEXAGON_ID)
+    hexagon_layer(plot_data, group_colours(plot_data[SUPPLY_HEXAGON_ID]), render_mode,
+                  tooltip_columns=[SUPPLY_HEXAGON_ID]).add_to(my_map)
+    site_markers(optimal_loc_data, my_map)
 
     plugins.Fullscreen(position='topleft').add_to(my_map)
 
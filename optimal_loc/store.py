@@ -0,0 +1,216 @@
+import sqlite3
+
+from numpy import array, float32, int64, isfinite, ix_, logical_not, nonzero, zeros
+from pymongo import ASCENDING, UpdateOne
+
+from optimal_loc.app_constants import DISTANCE, FROMHEX, TOHEX
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.mongo import DEFAULT_BATCH_SIZE, read_distance_frame
+
+RESOLUTION = "resolution"
+DEFAULT_CACHE_PATH = "optimal_loc_distances.sqlite"
+
+
+def missing_blocks(found, known=None) -> list:
+    """
+    Splits the pairs which are not found into at most two (rows, columns) blocks to look up.
+
+    The first block holds the rows without any found pair, e.g. hexagons seen for the first time, with the columns
+    they miss. The second one holds the other rows with missing pairs and the columns those miss, e.g. the known
+    hexagons to the new ones. So growing an area only looks up new x all and old x new, not the whole matrix.
+
+    Parameters:
+        found (ndarray): Boolean matrix of the pairs which are already known.
+        known (ndarray): Optional boolean matrix of pairs which are not looked up although they were not found,
+            e.g. the distance of a hexagon to itself. Default is None.
+
+    Returns:
+        list: (row positions, column positions) of the non-empty blocks.
+    """
+    missing = ~found if known is None else ~(found | known)
+    new_rows = ~found.any(axis=1)
+    blocks = []
+    for rows in (new_rows & missing.any(axis=1), ~new_rows & missing.any(axis=1)):
+        rows = nonzero(rows)[0]
+        if len(rows):
+            blocks.append((rows, nonzero(missing[rows].any(axis=0))[0]))
+    return blocks
+
+
+class DistanceStore:
+    """
+    Persistent distances keyed by (resolution, fromhex, tohex).
+
+    A local SQLite file is always checked first. Pairs which are not in it are fetched from the optional MongoDB
+    collection and added to the file, so repeat runs over the same area do not touch the network. The pairs the
+    collection does not hold are remembered in the file too, until they are 'put' or 'forget_missing' is called.
+
+    Parameters:
+        path (str): The SQLite cache file. Default is "optimal_loc_distances.sqlite".
+        collection (Collection): Optional MongoDB collection with "resolution", "fromhex", "tohex" and "distance"
+            fields, the shared source of the distances.
+        batch_size (int): Number of documents per cursor batch and per bulk write. Default is 50,000.
+
+    Example:
+        store = DistanceStore("distances.sqlite", MongoClient(uri)["db"]["distances"])
+        object = OptimalLoc(distance_store=store)
+        object.create_hexagon_distance_data(raw_data)  # cached and stored distances replace the haversine ones
+        object.read_distances(read_from_dataframe=True, distance_dataframe=real_distances)  # e.g. edited ones
+        object.save_distances()  # writes them to the cache and back to MongoDB
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, collection=None, batch_size: int = DEFAULT_BATCH_SIZE):
+        self.path = path
+        self.collection = collection
+        self.batch_size = batch_size
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS distances ({RESOLUTION} INTEGER, {FROMHEX} TEXT, {TOHEX} TEXT, "
+            f"{DISTANCE} REAL, PRIMARY KEY ({RESOLUTION}, {FROMHEX}, {TOHEX})) WITHOUT ROWID")
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS missing ({RESOLUTION} INTEGER, {FROMHEX} TEXT, {TOHEX} TEXT, "
+            f"PRIMARY KEY ({RESOLUTION}, {FROMHEX}, {TOHEX})) WITHOUT ROWID")
+
+    def __repr__(self):
+        return f"DistanceStore(path={self.path!r}, collection={getattr(self.collection, 'name', None)!r})"
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def create_index(self) -> None:
+        """Creates the unique (resolution, fromhex, tohex) index the upserts and lookups of the collection use."""
+        self.collection.create_index([(RESOLUTION, ASCENDING), (FROMHEX, ASCENDING), (TOHEX, ASCENDING)],
+                                     unique=True)
+
+    def forget_missing(self, resolution: int = None) -> None:
+        """
+        Forgets which pairs the collection did not hold (of one resolution, or all), e.g. after it got new pairs,
+        so the next 'fill' looks them up again.
+        """
+        with self.connection:
+            if resolution is None:
+                self.connection.execute("DELETE FROM missing")
+            else:
+                self.connection.execute(f"DELETE FROM missing WHERE {RESOLUTION} = ?", (resolution,))
+
+    def _matching_rows(self, table: str, columns: str, resolution: int, matrix: DistanceMatrix) -> list:
+        cursor = self.connection.cursor()
+        try:
+            for name, hexagons in (("from_hexagons", matrix.from_hexagons), ("to_hexagons", matrix.to_hexagons)):
+                cursor.execute(f"CREATE TEMP TABLE {name} (hexagon TEXT PRIMARY KEY, position INTEGER)")
+                cursor.executemany(f"INSERT INTO {name} VALUES (?, ?)", zip(hexagons.tolist(), range(len(hexagons))))
+            cursor.execute(
+                f"SELECT f.position, t.position{columns} FROM {table} d "
+                f"JOIN from_hexagons f ON d.{FROMHEX} = f.hexagon JOIN to_hexagons t ON d.{TOHEX} = t.hexagon "
+                f"WHERE d.{RESOLUTION} = ?", (resolution,))
+            return cursor.fetchall()
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS temp.from_hexagons")
+            cursor.execute("DROP TABLE IF EXISTS temp.to_hexagons")
+
+    def _cached_pairs(self, resolution: int, matrix: DistanceMatrix):
+        rows = self._matching_rows("distances", f", d.{DISTANCE}", resolution, matrix)
+        if not rows:
+            return zeros(0, dtype=int64), zeros(0, dtype=int64), zeros(0, dtype=float32)
+        positions = array(rows)
+        return positions[:, 0].astype(int64), positions[:, 1].astype(int64), positions[:, 2].astype(float32)
+
+    def _absent_pairs(self, resolution: int, matrix: DistanceMatrix):
+        absent = zeros(matrix.shape, dtype=bool)
+        rows = self._matching_rows("missing", "", resolution, matrix)
+        if rows:
+            positions = array(rows, dtype=int64)
+            absent[positions[:, 0], positions[:, 1]] = True
+        return absent
+
+    def _write_cache(self, resolution: int, from_hexagons, to_hexagons, distances) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO distances VALUES (?, ?, ?, ?)",
+                zip([resolution] * len(distances), from_hexagons, to_hexagons, distances))
+            self.connection.executemany(
+                f"DELETE FROM missing WHERE {RESOLUTION} = ? AND {FROMHEX} = ? AND {TOHEX} = ?",
+                zip([resolution] * len(distances), from_hexagons, to_hexagons))
+
+    def _write_missing(self, resolution: int, from_hexagons, to_hexagons) -> None:
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO missing VALUES (?, ?, ?)",
+                                        zip([resolution] * len(from_hexagons), from_hexagons, to_hexagons))
+
+    def fill(self, matrix: DistanceMatrix, resolution: int):
+        """
+        Replaces the distances of the matrix with the stored ones, in place.
+
+        The cache is read first. Only if some pairs are not cached, the blocks of missing pairs (see
+        'missing_blocks') are read from the collection and the pairs found there are added to the cache. The
+        pairs the collection does not hold are recorded as missing and not looked up again.
+
+        Returns:
+            ndarray: Boolean mask of the pairs which were found in the store.
+        """
+        found = zeros(matrix.shape, dtype=bool)
+        from_positions, to_positions, distances = self._cached_pairs(resolution, matrix)
+        matrix.values[from_positions, to_positions] = distances
+        found[from_positions, to_positions] = True
+        if self.collection is None or found.all():
+            return found
+        known = found | self._absent_pairs(resolution, matrix)
+        if known.all():
+            return found
+
+        blocks = missing_blocks(known)
+        fetched = [read_distance_frame(self.collection, query={RESOLUTION: resolution,
+                                                               FROMHEX: {"$in": matrix.from_hexagons[rows].tolist()},
+                                                               TOHEX: {"$in": matrix.to_hexagons[columns].tolist()}},
+                                       coordinates=False, batch_size=self.batch_size)
+                   for rows, columns in blocks]
+        for block in fetched:
+            from_positions = matrix.from_hexagons.get_indexer(block[FROMHEX])
+            to_positions = matrix.to_hexagons.get_indexer(block[TOHEX])
+            new = ~found[from_positions, to_positions]
+            from_positions, to_positions = from_positions[new], to_positions[new]
+            distances = block[DISTANCE].to_numpy()[new]
+            matrix.values[from_positions, to_positions] = distances
+            found[from_positions, to_positions] = True
+            self._write_cache(resolution, matrix.from_hexagons[from_positions].tolist(),
+                              matrix.to_hexagons[to_positions].tolist(), distances.tolist())
+
+        looked_up = zeros(matrix.shape, dtype=bool)
+        for rows, columns in blocks:
+            looked_up[ix_(rows, columns)] = True
+        from_positions, to_positions = nonzero(looked_up & ~known & ~found)
+        self._write_missing(resolution, matrix.from_hexagons[from_positions].tolist(),
+                            matrix.to_hexagons[to_positions].tolist())
+        return found
+
+    def put(self, matrix: DistanceMatrix, resolution: int, write_back: bool = True) -> int:
+        """
+        Stores the known (finite) distances of the matrix in the cache and, with write_back, in the collection.
+        The pairs marked as 'estimated' in the matrix, e.g. haversine distances filled in for missing pairs, are
+        not stored.
+
+        The collection is written with unordered bulk upserts of `batch_size` pairs, so existing pairs are
+        updated and new ones inserted in one round trip per batch.
+
+        Returns:
+            int: The number of pairs written.
+        """
+        known = isfinite(matrix.values)
+        if matrix.estimated is not None:
+            known &= logical_not(matrix.estimated)
+        from_positions, to_positions = nonzero(known)
+        from_hexagons = matrix.from_hexagons[from_positions].tolist()
+        to_hexagons = matrix.to_hexagons[to_positions].tolist()
+        distances = matrix.values[from_positions, to_positions].tolist()
+        self._write_cache(resolution, from_hexagons, to_hexagons, distances)
+
+        if write_back and self.collection is not None:
+            for start in range(0, len(distances), self.batch_size):
+                end = start + self.batch_size
+                self.collection.bulk_write(
+                    [UpdateOne({RESOLUTION: resolution, FROMHEX: from_hexagon, TOHEX: to_hexagon},
+                               {"$set": {DISTANCE: distance}}, upsert=True)
+                     for from_hexagon, to_hexagon, distance in zip(from_hexagons[start:end], to_hexagons[start:end],
+                                                                   distances[start:end])],
+                    ordered=False)
+        return len(distances)
@@ -0,0 +1,90 @@
+from numpy import asarray, bincount, concatenate, empty, int64, ndarray, uint64, unique
+from pandas import DataFrame
+
+from optimal_loc.app_constants import LATITUDE, LONGITUDE
+from optimal_loc.indexing import DEFAULT_CHUNK_SIZE, frequency_table, geo_to_cells
+
+
+def chunk_coordinates(chunk):
+    """
+    Returns the latitude and longitude arrays of one chunk of events.
+
+    A chunk can be a DataFrame with "latitude" and "longitude" columns, an Arrow table or record batch
+    with the same columns, an (n, 2) array of latitude/longitude pairs or a (latitudes, longitudes) tuple.
+    """
+    if hasattr(chunk, "to_pandas") and not isinstance(chunk, DataFrame):
+        chunk = chunk.to_pandas()
+    if isinstance(chunk, DataFrame):
+        return chunk[LATITUDE].to_numpy(), chunk[LONGITUDE].to_numpy()
+    if isinstance(chunk, ndarray):
+        if chunk.ndim != 2 or chunk.shape[1] != 2:
+            raise ValueError("Array chunks must have the shape (n, 2) with latitude and longitude columns.")
+        return chunk[:, 0], chunk[:, 1]
+    if isinstance(chunk, tuple) and len(chunk) == 2:
+        return asarray(chunk[0]), asarray(chunk[1])
+    raise ValueError(f"Unsupported event chunk type: {type(chunk).__name__}")
+
+
+class HexagonCounter:
+    """
+    Event counts per hexagon, built from chunks of events.
+
+    Each chunk is folded into the counts and dropped, so the memory use is bounded by the number of hexagons
+    and not by the number of events. Counters of the same resolution can be merged, which lets separate
+    workers or files be counted independently and combined at the end.
+
+    Example:
+        counter = HexagonCounter(resolution=8)
+        counter.consume(pd.read_csv('events.csv', usecols=['latitude', 'longitude'], chunksize=1_000_000))
+        other = HexagonCounter(resolution=8).consume(pq.ParquetFile('events.parquet').iter_batches())
+        event_frequency_data = counter.merge(other).to_frame()
+    """
+
+    def __init__(self, resolution: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 n_workers: int = None, executor: str = "thread"):
+        self.resolution = resolution
+        self.chunk_size = chunk_size
+        self.n_workers = n_workers
+        self.executor = executor
+        self.cells = empty(0, dtype=uint64)
+        self.counts = empty(0, dtype=int64)
+        self.total_events = 0
+
+    def __len__(self):
+        return len(self.cells)
+
+    def _add_counts(self, cells, counts):
+        cells, inverse = unique(concatenate([self.cells, cells]), return_inverse=True)
+        self.counts = bincount(inverse, weights=concatenate([self.counts, counts]),
+                               minlength=len(cells)).astype(int64)
+        self.cells = cells
+
+    def update(self, chunk) -> "HexagonCounter":
+        """Folds one chunk of events into the counts."""
+        latitudes, longitudes = chunk_coordinates(chunk)
+        cells, counts = unique(
+            geo_to_cells(latitudes, longitudes, self.resolution,
+                         chunk_size=self.chunk_size, n_workers=self.n_workers, executor=self.executor),
+            return_counts=True)
+        self._add_counts(cells, counts)
+        self.total_events += int(counts.sum())
+        return self
+
+    def consume(self, chunks) -> "HexagonCounter":
+        """Folds every chunk of an iterable (a CSV/Parquet reader, a generator ...) into the counts."""
+        for chunk in chunks:
+            self.update(chunk)
+        return self
+
+    def merge(self, other: "HexagonCounter") -> "HexagonCounter":
+        """Adds the counts of another counter of the same resolution to this one."""
+        if other.resolution != self.resolution:
+            raise ValueError(
+                f"Can not merge hexagon counts of resolution {other.resolution} into resolution {self.resolution}.")
+        self._add_counts(other.cells, other.counts)
+        self.total_events += other.total_events
+        return self
+
+    def to_frame(self) -> DataFrame:
+        """Returns the counts in the `event_frequency_data` layout."""
+        return frequency_table(self.cells, self.counts)
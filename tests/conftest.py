@@ -0,0 +1,33 @@
+from h3 import k_ring
+from numpy.random import default_rng
+from pandas import DataFrame
+
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.indexing import cell_centroids
+
+RESOLUTION = 7
+CENTRE = "872a30661ffffff"
+
+
+def events(n: int = 2000, seed: int = 0) -> DataFrame:
+    """Seeded raw events around Manhattan, in the "latitude" and "longitude" columns."""
+    rng = default_rng(seed)
+    return DataFrame({"latitude": rng.normal(40.73, 0.02, n), "longitude": rng.normal(-73.99, 0.02, n)})
+
+
+def frequency_data(hexagons, events=1) -> DataFrame:
+    """Frequency data of the hexagons, with their centroids and `events` events each."""
+    latitudes, longitudes = cell_centroids(hexagons)
+    return DataFrame({"hexagon_id": hexagons, "total_event": events, "hex_lat": latitudes, "hex_lon": longitudes})
+
+
+def area(k: int = 4) -> list:
+    """The sorted hexagons within k grid steps of CENTRE, 61 for the default k."""
+    return sorted(k_ring(CENTRE, k))
+
+
+def real_distances(hexagons) -> DistanceMatrix:
+    """Haversine distances of the hexagons, standing in for real ones: not marked as estimated."""
+    matrix = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION)
+    matrix.estimated = None
+    return matrix
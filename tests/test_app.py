@@ -0,0 +1,184 @@
+from h3 import h3_get_resolution
+from numpy import arange, array
+from pandas import concat
+from pandas.testing import assert_frame_equal
+from pytest import approx, raises
+
+from optimal_loc.app import OptimalLoc, solution_tables
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.heuristics import PMedianSolution
+from optimal_loc.indexing import event_frequency_table
+from optimal_loc.providers import HaversineProvider
+from optimal_loc.store import DistanceStore
+
+from conftest import RESOLUTION, area, events, frequency_data, real_distances
+
+
+class CountingProvider(HaversineProvider):
+    """Haversine distances, counting the calls and the pairs they ask for."""
+
+    def __init__(self):
+        self.calls = 0
+        self.pairs = 0
+
+    def distances(self, from_lat, from_lon, to_lat, to_lon, from_hexagons=None, to_hexagons=None,
+                  resolution: int = None):
+        self.calls += 1
+        self.pairs += len(from_lat) * len(to_lat)
+        return super().distances(from_lat, from_lon, to_lat, to_lon, from_hexagons, to_hexagons, resolution)
+
+
+def test_distance_block_only_sends_the_missing_pairs_to_the_provider(tmp_path):
+    hexagons = area()
+    old, added = hexagons[:-2], hexagons[-2:]
+    full = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION)
+    store = DistanceStore(str(tmp_path / "distances.sqlite"))
+    store.put(real_distances(old), RESOLUTION, write_back=False)
+    app = OptimalLoc(distance_store=store, results_dir=str(tmp_path / "results"))
+    app.resolution = RESOLUTION
+    provider = CountingProvider()
+
+    matrix = app._distance_block(frequency_data(old + added), None, provider)
+
+    assert provider.calls == 2  # the new rows against all columns, the old rows against the new columns
+    assert provider.pairs == len(hexagons) ** 2 - len(old) ** 2
+    assert (matrix.reindex(hexagons, hexagons).values == full.values).all()
+    store.close()
+
+
+def test_hex_distance_data_is_read_only(tmp_path):
+    app = OptimalLoc(results_dir=str(tmp_path / "results"))
+    app.distance_matrix = DistanceMatrix.from_frequency_data(frequency_data(area(1)), RESOLUTION)
+    app.resolution = RESOLUTION
+
+    app.hex_distance_data["distance"] = 0
+    assert (app.distance_matrix.values > 0).all()
+    with raises(AttributeError):
+        app.hex_distance_data = app.distance_matrix.to_frame()
+
+    edited = app.distance_matrix.to_frame()
+    edited["distance"] = 1.0
+    app.read_distances(read_from_dataframe=True, distance_dataframe=edited)
+    assert (app.distance_matrix.values == 1).all()
+
+
+def test_save_distances_skips_the_estimated_pairs(tmp_path):
+    hexagons = area()
+    old, added = hexagons[:-2], hexagons[-2:]
+    store = DistanceStore(str(tmp_path / "distances.sqlite"))
+    store.put(real_distances(old), RESOLUTION, write_back=False)
+    app = OptimalLoc(distance_store=store, results_dir=str(tmp_path / "results"))
+    app.resolution = RESOLUTION
+
+    app.distance_matrix = app._distance_block(frequency_data(hexagons), None, "haversine")
+    assert app.save_distances(write_back=False) == len(old) ** 2
+
+    app.distance_matrix = app._distance_block(frequency_data(hexagons), None, CountingProvider())
+    assert app.save_distances(write_back=False) == len(hexagons) ** 2 - len(added)
+    store.close()
+
+
+def test_provider_distances_are_cached_for_the_next_run(tmp_path):
+    hexagons = area()
+    path = str(tmp_path / "distances.sqlite")
+    provider = CountingProvider()
+    for _ in range(2):
+        store = DistanceStore(path)
+        app = OptimalLoc(distance_store=store, results_dir=str(tmp_path / "results"))
+        app.resolution = RESOLUTION
+        matrix = app._distance_block(frequency_data(hexagons), None, provider)
+        store.close()
+
+    assert provider.calls == 1
+    assert provider.pairs == len(hexagons) ** 2
+    assert (matrix.values == real_distances(hexagons).values).all()
+
+
+def test_the_run_profile_times_every_phase_of_a_solve(tmp_path):
+    recorded = []
+    app = OptimalLoc(profile_callback=lambda phase, seconds, profile: recorded.append(phase),
+                     results_dir=str(tmp_path / "results"))
+    app.create_hexagon_distance_data(events(300), resolution=RESOLUTION)
+
+    app.calculate_optimal_locations(3, solver="highs")
+    optimum = app.objective
+    app.calculate_optimal_locations(3, solver="heuristic", time_limit=5, mip_gap=0.01)
+
+    assert recorded[:2] == ["indexing", "distance_matrix"]
+    assert {"model_building", "solving", "extraction"} <= set(recorded[2:])
+    assert app.profile.info["solver"] == "heuristic"
+    assert app.profile.info["lower_bound"] <= optimum * (1 + 1e-9)
+    assert app.objective == approx(optimum)
+    assert app.results.runs()["objective"].tolist() == approx([optimum, optimum])
+
+
+def test_solution_tables_give_every_site_its_served_events_and_distances():
+    data = frequency_data(area(1)[:4], events=[1, 2, 3, 4])
+    distances = arange(16.0).reshape(4, 4)
+    solution = PMedianSolution(array([0, 2]), array([0, 0, 2, 2]), 0.0)
+
+    optimal_data, supply_data = solution_tables(solution, data, distances)
+
+    assert optimal_data["supply_hexagon_id"].tolist() == data["hexagon_id"].iloc[[0, 0, 2, 2]].tolist()
+    assert supply_data["supply_hexagon_id"].tolist() == data["hexagon_id"].iloc[[0, 2]].tolist()
+    assert supply_data["served_events"].tolist() == [3, 7]
+    assert supply_data["mean_distance"].tolist() == approx([(1 * 0 + 2 * 1) / 3, (3 * 10 + 4 * 11) / 7])
+    assert supply_data["max_distance"].tolist() == [1, 11]
+
+    candidates = solution_tables(PMedianSolution(array([0, 1]), array([0, 0, 1, 1]), 0.0), data, distances[[0, 2]],
+                                 candidates=[0, 2])
+    assert_frame_equal(candidates[1], supply_data)
+
+
+def test_the_hierarchical_solve_refines_few_candidates_to_a_near_optimal_solution(tmp_path):
+    raw_data = events(1000)
+    app = OptimalLoc(results_dir=str(tmp_path / "results"))
+    app.create_hexagon_distance_data(raw_data, resolution=8)
+    app.calculate_optimal_locations(4, solver="highs")
+    optimum = app.objective
+
+    levels = app.hierarchical_optimal_locations(4, raw_data, resolution=8, coarse_resolution=7, solver="highs")
+
+    assert levels["resolution"].tolist() == [7, 8]
+    assert levels["n_candidates"].iloc[1] < levels["n_hexagons"].iloc[1]
+    assert optimum * (1 - 1e-9) <= app.objective <= optimum * 1.05
+    assert len(app.supply_data) == 4
+    assert {h3_get_resolution(hexagon) for hexagon in app.supply_data["supply_hexagon_id"]} == {8}
+
+
+def test_the_decomposed_solve_serves_every_hexagon_from_its_nearest_site(tmp_path):
+    app = OptimalLoc(results_dir=str(tmp_path / "results"))
+    app.create_hexagon_distance_data(events(300), resolution=8)
+    app.calculate_optimal_locations(6, solver="highs")
+    optimum = app.objective
+    data = app.event_frequency_data
+
+    partitions = app.decomposed_optimal_locations(6, n_partitions=3, solver="highs")
+
+    assert 1 < len(partitions) <= 3 and partitions["number_of_loc"].sum() == 6
+    sites = app.distance_matrix.reindex(app.supply_data["supply_hexagon_id"], data["hexagon_id"]).values
+    assert len(sites) == 6
+    assert app.objective == approx((sites.min(axis=0) * data["total_event"].to_numpy()).sum(), rel=1e-5)
+    assert app.objective >= optimum * (1 - 1e-9)
+
+
+def test_update_events_adds_the_delta_and_re_optimises_from_the_current_sites(tmp_path):
+    history, delta = events(300), events(100, seed=1)
+    app = OptimalLoc(results_dir=str(tmp_path / "results"))
+    app.create_hexagon_distance_data(history, resolution=8)
+    app.calculate_optimal_locations(3, solver="heuristic")
+    old_sites = set(app.supply_data["supply_hexagon_id"])
+
+    changes = app.update_events(delta)
+
+    data = app.event_frequency_data
+    expected = event_frequency_table(concat([history, delta]), 8)
+    counts = dict(zip(data["hexagon_id"], data["total_event"]))
+    assert counts == dict(zip(expected["hexagon_id"], expected["total_event"]))
+    full = DistanceMatrix.from_frequency_data(data, 8)
+    assert (app.distance_matrix.reindex(data["hexagon_id"], data["hexagon_id"]).values == full.values).all()
+    assert set(changes.loc[changes["change"] != "opened", "supply_hexagon_id"]) == old_sites
+    new_sites = set(app.supply_data["supply_hexagon_id"])
+    assert set(changes.loc[changes["change"] != "closed", "supply_hexagon_id"]) == new_sites
+    sites = full.reindex(app.supply_data["supply_hexagon_id"], data["hexagon_id"]).values
+    assert app.objective == approx((sites.min(axis=0) * data["total_event"].to_numpy()).sum(), rel=1e-5)
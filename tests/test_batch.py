@@ -0,0 +1,32 @@
+from numpy.random import default_rng
+from pytest import approx
+
+from optimal_loc.batch import Scenario, run_scenarios
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.indexing import event_frequency_table
+from optimal_loc.optimization import PMedianModel, candidate_pairs, solve_model
+from optimal_loc.results import ResultStore
+
+from conftest import events
+
+
+def test_scenarios_solved_on_the_pool_match_solving_them_one_by_one(tmp_path):
+    raw_data = events(300)
+    raw_data["night"] = default_rng(1).random(len(raw_data)) < 0.4
+    scenarios = [Scenario("all", 3, resolution=7, solver="highs"),
+                 Scenario("night", 2, resolution=7, query="night", solver="highs"),
+                 Scenario("too_many", 1000, resolution=7, solver="highs")]
+
+    summary = run_scenarios(raw_data, scenarios, str(tmp_path), max_workers=2)
+
+    assert summary["scenario"].tolist() == ["all", "night", "too_many"]
+    assert summary["error"].isna().tolist() == [True, True, False]
+    for scenario, objective in zip(scenarios[:2], summary["objective"]):
+        selected = raw_data if scenario.query is None else raw_data.query(scenario.query)
+        frequency_data = event_frequency_table(selected, 7)
+        distances = DistanceMatrix.from_frequency_data(frequency_data, 7).values
+        model = PMedianModel(distances, frequency_data["total_event"], *candidate_pairs(distances),
+                             scenario.number_of_loc)
+        assert objective == approx(solve_model(model, "highs").objective)
+        supply_data = ResultStore(str(tmp_path)).load(scenario.name).supply_data
+        assert len(supply_data) == scenario.number_of_loc
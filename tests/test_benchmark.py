@@ -0,0 +1,31 @@
+from pandas import DataFrame
+
+from optimal_loc.benchmark import compare_to_baseline
+
+
+def results(seconds: float, objective: float, error: str = None) -> DataFrame:
+    return DataFrame({"case": ["city-10000-r7-k5-heuristic-s0"], "calculate_optimal_locations_seconds": [seconds],
+                      "objective": [objective], "error": [error]})
+
+
+def regressions(current: DataFrame, baseline: DataFrame, **options) -> set:
+    comparison = compare_to_baseline(current, baseline, **options)
+    return set(comparison.loc[comparison["regression"], "metric"])
+
+
+def test_a_worse_objective_regresses_within_the_time_tolerance():
+    baseline = results(1.0, 1000.0)
+
+    assert regressions(results(1.2, 1000.0), baseline) == set()
+    assert regressions(results(1.0, 1200.0), baseline) == {"objective"}
+    assert regressions(results(1.0, 1000.01), baseline) == {"objective"}
+    assert regressions(results(1.0, 1000.01), baseline, objective_tolerance=0.01) == set()
+    assert regressions(results(1.0, 900.0), baseline) == set()
+
+
+def test_slower_runs_and_new_failures_regress():
+    baseline = results(1.0, 1000.0)
+
+    assert regressions(results(1.3, 1000.0), baseline) == {"calculate_optimal_locations_seconds"}
+    assert regressions(results(0.01, 1000.0), results(0.001, 1000.0)) == set()
+    assert regressions(results(None, None, "infeasible"), baseline) == {"error"}
@@ -0,0 +1,39 @@
+from itertools import combinations
+
+from h3 import k_ring
+from numpy import arange, ones
+from pytest import approx
+
+from optimal_loc.coverage import MAX_COVERAGE, SET_COVER, CoverageModel, ring_coverage_pairs, solve_coverage
+
+CENTRE = "882a306605fffff"
+
+
+def test_set_cover_reduction_keeps_the_optimum():
+    hexagons = sorted(k_ring(CENTRE, 6))
+    model = CoverageModel(len(hexagons), ones(len(hexagons)), *ring_coverage_pairs(hexagons, 2), SET_COVER)
+
+    sites, demands, reduced = model.reduce()
+    solution = solve_coverage(model, "highs", hexagons, hexagons)
+
+    assert reduced.n_supplies == len(sites) < model.n_supplies
+    assert reduced.n_demands == len(demands) < model.n_demands
+    assert solution.covered.all()
+    assert solution.objective == model.solve_highs().objective
+    assert solution.objective == solve_coverage(model, "cbc", hexagons, hexagons).objective
+
+
+def test_max_coverage_covers_the_most_events_of_any_set_of_sites():
+    hexagons = sorted(k_ring(CENTRE, 3))
+    weights = arange(1, len(hexagons) + 1) % 7
+    model = CoverageModel(len(hexagons), weights, *ring_coverage_pairs(hexagons, 1), MAX_COVERAGE, number_of_loc=3)
+    coverage = model.coverage_matrix().toarray() > 0
+    best = max(weights[coverage[list(sites)].any(axis=0)].sum() for sites in combinations(range(len(hexagons)), 3))
+
+    for solver in ("highs", "cbc"):
+        solution = solve_coverage(model, solver, hexagons, hexagons)
+
+        assert len(solution.supply_positions) == 3
+        assert solution.objective == approx(best)
+        assert solution.objective == approx(weights[solution.covered].sum())
+    assert model.solve_greedy().objective <= best
@@ -0,0 +1,33 @@
+from numpy import int8, int16, isnan
+
+from optimal_loc.distances import DistanceMatrix, category_codes
+
+from conftest import RESOLUTION, area, frequency_data
+
+
+def test_a_shuffled_long_form_frame_gives_the_matrix_in_any_hexagon_order():
+    hexagons = area(2)
+    full = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION)
+    distance_data = full.to_frame().astype({"fromhex": str, "tohex": str}).sample(frac=1, random_state=0)
+    dropped = distance_data.iloc[0]
+
+    matrix = DistanceMatrix.from_frame(distance_data.iloc[1:]).reindex(hexagons[::-1], hexagons)
+
+    expected = full.values[::-1].copy()
+    expected[hexagons[::-1].index(dropped["fromhex"]), hexagons.index(dropped["tohex"])] = float("nan")
+    assert ((matrix.values == expected) | (isnan(matrix.values) & isnan(expected))).all()
+    assert isnan(matrix.values).sum() == 1
+
+
+def test_the_long_form_frame_holds_the_hexagons_as_small_categorical_codes():
+    hexagons = area(2)
+    matrix = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION).reindex(hexagons, hexagons[:5])
+
+    distance_data = matrix.to_frame()
+
+    assert distance_data["fromhex"].cat.codes.dtype == int8
+    assert distance_data["tohex"].tolist() == hexagons[:5] * len(hexagons)
+    assert distance_data["fromhex"].astype(str).tolist() == [hexagon for hexagon in hexagons for _ in range(5)]
+    assert (DistanceMatrix.from_frame(distance_data).values == matrix.values).all()
+    assert (DistanceMatrix.from_frame(distance_data.astype({"fromhex": str})).values == matrix.values).all()
+    assert category_codes(200).dtype == int16
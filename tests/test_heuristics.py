@@ -0,0 +1,23 @@
+from itertools import combinations
+
+from numpy import arange
+from pytest import approx
+
+from optimal_loc.heuristics import solve_p_median
+
+from conftest import area, real_distances
+
+
+def test_heuristic_objective_and_lagrangian_bound_enclose_the_optimum():
+    distances = real_distances(area(2)).values
+    costs = distances * arange(1, distances.shape[1] + 1)
+
+    for number_of_loc in (1, 3):
+        optimum = min(costs[list(sites)].min(axis=0).sum() for sites in combinations(range(len(costs)), number_of_loc))
+
+        solution = solve_p_median(costs, number_of_loc)
+
+        assert len(solution.supply_positions) == number_of_loc
+        assert solution.objective == approx(costs[solution.assignment, arange(costs.shape[1])].sum())
+        assert solution.lower_bound <= optimum + 1e-6 * optimum
+        assert solution.objective == approx(optimum)
@@ -0,0 +1,28 @@
+from h3 import geo_to_h3, h3_to_parent
+from pandas import Series
+
+from optimal_loc.indexing import auto_resolution_counts, cells_to_strings, event_frequency_table
+
+from conftest import events
+
+
+def test_bulk_indexing_counts_like_one_geo_to_h3_per_event():
+    raw_data = events()
+    expected = raw_data.apply(lambda row: geo_to_h3(row["latitude"], row["longitude"], 8), axis=1).value_counts()
+
+    for kwargs in ({}, {"chunk_size": 300, "n_workers": 3}):
+        table = event_frequency_table(raw_data, 8, **kwargs)
+
+        assert dict(zip(table["hexagon_id"], table["total_event"])) == expected.to_dict()
+        assert table["total_event"].is_monotonic_decreasing
+
+
+def test_auto_resolution_is_the_finest_parent_level_below_max_hexagons():
+    raw_data = events()
+    finest = [geo_to_h3(lat, lon, 15) for lat, lon in zip(raw_data["latitude"], raw_data["longitude"])]
+
+    resolution, cells, counts = auto_resolution_counts(raw_data, max_hexagons=150)
+
+    parents = Series([h3_to_parent(cell, resolution) for cell in finest]).value_counts()
+    assert len(cells) < 150 <= len({h3_to_parent(cell, resolution + 1) for cell in finest})
+    assert dict(zip(cells_to_strings(cells), counts)) == parents.to_dict()
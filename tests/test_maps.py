@@ -0,0 +1,30 @@
+from h3 import h3_to_children, h3_to_parent
+from pandas import DataFrame
+
+from optimal_loc.maps import coarsen_hexagons
+
+PARENT = "872a30661ffffff"
+
+
+def children_data(groups, weights) -> DataFrame:
+    return DataFrame({"hexagon_id": sorted(h3_to_children(PARENT, 8)), "site": groups, "total_event": weights})
+
+
+def test_coarsen_hexagons_gives_the_parent_the_group_of_most_children():
+    data = children_data(["a"] * 5 + ["b"] * 2, 1)
+
+    coarse, resolution = coarsen_hexagons(data, max_cells=1, group="site")
+
+    assert resolution == 7
+    assert coarse["hexagon_id"].tolist() == [h3_to_parent(data["hexagon_id"][0], 7)]
+    assert coarse["site"].tolist() == ["a"]
+    assert coarse["total_event"].tolist() == [7]
+
+
+def test_coarsen_hexagons_gives_the_parent_the_group_of_the_largest_weight():
+    data = children_data(["a"] * 5 + ["b"] * 2, [1] * 5 + [10] * 2)
+
+    coarse, _ = coarsen_hexagons(data, max_cells=1, weight="total_event", group="site")
+
+    assert coarse["site"].tolist() == ["b"]
+    assert coarse["total_event"].tolist() == [25]
@@ -0,0 +1,41 @@
+from pandas import CategoricalDtype
+
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.mongo import read_distance_frame
+
+from conftest import area, real_distances
+
+
+class ListCollection:
+    """An in-memory MongoDB collection answering `$in` and equality filters, recording the projections."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.projections = []
+
+    @staticmethod
+    def _matches(document, query):
+        return all(document[field] in condition["$in"] if isinstance(condition, dict) else document[field] == condition
+                   for field, condition in query.items())
+
+    def find(self, query, projection=None, batch_size=None):
+        self.projections.append(projection)
+        return iter([{field: document[field] for field in projection if projection[field]}
+                     for document in self.documents if self._matches(document, query)])
+
+
+def test_distance_documents_are_read_in_batches_with_the_hexagon_filter_pushed_down():
+    hexagons = area(2)
+    frame = real_distances(hexagons).to_frame()
+    collection = ListCollection([{"_id": i, "fromhex": row.fromhex, "tohex": row.tohex, "distance": row.distance,
+                                  "profile": "car"} for i, row in enumerate(frame.itertuples())])
+    subset = hexagons[:7]
+
+    distance_data = read_distance_frame(collection, subset, batch_size=5)
+
+    assert collection.projections == [{"fromhex": 1, "tohex": 1, "distance": 1, "_id": 0}]
+    assert list(distance_data.columns) == ["fromhex", "tohex", "distance"]
+    assert isinstance(distance_data["fromhex"].dtype, CategoricalDtype)
+    assert len(distance_data) == len(subset) ** 2
+    matrix = DistanceMatrix.from_frame(distance_data).reindex(subset, subset)
+    assert (matrix.values == real_distances(hexagons).reindex(subset, subset).values).all()
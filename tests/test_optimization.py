@@ -0,0 +1,77 @@
+from numpy import arange, bincount, repeat, sort, tile
+from pytest import approx, raises
+
+from optimal_loc import optimization
+from optimal_loc.optimization import (
+    PMedianModel, candidate_pairs, check_candidate_pairs, solve_model, sweep_p_median
+)
+
+from conftest import area, real_distances
+
+
+def p_median_model(k: int = 2, number_of_loc: int = 3) -> PMedianModel:
+    hexagons = area(k)
+    distances = real_distances(hexagons).values
+    n = len(hexagons)
+    return PMedianModel(distances, arange(1, n + 1), repeat(arange(n), n), tile(arange(n), n), number_of_loc)
+
+
+def test_candidate_pairs_keep_the_k_nearest_supplies_within_the_cutoff():
+    distances = real_distances(area(2)).values
+    distances[0, 5] = float("nan")
+
+    supplies, demands = candidate_pairs(distances, k_nearest=4)
+
+    assert (bincount(demands) == 4).all()
+    for demand in range(distances.shape[1]):
+        kept = sort(distances[supplies[demands == demand], demand])
+        assert (kept == sort(distances[:, demand])[:4]).all()
+
+    supplies, demands = candidate_pairs(distances, max_distance=3000)
+    assert (distances[supplies, demands] <= 3000).all()
+    assert len(supplies) == (distances <= 3000).sum() < distances.size - 1
+    with raises(ValueError):
+        check_candidate_pairs(*candidate_pairs(distances, max_distance=10)[1:], distances.shape[1])
+
+
+def test_highs_cbc_and_the_heuristic_find_the_same_objective():
+    model = p_median_model(number_of_loc=4)
+    names = [str(i) for i in range(model.n_supplies)]
+
+    highs = solve_model(model, "highs")
+    cbc = solve_model(model, "cbc", names, names)
+    heuristic = solve_model(model, "heuristic")
+
+    assert highs.status == cbc.status == "optimal"
+    assert len(highs.supply_positions) == 4
+    assert cbc.objective == approx(highs.objective)
+    assert heuristic.objective == approx(highs.objective)
+    assert heuristic.lower_bound <= highs.objective * (1 + 1e-9)
+
+
+def test_sweep_shares_the_time_limit_between_the_warm_start_and_cbc(monkeypatch):
+    limits = []
+    solve_p_median, solve_cbc = optimization.solve_p_median, PMedianModel.solve_cbc
+
+    def heuristic(*args, **kwargs):
+        limits.append(("heuristic", kwargs["time_limit"]))
+        return solve_p_median(*args, **kwargs)
+
+    def cbc(self, supplies, demands, threads, time_limit, *args, **kwargs):
+        limits.append(("cbc", time_limit))
+        return solve_cbc(self, supplies, demands, threads, time_limit, *args, **kwargs)
+
+    monkeypatch.setattr(optimization, "solve_p_median", heuristic)
+    monkeypatch.setattr(PMedianModel, "solve_cbc", cbc)
+    model = p_median_model()
+    names = [str(i) for i in range(model.n_supplies)]
+
+    results = sweep_p_median(model, [3, 2], "cbc", names, names, time_limit=20)
+
+    assert [number_of_loc for number_of_loc, _, _ in results] == [2, 3]
+    assert [solver for solver, _ in limits] == ["heuristic", "cbc"] * 2
+    assert all(limit == 10 for _, limit in limits[::2])
+    assert all(0 < limit < 20 for _, limit in limits[1::2])
+    for number_of_loc, solution, _ in results:
+        model.set_number_of_loc(number_of_loc)
+        assert abs(solution.objective - model.solve_highs().objective) < 1e-6 * solution.objective
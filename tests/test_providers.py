@@ -0,0 +1,110 @@
+import asyncio
+from threading import Thread
+from time import perf_counter
+
+from numpy import allclose, arange
+from pytest import fixture, importorskip, raises
+
+from optimal_loc.distances import haversine_distances
+from optimal_loc.providers import OSRMTableProvider
+
+web = importorskip("aiohttp.web")
+
+
+class StubTableService:
+    """
+    A local OSRM-style table service answering with the haversine distances.
+
+    It records the (sources, destinations) of every request. The first `failures` requests, and every request
+    whose first source is `failing_source`, get a 503.
+    """
+
+    def __init__(self):
+        self.url = None
+        self.requests = []
+        self.failures = 0
+        self.failing_source = None
+
+    async def table(self, request):
+        coordinates = request.match_info["coordinates"].split(";")
+        points = [[float(value) for value in point.split(",")] for point in coordinates]
+        sources = [points[int(i)] for i in request.query["sources"].split(";")]
+        destinations = [points[int(i)] for i in request.query["destinations"].split(";")]
+        self.requests.append((len(sources), len(destinations)))
+        if self.failures or sources[0] == self.failing_source:
+            self.failures = max(self.failures - 1, 0)
+            return web.Response(status=503)
+        distances = haversine_distances([lat for _, lat in sources], [lon for lon, _ in sources],
+                                        [lat for _, lat in destinations], [lon for lon, _ in destinations])
+        return web.json_response({"code": "Ok", "distances": distances.tolist()})
+
+
+@fixture
+def service():
+    stub = StubTableService()
+    application = web.Application()
+    application.router.add_get("/table/v1/{profile}/{coordinates}", stub.table)
+    runner = web.AppRunner(application)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    stub.url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield stub
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+def points(n: int, offset: float = 0.0):
+    return 40.70 + offset + arange(n) * 0.01, -74.00 + arange(n) * 0.01
+
+
+def test_the_matrix_is_requested_in_tiles(service):
+    from_lat, from_lon = points(7)
+    to_lat, to_lon = points(5, 0.005)
+    provider = OSRMTableProvider(service.url, max_table_size=4)
+
+    values = provider.distances(from_lat, from_lon, to_lat, to_lon)
+
+    assert len(service.requests) == 4 * 3
+    assert all(sources <= 2 and destinations <= 2 for sources, destinations in service.requests)
+    assert allclose(values, haversine_distances(from_lat, from_lon, to_lat, to_lon), rtol=1e-4)
+
+
+def test_a_busy_service_is_retried_with_backoff(service):
+    lat, lon = points(3)
+    service.failures = 2
+    provider = OSRMTableProvider(service.url, backoff=0.05)
+
+    start = perf_counter()
+    values = provider.distances(lat, lon, lat, lon)
+
+    assert len(service.requests) == 3
+    assert perf_counter() - start >= 0.05 + 0.1
+    assert allclose(values, haversine_distances(lat, lon, lat, lon), rtol=1e-4)
+
+    service.requests, service.failures = [], 10
+    with raises(ConnectionError):
+        OSRMTableProvider(service.url, max_retries=2, backoff=0.01).distances(lat, lon, lat, lon)
+    assert len(service.requests) == 3
+
+
+def test_an_interrupted_matrix_resumes_from_the_progress_file(service, tmp_path):
+    lat, lon = points(6)
+    progress_path = str(tmp_path / "tiles.jsonl")
+    service.failing_source = [round(lon[4], 6), round(lat[4], 6)]
+
+    with raises(ConnectionError):
+        OSRMTableProvider(service.url, max_table_size=4, max_retries=0,
+                          progress_path=progress_path).distances(lat, lon, lat, lon)
+    assert len(service.requests) == 9
+
+    service.requests, service.failing_source = [], None
+    values = OSRMTableProvider(service.url, max_table_size=4, progress_path=progress_path).distances(lat, lon,
+                                                                                                     lat, lon)
+    assert len(service.requests) == 3
+    assert allclose(values, haversine_distances(lat, lon, lat, lon), rtol=1e-4)
@@ -0,0 +1,26 @@
+from numpy import float32, int64, memmap
+from pandas import DataFrame
+from pytest import raises
+
+from optimal_loc.results import ResultStore
+
+
+def test_runs_round_trip_through_the_result_store(tmp_path):
+    store = ResultStore(str(tmp_path))
+    supply_data = DataFrame({"supply_hexagon_id": ["872a30661ffffff", "872a30660ffffff"],
+                             "served_events": [3, 7], "mean_distance": [0.5, 1.5]})
+    optimal_data = DataFrame({"hexagon_id": ["a", "b", "c"], "hex_lat": [40.0, 40.1, 40.2]})
+
+    first = store.save({"supply_data": supply_data}, {"number_of_loc": int64(2), "objective": float32(1.5)})
+    second = store.save({"supply_data": supply_data, "optimal_data": optimal_data}, {"number_of_loc": 3},
+                        run_id="night")
+    store.save({"supply_data": supply_data.iloc[:1]}, {"number_of_loc": 1}, run_id="night")
+
+    assert store.run_ids() == [first, second]
+    assert store.runs()["number_of_loc"].tolist() == [2, 1]
+    assert store.load(first).metadata == {"number_of_loc": 2, "objective": 1.5}
+    assert store.load(first).supply_data.equals(supply_data)
+    assert store.load().tables == ["supply_data"]
+    assert isinstance(store.load(first).column("supply_data", "served_events"), memmap)
+    with raises(ValueError):
+        store.load("day")
@@ -0,0 +1,81 @@
+from numpy import isfinite
+
+from optimal_loc.distances import DistanceMatrix
+from optimal_loc.store import DistanceStore
+
+from conftest import RESOLUTION, area, frequency_data
+
+
+class CountingCollection:
+    """A minimal in-memory MongoDB collection which counts the pairs it is asked for and sends back."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requested_pairs = 0
+        self.returned_pairs = 0
+
+    def find(self, query, projection=None, batch_size=None):
+        from_hexagons, to_hexagons = set(query["fromhex"]["$in"]), set(query["tohex"]["$in"])
+        self.requested_pairs += len(from_hexagons) * len(to_hexagons)
+        found = [{field: document[field] for field in projection if projection[field]}
+                 for document in self.documents
+                 if document["resolution"] == query["resolution"] and document["fromhex"] in from_hexagons
+                 and document["tohex"] in to_hexagons]
+        self.returned_pairs += len(found)
+        return iter(found)
+
+
+def test_fill_only_requests_the_pairs_of_new_hexagons(tmp_path):
+    hexagons = area()
+    old, added = hexagons[:-2], hexagons[-2:]
+    full = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION)
+    collection = CountingCollection([{"resolution": RESOLUTION, "fromhex": from_hexagon, "tohex": to_hexagon,
+                                      "distance": float(full.values[i, j])}
+                                     for i, from_hexagon in enumerate(hexagons)
+                                     for j, to_hexagon in enumerate(hexagons)])
+    store = DistanceStore(str(tmp_path / "distances.sqlite"), collection)
+
+    store.fill(DistanceMatrix.from_frequency_data(frequency_data(old), RESOLUTION, None), RESOLUTION)
+    collection.requested_pairs = collection.returned_pairs = 0
+
+    matrix = DistanceMatrix.from_frequency_data(frequency_data(old + added), RESOLUTION, None)
+    found = store.fill(matrix, RESOLUTION)
+
+    n_missing = len(hexagons) ** 2 - len(old) ** 2
+    assert found.all()
+    assert collection.requested_pairs == n_missing
+    assert collection.returned_pairs == n_missing
+    assert isfinite(matrix.values).all()
+    assert (matrix.reindex(hexagons, hexagons).values == full.values).all()
+    store.close()
+
+
+def test_fill_remembers_the_pairs_the_collection_does_not_hold(tmp_path):
+    hexagons = area()
+    old = hexagons[:-2]
+    full = DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION)
+    # An externally filled collection, without the distance of a hexagon to itself.
+    collection = CountingCollection([{"resolution": RESOLUTION, "fromhex": from_hexagon, "tohex": to_hexagon,
+                                      "distance": float(full.values[i, j])}
+                                     for i, from_hexagon in enumerate(hexagons)
+                                     for j, to_hexagon in enumerate(hexagons) if i != j])
+    store = DistanceStore(str(tmp_path / "distances.sqlite"), collection)
+
+    first = store.fill(DistanceMatrix.from_frequency_data(frequency_data(old), RESOLUTION, None), RESOLUTION)
+    assert collection.requested_pairs == len(old) ** 2
+    assert first.sum() == len(old) ** 2 - len(old)
+
+    collection.requested_pairs = collection.returned_pairs = 0
+    second = store.fill(DistanceMatrix.from_frequency_data(frequency_data(old), RESOLUTION, None), RESOLUTION)
+    assert collection.requested_pairs == 0
+    assert (second == first).all()
+
+    third = store.fill(DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION, None), RESOLUTION)
+    assert collection.requested_pairs == len(hexagons) ** 2 - len(old) ** 2
+    assert third.sum() == len(hexagons) ** 2 - len(hexagons)
+
+    store.forget_missing()
+    collection.requested_pairs = 0
+    store.fill(DistanceMatrix.from_frequency_data(frequency_data(hexagons), RESOLUTION, None), RESOLUTION)
+    assert collection.requested_pairs > 0
+    store.close()
@@ -0,0 +1,22 @@
+from pytest import raises
+
+from optimal_loc.indexing import event_frequency_table
+from optimal_loc.streaming import HexagonCounter
+
+from conftest import events
+
+
+def test_merged_chunk_counts_equal_the_counts_of_all_events():
+    raw_data = events()
+    first, second = raw_data.iloc[:1200], raw_data.iloc[1200:]
+    expected = event_frequency_table(raw_data, 8)
+
+    counter = HexagonCounter(8).consume([first.iloc[:500], first.iloc[500:].to_numpy()])
+    other = HexagonCounter(8).update((second["latitude"].to_numpy(), second["longitude"].to_numpy()))
+    frame = counter.merge(other).to_frame()
+
+    assert counter.total_events == len(raw_data)
+    counts = dict(zip(frame["hexagon_id"], frame["total_event"]))
+    assert counts == dict(zip(expected["hexagon_id"], expected["total_event"]))
+    with raises(ValueError):
+        counter.merge(HexagonCounter(7))